@@ -0,0 +1,181 @@
+"""Admission control for expensive routes.
+
+A pool admits at most ``limit`` requests at a time in this process. The
+rest wait in a bounded queue, taking turns per user, so one person
+submitting a batch of quotes does not hold everyone else up; requests
+that do not say whose they are wait together, limited only by the size
+of the queue. A request is turned away with 503 and a Retry-After
+header when the queue or its user's share of it is full, or when it has
+waited ``max_wait`` seconds, rather than tying up a worker indefinitely.
+
+Routes that are not gated never wait behind gated ones as long as the
+worker has threads left, so run gunicorn with threaded workers
+(--threads) and keep the pool limits below the thread count.
+"""
+import math
+import time
+import logging
+import threading
+import functools
+from collections import deque
+
+from metrics import ADMISSION_ACTIVE, ADMISSION_QUEUED, ADMISSION_WAIT_SECONDS, ADMISSION_REJECTED
+
+# Starting estimate of how long a request holds its slot, used for
+# Retry-After until real requests have been timed
+INITIAL_HOLD_SECONDS = 1.0
+
+
+class Rejected(Exception):
+    """A request turned away by an admission pool; ``retry_after`` is in whole seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("key", "event", "admitted")
+
+    def __init__(self, key):
+        self.key = key
+        self.event = threading.Event()
+        self.admitted = False
+
+
+class AdmissionPool:
+    """Bounded concurrency for one class of requests, with a fair waiting queue.
+
+    Waiting requests are grouped by key (the user), and a freed slot goes
+    to the oldest request of the next user in turn, so users are served
+    round-robin and each user's requests in order. Requests with the key
+    None share a turn and are only limited by ``queue_size``. A slot is handed
+    straight from the request releasing it to the one admitted, so a new
+    arrival cannot jump the queue.
+    """
+
+    def __init__(self, name, limit, queue_size, user_queue_size, max_wait):
+        self.name = name
+        self.limit = max(1, limit)
+        self.queue_size = queue_size
+        self.user_queue_size = user_queue_size
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        # Waiting requests per key, and the keys with waiting requests in
+        # the order their next request gets a slot
+        self._queues = {}
+        self._turns = deque()
+        self._hold_seconds = INITIAL_HOLD_SECONDS
+        self._publish()
+
+    def acquire(self, key):
+        """Wait for a slot. Returns the seconds waited, or raises Rejected."""
+        started = time.monotonic()
+        with self._lock:
+            if self._active < self.limit and not self._queued:
+                self._active += 1
+                self._publish()
+                ADMISSION_WAIT_SECONDS.observe(0, pool=self.name)
+                return 0.0
+            queue = self._queues.get(key)
+            if self._queued >= self.queue_size:
+                raise self._reject("queue_full", "The server is busy.")
+            if key is not None and queue is not None and len(queue) >= self.user_queue_size:
+                raise self._reject("user_queue_full", "You already have requests waiting.")
+            waiter = _Waiter(key)
+            if queue is None:
+                queue = self._queues[key] = deque()
+                self._turns.append(key)
+            queue.append(waiter)
+            self._queued += 1
+            self._publish()
+
+        waiter.event.wait(self.max_wait)
+        with self._lock:
+            if not waiter.admitted:
+                self._remove(waiter)
+                self._publish()
+                raise self._reject("timeout", "The server is busy.")
+        waited = time.monotonic() - started
+        ADMISSION_WAIT_SECONDS.observe(waited, pool=self.name)
+        if waited > 1:
+            logging.debug("Admitted %s request for %s after %.1f s", self.name, key, waited)
+        return waited
+
+    def release(self, held_seconds):
+        """Free a slot, handing it to the next waiting request if there is one."""
+        with self._lock:
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held_seconds
+            if self._turns:
+                key = self._turns.popleft()
+                queue = self._queues[key]
+                waiter = queue.popleft()
+                self._queued -= 1
+                if queue:
+                    self._turns.append(key)
+                else:
+                    del self._queues[key]
+                waiter.admitted = True
+                waiter.event.set()
+            else:
+                self._active -= 1
+            self._publish()
+
+    def _remove(self, waiter):
+        queue = self._queues[waiter.key]
+        queue.remove(waiter)
+        self._queued -= 1
+        if not queue:
+            del self._queues[waiter.key]
+            self._turns.remove(waiter.key)
+
+    def _reject(self, reason, message):
+        # Roughly the time for the requests ahead to finish
+        retry_after = max(1, math.ceil(self._hold_seconds * (self._queued + 1) / self.limit))
+        ADMISSION_REJECTED.inc(pool=self.name, reason=reason)
+        logging.info("Rejected %s request (%s), %s active, %s queued", self.name, reason, self._active, self._queued)
+        return Rejected(f"{message} Please try again shortly.", retry_after)
+
+    def _publish(self):
+        ADMISSION_ACTIVE.set(self._active, pool=self.name)
+        ADMISSION_QUEUED.set(self._queued, pool=self.name)
+
+
+def admission_controlled(pool_name, key=None):
+    """Gate a Flask view on the app's admission pool ``pool_name``.
+
+    Pools are kept in app.extensions["admission"]. ``key`` returns the
+    user of the current request; requests without one share the pool's
+    queue, as behind a proxy every client has the same address. A
+    streamed response keeps its slot until it has been sent.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            from flask import current_app, jsonify
+
+            pool = current_app.extensions["admission"][pool_name]
+            user = (key() if key is not None else None) or None
+            try:
+                pool.acquire(user)
+            except Rejected as e:
+                response = jsonify({"error": str(e)})
+                response.status_code = 503
+                response.headers["Retry-After"] = str(e.retry_after)
+                return response
+
+            started = time.monotonic()
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            except BaseException:
+                pool.release(time.monotonic() - started)
+                raise
+            if response.is_streamed:
+                response.call_on_close(lambda: pool.release(time.monotonic() - started))
+            else:
+                pool.release(time.monotonic() - started)
+            return response
+        return wrapper
+    return decorator
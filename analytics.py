@@ -0,0 +1,458 @@
+"""Sales rollups: quote counts, footage and revenue per day by Area,
+QuotedBy, product and rail colour.
+
+The sales_rollups table holds one row per (dimension, day, key), so a
+report reads at most one row per day and key in its date range however
+many quotes are stored. Quote writes update the rows they touch in the
+same transaction. Writes that bypass the rollups (such as the
+quote_store.py import command) show up in the quote change log, and the
+next report rebuilds the table from a full scan, vectorized with NumPy
+when it is installed.
+
+Amounts follow calculate_totals: a quote's subtotal, GST, total and
+deposit are each rounded up to the cent and stored as whole cents, so
+adding and removing quotes is exact. Product and rail colour rows hold
+the amounts of the product lines of that product or colour, each line
+rounded the same way on its own.
+
+Usage:
+  python analytics.py [--db PATH] rebuild [--no-numpy]
+  python analytics.py [--db PATH] report [--group-by area] [--from 2025-01-01] [--to 2025-12-31] [--interval month]
+"""
+import re
+import json
+import math
+import time
+import logging
+import argparse
+from array import array
+
+from quote_store import SQLiteQuoteStore
+from quote_pricing import GST_RATE
+
+# Quote-level dimensions and the quote field each is read from
+QUOTE_DIMENSIONS = {"area": "Area", "quoted_by": "QuotedBy"}
+# Dimensions read from each product line, in the order of quote_lines' keys
+LINE_DIMENSIONS = ("product", "rail_color")
+# Dimensions a report can be grouped by
+DIMENSIONS = ("area", "quoted_by", "product", "rail_color")
+# Dimension of the overall totals, stored under the key ""
+ALL = "all"
+# SQL expression of the period each interval groups by
+INTERVALS = {None: "''", "day": "day", "month": "substr(day, 1, 7)"}
+# Quote fields read by a rebuild; RailColor and the last four hold the
+# single product of quotes saved before multiple products
+SCANNED_FIELDS = ("QuoteDate", "Area", "QuotedBy", "RailColor", "Products", "Product", "Footage", "PricePerFt", "LineTotal")
+# Quotes aggregated per columnar batch during a rebuild
+REBUILD_BATCH_SIZE = 20000
+# Change-log sequence number the rollups are current with
+META_KEY = "sales_rollups_seq"
+
+_DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+# Keys are grouped case-insensitively; SQLite's NOCASE folds ASCII letters only
+_FOLD = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _text(value):
+    return str(value).strip() if value is not None else ""
+
+
+def _cents(subtotal):
+    """Subtotal, GST, total and deposit in cents, rounded up like calculate_totals."""
+    gst = subtotal * GST_RATE
+    total = subtotal + gst
+    return math.ceil(subtotal * 100), math.ceil(gst * 100), math.ceil(total * 100), math.ceil(total / 2 * 100)
+
+
+def quote_lines(data):
+    """((product, rail colour), footage, line_total) of each product line in stored quote data.
+
+    Quotes saved before multiple products keep their one product in
+    top-level fields, with the colour in RailColor; lines without a Color
+    of their own take that too. Lines whose total cannot be worked out are
+    left out.
+    """
+    rail_color = _text(data.get("RailColor"))
+    products = data.get("Products")
+    if not isinstance(products, list):
+        products = [data] if data.get("Product") is not None else []
+    lines = []
+    for product in products:
+        if not isinstance(product, dict):
+            continue
+        footage = _number(product.get("Footage", 0))
+        line_total = _number(product.get("LineTotal"))
+        if line_total is None:
+            price_per_ft = _number(product.get("PricePerFt", 0))
+            if footage is None or price_per_ft is None:
+                continue
+            line_total = footage * price_per_ft
+        color = _text(product["Color"]) if "Color" in product else rail_color
+        lines.append(((_text(product.get("Product")), color), footage or 0.0, line_total))
+    return lines
+
+
+def quote_row(data):
+    """(day, quote-level keys, product lines) of stored quote data."""
+    day = _text(data.get("QuoteDate"))
+    if not _DATE_PATTERN.match(day):
+        day = ""
+    keys = [(ALL, "")] + [(dimension, _text(data.get(field))) for dimension, field in QUOTE_DIMENSIONS.items()]
+    return day, keys, quote_lines(data)
+
+
+def contributions(data):
+    """The amounts a quote adds to each rollup row.
+
+    Returns {(dimension, folded key, day): [key, quotes, footage,
+    subtotal, gst, total, deposit]}, amounts in cents.
+    """
+    if data is None:
+        return {}
+    day, keys, lines = quote_row(data)
+    footage = sum(line[1] for line in lines)
+    cents = _cents(sum(line[2] for line in lines))
+    rows = {}
+    for dimension, key in keys:
+        rows[(dimension, key.translate(_FOLD), day)] = [key, 1, footage, *cents]
+    for line_keys, line_footage, line_total in lines:
+        line_cents = _cents(line_total)
+        for dimension, key in zip(LINE_DIMENSIONS, line_keys):
+            # A product or colour on several lines of one quote counts that quote once
+            row = rows.setdefault((dimension, key.translate(_FOLD), day), [key, 1, 0.0, 0, 0, 0, 0])
+            row[2] += line_footage
+            for i, value in enumerate(line_cents, start=3):
+                row[i] += value
+    return rows
+
+
+class SalesRollups:
+    """Pre-aggregated sales totals in the quote store's database."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def is_current(self, conn=None):
+        conn = conn or self.store.conn
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (META_KEY,)).fetchone()
+        last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM quote_changes").fetchone()[0]
+        return row is not None and row["value"] == str(last_seq)
+
+    def record(self, conn, previous, entry):
+        """Update the rollups for a quote write made in ``conn``'s open transaction.
+
+        Call it right after the quote row is written or deleted, with the
+        entry that was replaced (or None) and the entry written (None for a
+        delete). Returns False, writing nothing, if the rollups were already
+        out of date; the next report rebuilds them.
+        """
+        last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM quote_changes").fetchone()[0]
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (META_KEY,)).fetchone()
+        # The write just made must be the only change since they were current
+        if row is None or row["value"] != str(last_seq - 1):
+            return False
+
+        old = contributions(previous["data"] if previous else None)
+        new = contributions(entry["data"] if entry else None)
+        for group in old.keys() | new.keys():
+            before = old.get(group)
+            after = new.get(group)
+            if before == after:
+                continue
+            before = before or [None, 0, 0.0, 0, 0, 0, 0]
+            after = after or [None, 0, 0.0, 0, 0, 0, 0]
+            dimension, _, day = group
+            key = after[0] if after[0] is not None else before[0]
+            delta = [a - b for a, b in zip(after[1:], before[1:])]
+            conn.execute(
+                """
+                INSERT INTO sales_rollups
+                    (dimension, day, key, quotes, footage, subtotal_cents, gst_cents, total_cents, deposit_cents)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(dimension, day, key) DO UPDATE SET
+                    quotes = quotes + excluded.quotes,
+                    footage = footage + excluded.footage,
+                    subtotal_cents = subtotal_cents + excluded.subtotal_cents,
+                    gst_cents = gst_cents + excluded.gst_cents,
+                    total_cents = total_cents + excluded.total_cents,
+                    deposit_cents = deposit_cents + excluded.deposit_cents
+                """,
+                (dimension, day, key, *delta),
+            )
+            if delta[0] < 0:
+                conn.execute(
+                    "DELETE FROM sales_rollups WHERE dimension = ? AND day = ? AND key = ? AND quotes <= 0",
+                    (dimension, day, key),
+                )
+        self._mark_current(conn, last_seq)
+        return True
+
+    def _mark_current(self, conn, last_seq):
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (META_KEY, str(last_seq)),
+        )
+
+    def _scan(self, conn):
+        """Yield the fields of every stored quote that the rollups read."""
+        # With several paths json_extract parses the body once and returns
+        # the values as a JSON array
+        paths = ", ".join(f"'$.data.{field}'" for field in SCANNED_FIELDS)
+        for row in conn.execute(f"SELECT json_extract(body, {paths}) FROM quotes"):
+            yield {field: value for field, value in zip(SCANNED_FIELDS, json.loads(row[0])) if value is not None}
+
+    def rebuild(self, use_numpy=True):
+        """Recompute the rollups from every stored quote. Returns the number of quotes scanned.
+
+        Writers wait for the rebuild, so no quote write is missed.
+        """
+        numpy = _import_numpy() if use_numpy else None
+        started = time.perf_counter()
+        with self.store.transaction() as conn:
+            if numpy is not None:
+                count, rows = self._aggregate_columnar(self._scan(conn), numpy)
+            else:
+                count, rows = self._aggregate(self._scan(conn))
+            conn.execute("DELETE FROM sales_rollups")
+            conn.executemany(
+                """
+                INSERT INTO sales_rollups
+                    (dimension, day, key, quotes, footage, subtotal_cents, gst_cents, total_cents, deposit_cents)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+            self._mark_current(conn, conn.execute("SELECT COALESCE(MAX(seq), 0) FROM quote_changes").fetchone()[0])
+        logging.info(
+            "Rebuilt sales rollups from %s quotes in %.2f s (%s)",
+            count, time.perf_counter() - started, "numpy" if numpy is not None else "python",
+        )
+        return count
+
+    def _aggregate(self, quotes):
+        totals = {}
+        count = 0
+        for data in quotes:
+            count += 1
+            for group, row in contributions(data).items():
+                total = totals.get(group)
+                if total is None:
+                    totals[group] = row
+                else:
+                    for i in range(1, 7):
+                        total[i] += row[i]
+        rows = [(group[0], group[2], row[0], *row[1:]) for group, row in totals.items()]
+        return count, rows
+
+    def _aggregate_columnar(self, quotes, np):
+        """_aggregate with the amounts summed per row group by numpy.bincount.
+
+        Quotes are read into flat columns a batch at a time, so memory
+        depends on the batch size and the number of row groups, not on
+        the number of quotes.
+        """
+        groups = {}
+        seen_keys = {}
+        labels = []
+        sums = [np.zeros(0) for _ in range(6)]
+
+        def group_id(dimension, key, day):
+            # Keys seen before skip the case folding
+            gid = seen_keys.get((dimension, key, day))
+            if gid is None:
+                group = (dimension, key.translate(_FOLD), day)
+                gid = groups.get(group)
+                if gid is None:
+                    gid = groups[group] = len(labels)
+                    labels.append((dimension, day, key))
+                seen_keys[(dimension, key, day)] = gid
+            return gid
+
+        def add_batch(quote_groups, line_quote, line_group, line_first, line_footage, line_total, count):
+            per_quote = 1 + len(QUOTE_DIMENSIONS)
+            # line_group and line_first hold an entry per line dimension of each line
+            per_line = len(LINE_DIMENSIONS)
+            line_quote = np.asarray(line_quote, dtype=np.int64)
+            line_footage = np.asarray(line_footage, dtype=np.float64)
+            line_total = np.asarray(line_total, dtype=np.float64)
+            # Sums run in line order, as sum() does, so totals round the same
+            quote_subtotal = np.bincount(line_quote, weights=line_total, minlength=count)
+            quote_footage = np.bincount(line_quote, weights=line_footage, minlength=count)
+            quote_cents = self._cents_columns(np, quote_subtotal)
+            line_cents = self._cents_columns(np, line_total)
+
+            group = np.concatenate([np.asarray(quote_groups, dtype=np.int64), np.asarray(line_group, dtype=np.int64)])
+            columns = [
+                np.concatenate([np.ones(count * per_quote), np.asarray(line_first, dtype=np.float64)]),
+                np.concatenate([np.repeat(quote_footage, per_quote), np.repeat(line_footage, per_line)]),
+            ] + [
+                np.concatenate([np.repeat(quote_column, per_quote), np.repeat(line_column, per_line)])
+                for quote_column, line_column in zip(quote_cents, line_cents)
+            ]
+            size = len(labels)
+            for i, column in enumerate(columns):
+                counted = np.bincount(group, weights=column, minlength=size)
+                sums[i] = np.concatenate([sums[i], np.zeros(size - len(sums[i]))]) + counted
+
+        count = 0
+        batch = None
+        for data in quotes:
+            if batch is None:
+                batch = (array("q"), array("q"), array("q"), array("d"), array("d"), array("d"))
+                batch_count = 0
+            quote_groups, line_quote, line_group, line_first, line_footage, line_total = batch
+            day, keys, lines = quote_row(data)
+            for dimension, key in keys:
+                quote_groups.append(group_id(dimension, key, day))
+            seen = set()
+            for line_keys, footage, total in lines:
+                line_quote.append(batch_count)
+                line_footage.append(footage)
+                line_total.append(total)
+                for dimension, key in zip(LINE_DIMENSIONS, line_keys):
+                    gid = group_id(dimension, key, day)
+                    line_group.append(gid)
+                    line_first.append(0.0 if gid in seen else 1.0)
+                    seen.add(gid)
+            batch_count += 1
+            count += 1
+            if batch_count >= REBUILD_BATCH_SIZE:
+                add_batch(*batch, batch_count)
+                batch = None
+        if batch is not None:
+            add_batch(*batch, batch_count)
+
+        rows = [
+            (dimension, day, key, int(round(sums[0][gid])), float(sums[1][gid]), *(int(round(sums[i][gid])) for i in range(2, 6)))
+            for gid, (dimension, day, key) in enumerate(labels)
+        ]
+        return count, rows
+
+    @staticmethod
+    def _cents_columns(np, subtotal):
+        # The same float operations as _cents, element-wise
+        gst = subtotal * GST_RATE
+        total = subtotal + gst
+        return np.ceil(subtotal * 100), np.ceil(gst * 100), np.ceil(total * 100), np.ceil(total / 2 * 100)
+
+    def ensure_current(self):
+        """Rebuild the rollups if a quote write bypassed them."""
+        if self.is_current():
+            return
+        with self.store.transaction() as conn:
+            # Another worker may have rebuilt them while this one waited
+            if self.is_current(conn):
+                return
+            self.rebuild()
+
+    def report(self, group_by=None, date_from=None, date_to=None, interval=None):
+        """Totals per key of ``group_by`` and per ``interval``, for quotes dated from..to inclusive.
+
+        ``group_by`` is one of DIMENSIONS, or None for overall totals;
+        ``interval`` is "day", "month" or None. Quotes without a valid
+        QuoteDate only count when no date range is given. Raises ValueError
+        for an unknown dimension or interval or a date not in YYYY-MM-DD form.
+        """
+        if group_by is not None and group_by not in DIMENSIONS:
+            raise ValueError(f"group_by must be one of: {', '.join(DIMENSIONS)}.")
+        if interval not in INTERVALS:
+            raise ValueError("interval must be day or month.")
+        for value in (date_from, date_to):
+            if value is not None and not _DATE_PATTERN.match(value):
+                raise ValueError("Dates must be in YYYY-MM-DD format.")
+        self.ensure_current()
+
+        def query(dimension, interval):
+            where = ["dimension = ?"]
+            params = [dimension]
+            if date_from is not None:
+                where.append("day >= ?")
+                params.append(date_from)
+            if date_to is not None:
+                where.append("day <= ?")
+                params.append(date_to)
+            rows = self.store.conn.execute(
+                f"""
+                SELECT key, {INTERVALS[interval]} AS period, SUM(quotes) AS quotes, SUM(footage) AS footage,
+                    SUM(subtotal_cents) AS subtotal, SUM(gst_cents) AS gst,
+                    SUM(total_cents) AS total, SUM(deposit_cents) AS deposit
+                FROM sales_rollups
+                WHERE {' AND '.join(where)}
+                GROUP BY key, period
+                ORDER BY period, total DESC, key
+                """,
+                params,
+            ).fetchall()
+            results = []
+            for row in rows:
+                result = {"key": row["key"]} if dimension != ALL else {}
+                if interval is not None:
+                    result["period"] = row["period"]
+                result.update({
+                    "quotes": row["quotes"],
+                    "footage": round(row["footage"], 2),
+                    "subtotal": row["subtotal"] / 100,
+                    "gst": row["gst"] / 100,
+                    "total": row["total"] / 100,
+                    "deposit": row["deposit"] / 100,
+                })
+                results.append(result)
+            return results
+
+        totals = query(ALL, None)
+        return {
+            "group_by": group_by,
+            "interval": interval,
+            "date_from": date_from,
+            "date_to": date_to,
+            "rows": query(group_by or ALL, interval),
+            "totals": totals[0] if totals else {
+                "quotes": 0, "footage": 0, "subtotal": 0, "gst": 0, "total": 0, "deposit": 0,
+            },
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query the sales rollups.")
+    parser.add_argument("--db", default="/persistent/quotes.db", help="Path to the SQLite quote store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="Recompute the rollups from every quote")
+    rebuild_parser.add_argument("--no-numpy", action="store_true", help="Aggregate in pure Python")
+    report_parser = subparsers.add_parser("report", help="Print a report as JSON")
+    report_parser.add_argument("--group-by", choices=DIMENSIONS)
+    report_parser.add_argument("--from", dest="date_from")
+    report_parser.add_argument("--to", dest="date_to")
+    report_parser.add_argument("--interval", choices=("day", "month"))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    rollups = SalesRollups(SQLiteQuoteStore(args.db))
+    if args.command == "rebuild":
+        count = rollups.rebuild(use_numpy=not args.no_numpy)
+        print(f"Rebuilt sales rollups from {count} quotes")
+    elif args.command == "report":
+        try:
+            report = rollups.report(args.group_by, args.date_from, args.date_to, args.interval)
+        except ValueError as e:
+            parser.error(str(e))
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
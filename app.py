@@ -1,216 +1,460 @@
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Blueprint, Flask, current_app, render_template, request, url_for, send_file, jsonify, Response, stream_with_context
+from werkzeug.local import LocalProxy
 from werkzeug.utils import secure_filename
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
+from urllib.parse import unquote
 import os
-import json
-import re
+import sys
 import logging
-import math
-import zipfile
+import json
+import base64
+import time
 import io
-
-# Configure logging with detailed output
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-
-app = Flask(__name__)
-base_dir = os.path.abspath(os.path.dirname(__file__))
-
-# Hardcode persistent disk paths
-UPLOAD_FOLDER = "/persistent/uploads"
-PDF_OUTPUT_FOLDER = "/persistent/pdfs"
-QUOTE_STORE_PATH = "/persistent/quote_data.json"
-
-# Static images are in the app directory
-IMAGES_FOLDER = os.path.join(base_dir, "static", "images")
-
-# Define paths to static images
-LOGO_PATH = os.path.join(IMAGES_FOLDER, "logo.png")
-CHBA_LOGO_PATH = os.path.join(IMAGES_FOLDER, "CHB.png")
-WCB_LOGO_PATH = os.path.join(IMAGES_FOLDER, "wcb.png")
-VISA_LOGO_PATH = os.path.join(IMAGES_FOLDER, "visa.png")
-AMEX_LOGO_PATH = os.path.join(IMAGES_FOLDER, "amex_logo.png")
-MASTERCARD_LOGO_PATH = os.path.join(IMAGES_FOLDER, "mastercard_logo.png")
-
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['SECRET_KEY'] = 'secret'
-
-# Ensure folders exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(PDF_OUTPUT_FOLDER, exist_ok=True)
-logging.debug(f"Upload folder: {UPLOAD_FOLDER}, exists: {os.path.exists(UPLOAD_FOLDER)}")
-logging.debug(f"PDF output folder: {PDF_OUTPUT_FOLDER}, exists: {os.path.exists(PDF_OUTPUT_FOLDER)}")
-logging.debug(f"Quote store path: {QUOTE_STORE_PATH}, exists: {os.path.exists(QUOTE_STORE_PATH)}")
+import tempfile
+import threading
+import itertools
+from quote_store import SQLiteQuoteStore, import_legacy_store
+from quote_history import QuoteHistory
+from analytics import SalesRollups
+from quote_search import QuoteSearchIndex
+from quote_pricing import parse_products
+from quote_bulk import iter_export_lines, read_lines, import_lines
+from render_cache import RenderCache, quote_render_key, cache_filename
+from blob_store import BlobStore, quote_blob_names, is_upload_name
+from upload_sessions import UploadSessions, UploadError, ALLOWED_EXTENSIONS
+from admission import AdmissionPool, admission_controlled
+from zip_stream import iter_zip, unique_arcnames
+from quote_bundle import iter_bundle, select_quotes
+from metrics import registry, instrument_app, span, timed_iter, IMAGE_BYTES
+
+# Settings; each can be overridden by an environment variable of the same
+# name or by the config passed to create_app
+DEFAULT_CONFIG = {
+    # Hardcode persistent disk paths
+    "UPLOAD_FOLDER": "/persistent/uploads",
+    "PDF_OUTPUT_FOLDER": "/persistent/pdfs",
+    "QUOTE_DB_PATH": "/persistent/quotes.db",
+    # Legacy whole-file store, imported once into QUOTE_DB_PATH
+    "QUOTE_STORE_PATH": "/persistent/quote_data.json",
+    # Rendered PDFs are kept per content hash up to this many megabytes
+    "PDF_CACHE_MAX_MB": 2048,
+    "RENDER_WORKERS": 2,
+    # Largest request body; /api/import streams its body and is exempt
+    "MAX_REQUEST_MB": 160,
+    # Largest photo, and largest chunk of one sent to /uploads
+    "UPLOAD_MAX_MB": 25,
+    "UPLOAD_CHUNK_MB": 4,
+    # Unfinished or unused uploads are removed after this many hours
+    "UPLOAD_EXPIRE_HOURS": 24,
+    # /submit, /download_all_pdfs and /print_bundle running at once per worker process; more
+    # wait, taking turns per QuotedBy, in a queue of ADMISSION_QUEUE_SIZE
+    # (ADMISSION_USER_QUEUE per user) for up to ADMISSION_MAX_WAIT seconds,
+    # and are answered 503 beyond that
+    "ADMISSION_RENDER_LIMIT": 2,
+    "ADMISSION_QUEUE_SIZE": 16,
+    "ADMISSION_USER_QUEUE": 4,
+    "ADMISSION_MAX_WAIT": 15,
+    # Versions kept per quote; 0 keeps the whole history
+    "HISTORY_KEEP_VERSIONS": 0,
+    # PROFILING=1 lets single requests be profiled with X-Profile: 1 or ?_profile=1
+    "PROFILING": False,
+    "PROFILE_FOLDER": "/persistent/profiles",
+    # TRAFFIC_CAPTURE=1 appends a sanitized record of every request to
+    # TRAFFIC_CAPTURE_PATH, for benchmarks/replay.py
+    "TRAFFIC_CAPTURE": False,
+    "TRAFFIC_CAPTURE_PATH": "/persistent/traffic.jsonl",
+    # LOG_LEVEL=DEBUG gives the detailed output
+    "LOG_LEVEL": "INFO",
+    "SECRET_KEY": "secret",
+}
+
+bp = Blueprint("quotes", __name__)
+# Only registered when profiling is enabled
+debug_bp = Blueprint("debug", __name__)
+
+def load_config(overrides=None):
+    """DEFAULT_CONFIG updated from the environment, then from overrides."""
+    config = dict(DEFAULT_CONFIG)
+    for key, default in DEFAULT_CONFIG.items():
+        value = os.environ.get(key)
+        if value is None:
+            continue
+        if isinstance(default, bool):
+            config[key] = value == "1"
+        elif isinstance(default, int):
+            config[key] = int(value)
+        else:
+            config[key] = value
+    config.update(overrides or {})
+    return config
+
+class Services:
+    """The quote store and everything built on it, created on first use.
+
+    Opening the database, importing the legacy store and starting the
+    render dispatcher all touch the persistent disk, so they wait for the
+    first request that needs them rather than running when app.py is
+    imported.
+    """
+
+    def __init__(self, config):
+        from render_jobs import RenderQueue
+
+        upload_folder = config["UPLOAD_FOLDER"]
+        pdf_folder = config["PDF_OUTPUT_FOLDER"]
+        os.makedirs(upload_folder, exist_ok=True)
+        os.makedirs(pdf_folder, exist_ok=True)
+        logging.debug("Upload folder: %s", upload_folder)
+        logging.debug("PDF output folder: %s", pdf_folder)
+        logging.debug("Quote store path: %s", config["QUOTE_DB_PATH"])
+
+        self.quote_store = SQLiteQuoteStore(config["QUOTE_DB_PATH"])
+        import_legacy_store(self.quote_store, config["QUOTE_STORE_PATH"])
+        self.quote_history = QuoteHistory(self.quote_store, keep=config["HISTORY_KEEP_VERSIONS"] or None)
+        self.blob_store = BlobStore(self.quote_store, upload_folder)
+        self.upload_sessions = UploadSessions(
+            self.quote_store, self.blob_store,
+            max_bytes=config["UPLOAD_MAX_MB"] * 1024 * 1024,
+            expire_seconds=config["UPLOAD_EXPIRE_HOURS"] * 3600,
+        )
+        # Rebuilt by the first report if quotes were written without updating them
+        self.sales_rollups = SalesRollups(self.quote_store)
+        # Built on the first search, then kept current from the store's change log
+        self.search_index = QuoteSearchIndex()
+        self.render_cache = RenderCache(
+            self.quote_store, pdf_folder, max_bytes=config["PDF_CACHE_MAX_MB"] * 1024 * 1024
+        )
+        self.render_queue = RenderQueue(
+            self.quote_store, pdf_folder, upload_folder,
+            workers=config["RENDER_WORKERS"],
+            cache=self.render_cache,
+        )
+        # Pick up jobs left queued or interrupted by a previous run
+        self.render_queue.start()
+
+_services_lock = threading.Lock()
+
+def services():
+    """Services of the current app, created by the first request that needs them."""
+    app = current_app._get_current_object()
+    svc = app.extensions.get("quote_services")
+    if svc is None:
+        with _services_lock:
+            svc = app.extensions.get("quote_services")
+            if svc is None:
+                svc = app.extensions["quote_services"] = Services(app.config)
+    return svc
+
+quote_store = LocalProxy(lambda: services().quote_store)
+quote_history = LocalProxy(lambda: services().quote_history)
+blob_store = LocalProxy(lambda: services().blob_store)
+upload_sessions = LocalProxy(lambda: services().upload_sessions)
+sales_rollups = LocalProxy(lambda: services().sales_rollups)
+search_index = LocalProxy(lambda: services().search_index)
+render_cache = LocalProxy(lambda: services().render_cache)
+render_queue = LocalProxy(lambda: services().render_queue)
+
+# Evaluated on scrape, inside the /metrics request
+registry.gauge("quote_store_bytes", "Size of the quote database files.", function=lambda: quote_store.file_size())
+registry.gauge("quote_store_quotes", "Quotes in the quote store.", function=lambda: quote_store.count())
+registry.gauge("quote_history_bytes", "Size of stored quote versions.", function=lambda: quote_history.total_size())
+registry.gauge("quote_blob_bytes", "Size of stored images.", function=lambda: blob_store.total_size())
+registry.gauge("quote_pdf_cache_bytes", "Size of cached PDFs.", function=lambda: render_cache.total_size())
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ['png', 'jpg', 'jpeg', 'gif']
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def get_existing_image(filename):
     """Validate if an image file exists in the upload folder."""
     if filename:
-        path = os.path.join(UPLOAD_FOLDER, filename)
+        if not is_upload_name(filename):
+            logging.error("Rejected image path outside the upload folder: %s", filename)
+            return None
+        path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         if os.path.exists(path):
-            logging.debug(f"Image found: {path}")
+            logging.debug("Image found: %s", path)
             return filename
         else:
-            logging.error(f"Image not found: {path}")
+            logging.error("Image not found: %s", path)
     return None
 
 def check_quote_exists(quote_id):
-    """Check if a quote_id already exists in quote_data.json."""
-    if os.path.exists(QUOTE_STORE_PATH):
-        with open(QUOTE_STORE_PATH, "r") as f:
-            try:
-                quotes = json.load(f)
-                return any(quote["id"] == quote_id for quote in quotes)
-            except json.JSONDecodeError:
-                logging.error("Failed to parse quote_data.json")
-    return False
-
-def save_quote_version(quote_data, quote_id, is_update=False):
-    """Save or update quote in quote_data.json."""
-    entry = {
-        "id": quote_id,
-        "data": quote_data,
-        "is_generated": True,  # Mark as generated
-        "version": 2 if is_update else 1  # Track version
+    """Check if a quote_id already exists in the quote store."""
+    return quote_store.exists(quote_id)
+
+def quote_fields(data):
+    """Submitted form fields that belong to the quote itself.
+
+    Drops the request flags and the raw product and image inputs, which are
+    stored as Products and Images.
+    """
+    return {
+        key: value
+        for key, value in data.items()
+        if key not in ("quoteId", "is_update")
+        and not key.endswith(("_existing", "_photo"))
+        and not key.startswith("Products[")
     }
 
-    existing = []
-    if os.path.exists(QUOTE_STORE_PATH):
-        with open(QUOTE_STORE_PATH, "r") as f:
-            try:
-                existing = json.load(f)
-            except json.JSONDecodeError:
-                existing = []
-
-    # Update existing quote if quote_id exists, otherwise append
-    updated = False
-    for i, quote in enumerate(existing):
-        if quote["id"] == quote_id:
-            existing[i] = entry
-            updated = True
-            break
-    if not updated:
-        existing.append(entry)
-
-    with open(QUOTE_STORE_PATH, "w") as f:
-        json.dump(existing, f, indent=2)
-
-    logging.debug(f"Saved quote with ID: {quote_id}, Images: {quote_data.get('Images', {})}, Version: {entry['version']}")
-    return quote_id
-
-def draw_header(c, width, height):
-    logo_height = 50
-    logo_width = 100
-    small_logo_width = 80
-    small_logo_height = 40
-    payment_logo_width = 50
-    payment_logo_height = 30
+def save_quote_version(quote_data, quote_id):
+    """Save quote data as the next version of a quote. Returns the version number."""
+    # The quote, its history and the image reference counts change in one
+    # transaction
+    with quote_store.transaction() as conn:
+        previous = quote_store.get(quote_id)
+        version = quote_history.append(conn, quote_id, previous, quote_data)
+        entry = {
+            "id": quote_id,
+            "data": quote_data,
+            "is_generated": True,  # Mark as generated
+            "version": version,
+        }
+        quote_store.upsert(entry)
+        sales_rollups.record(conn, previous, entry)
+        blob_store.update_refs(conn, quote_blob_names(previous), quote_blob_names(entry))
+    if search_index.is_built:
+        search_index.sync(quote_store)
+
+    logging.debug("Saved quote with ID: %s, Images: %s, Version: %s", quote_id, quote_data.get('Images', {}), version)
+    return version
+
+def pdf_filename_for(client_name, client_address, versioned=False):
+    """Build the quote_<name>_<street>.pdf filename for a quote."""
+    safe_name = "".join(c for c in client_name if c.isalnum() or c in (' ', '_')).rstrip().replace(' ', '_')
+    safe_address = ""
+    if client_address:
+        address_parts = client_address.split(',')[0].split()
+        if address_parts:
+            safe_address = "".join(c for c in address_parts[0] if c.isalnum()).rstrip()
 
-    try:
-        if os.path.exists(LOGO_PATH):
-            c.drawImage(LOGO_PATH, 40, height - 60, width=logo_width, height=logo_height, preserveAspectRatio=True)
-        else:
-            logging.error(f"Home Rail logo file not found at: {LOGO_PATH}")
-    except Exception as e:
-        logging.error(f"Could not load Home Rail logo: {e}")
+    pdf_filename = f"quote_{safe_name}"
+    if safe_address:
+        pdf_filename += f"_{safe_address}"
+    if versioned:
+        pdf_filename += "_version_2"
+    return pdf_filename + ".pdf"
 
-    try:
-        if os.path.exists(CHBA_LOGO_PATH):
-            c.drawImage(CHBA_LOGO_PATH, 220, height - 60, width=small_logo_width, height=small_logo_height, preserveAspectRatio=True)
-        else:
-            logging.error(f"CHBA logo file not found at: {CHBA_LOGO_PATH}")
-    except Exception as e:
-        logging.error(f"Could not load CHBA logo: {e}")
+def encode_cursor(summary):
+    """Encode the (QuoteDate, id) paging key of a summary as an opaque cursor."""
+    key = json.dumps([summary["QuoteDate"], summary["id"]])
+    return base64.urlsafe_b64encode(key.encode("utf-8")).decode("ascii")
 
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor, or return None if it is invalid."""
     try:
-        if os.path.exists(WCB_LOGO_PATH):
-            c.drawImage(WCB_LOGO_PATH, 310, height - 60, width=small_logo_width, height=small_logo_height, preserveAspectRatio=True)
-        else:
-            logging.error(f"WCB logo file not found at: {WCB_LOGO_PATH}")
-    except Exception as e:
-        logging.error(f"Could not load WCB logo: {e}")
+        quote_date, quote_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(quote_date, str) or not isinstance(quote_id, str):
+        return None
+    return quote_date, quote_id
 
-    try:
-        if os.path.exists(VISA_LOGO_PATH):
-            c.drawImage(VISA_LOGO_PATH, 430, height - 50, width=payment_logo_width, height=payment_logo_height, preserveAspectRatio=True)
-        else:
-            logging.error(f"Visa logo file not found at: {VISA_LOGO_PATH}")
-    except Exception as e:
-        logging.error(f"Could not load Visa logo: {e}")
+@bp.route('/')
+def index():
+    # The quote list is fetched page by page from /api/quotes
+    return render_template('index.html')
 
+@bp.route('/api/quotes', methods=['GET'])
+def list_quotes():
     try:
-        if os.path.exists(AMEX_LOGO_PATH):
-            c.drawImage(AMEX_LOGO_PATH, 490, height - 50, width=payment_logo_width, height=payment_logo_height, preserveAspectRatio=True)
-        else:
-            logging.error(f"Amex logo file not found at: {AMEX_LOGO_PATH}")
-    except Exception as e:
-        logging.error(f"Could not load Amex logo: {e}")
+        limit = min(max(int(request.args.get("limit", 50)), 1), 200)
+    except ValueError:
+        return jsonify({"error": "limit must be a number."}), 400
+
+    after = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        after = decode_cursor(cursor)
+        if after is None:
+            return jsonify({"error": "Invalid cursor."}), 400
+
+    # Fetch one extra row to know whether another page exists
+    summaries = quote_store.list_summaries(limit=limit + 1, after=after)
+    next_cursor = None
+    if len(summaries) > limit:
+        summaries = summaries[:limit]
+        next_cursor = encode_cursor(summaries[-1])
+    return jsonify({"quotes": summaries, "next_cursor": next_cursor})
+
+@bp.route('/api/quotes/<quote_id>', methods=['GET'])
+def get_quote(quote_id):
+    quote = quote_store.get(quote_id)
+    if quote is None:
+        return jsonify({"error": "Quote not found."}), 404
 
+    images = quote["data"].get("Images", {})
+    for key in images:
+        images[key] = get_existing_image(images[key])
+    quote["data"]["Images"] = images
+    # Set defaults for older quotes
+    quote["is_generated"] = quote.get("is_generated", False)
+    quote["version"] = quote.get("version", 1)
+    return jsonify(quote)
+
+@bp.route('/api/quotes/<quote_id>/versions', methods=['GET'])
+def list_quote_versions(quote_id):
+    versions = quote_history.versions(quote_id)
+    if not versions and not quote_store.exists(quote_id):
+        return jsonify({"error": "Quote not found."}), 404
+    return jsonify({"quote_id": quote_id, "versions": versions})
+
+@bp.route('/api/quotes/<quote_id>/versions/<int:version>', methods=['GET'])
+def get_quote_version(quote_id, version):
+    quote = quote_store.get(quote_id)
+    if quote is not None and quote.get("version", 1) == version:
+        # The latest version is the stored quote
+        data = quote["data"]
+    else:
+        data = quote_history.get_version(quote_id, version)
+    if data is None:
+        return jsonify({"error": "Version not found."}), 404
+    return jsonify({"id": quote_id, "version": version, "data": data})
+
+@bp.route('/api/export', methods=['GET'])
+def export_quotes():
+    """Stream every quote as NDJSON, one entry per line."""
+    return Response(
+        stream_with_context(timed_iter(iter_export_lines(quote_store), "store_read")),
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=quotes.ndjson"},
+    )
+
+@bp.route('/api/import', methods=['POST'])
+def import_quotes():
+    """Import an NDJSON request body as produced by /api/export.
+
+    ?skip_existing=1 leaves quotes that already exist unchanged. Lines that
+    fail validation are skipped and listed in the response.
+    """
+    def progress(report):
+        logging.debug("Import: %s lines read, %s quotes imported", report.lines, report.imported)
+
+    # The body is read line by line, never whole, so MAX_REQUEST_MB does not
+    # apply. (None would fall back to the app-wide limit.)
+    request.max_content_length = sys.maxsize
+    # Buffered, so lines are not read from the socket a byte at a time
+    stream = io.BufferedReader(request.stream, buffer_size=64 * 1024)
+    with span("store_write"):
+        report = import_lines(
+            quote_store, read_lines(stream),
+            history=quote_history,
+            blob_store=blob_store,
+            rollups=sales_rollups,
+            skip_existing=request.args.get("skip_existing") == "1",
+            progress=progress,
+        )
+    if search_index.is_built:
+        search_index.sync(quote_store)
+    logging.info("Imported %s quotes from %s lines, %s errors", report.imported, report.lines, report.error_count)
+    return jsonify(report.as_dict())
+
+@bp.route('/reports', methods=['GET'])
+def sales_report():
+    """Sales totals from the pre-aggregated rollups.
+
+    ?group_by=area|quoted_by|product|rail_color, ?interval=day|month and
+    ?date_from= / ?date_to= (YYYY-MM-DD, inclusive) are all optional.
+    """
     try:
-        if os.path.exists(MASTERCARD_LOGO_PATH):
-            c.drawImage(MASTERCARD_LOGO_PATH, 550, height - 50, width=payment_logo_width, height=payment_logo_height, preserveAspectRatio=True)
-        else:
-            logging.error(f"MasterCard logo file not found at: {MASTERCARD_LOGO_PATH}")
-    except Exception as e:
-        logging.error(f"Could not load MasterCard logo: {e}")
-
-    c.setFont("Helvetica-Bold", 14)
-    c.drawCentredString(width / 2, height - 120, "Home Rail – Quote Summary")
-
-def wrap_text(c, text, max_width, font_name, font_size):
-    c.setFont(font_name, font_size)
-    words = text.split()
-    lines = []
-    current_line = []
-    current_width = 0
-
-    for word in words:
-        word_width = c.stringWidth(word + " ", font_name, font_size)
-        if current_width + word_width <= max_width:
-            current_line.append(word)
-            current_width += word_width
-        else:
-            lines.append(" ".join(current_line))
-            current_line = [word]
-            current_width = c.stringWidth(word + " ", font_name, font_size)
-    if current_line:
-        lines.append(" ".join(current_line))
+        with span("store_read"):
+            report = sales_rollups.report(
+                group_by=request.args.get("group_by", "").strip() or None,
+                date_from=request.args.get("date_from", "").strip() or None,
+                date_to=request.args.get("date_to", "").strip() or None,
+                interval=request.args.get("interval", "").strip() or None,
+            )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(report)
+
+@bp.route('/search', methods=['GET'])
+def search_quotes():
+    query = request.args.get("q", "").strip()
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 100)
+    except ValueError:
+        return jsonify({"error": "limit must be a number."}), 400
+
+    started = time.perf_counter()
+    search_index.sync(quote_store)
+    results = search_index.search(query, limit=limit)
+    took_ms = (time.perf_counter() - started) * 1000
+    logging.debug("Search for %r returned %s results in %.2f ms", query, len(results), took_ms)
+    return jsonify({"query": query, "results": results, "took_ms": round(took_ms, 3)})
+
+@bp.errorhandler(UploadError)
+def upload_error(e):
+    body = {"error": str(e)}
+    if e.offset is not None:
+        body["offset"] = e.offset
+    return jsonify(body), e.status
+
+@bp.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": f"Request is larger than {request.max_content_length // (1024 * 1024)} MB."}), 413
+
+@bp.route('/uploads', methods=['POST'])
+def create_upload():
+    """Start a resumable photo upload from JSON {"filename", "size", "sha256" (optional)}.
+
+    The photo is then sent with PATCH /uploads/<upload_id> in chunks of at
+    most chunk_size bytes, and its photo_id passed to /submit as
+    <field>_photo.
+    """
+    body = request.get_json(silent=True) or {}
+    status = upload_sessions.create(body.get("filename"), body.get("size"), body.get("sha256"))
+    status["chunk_size"] = current_app.config["UPLOAD_CHUNK_MB"] * 1024 * 1024
+    return jsonify(status), 201
+
+@bp.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Bytes received so far; a client resumes an interrupted upload from "offset"."""
+    return jsonify(upload_sessions.status(upload_id))
+
+@bp.route('/uploads/<upload_id>', methods=['PATCH'])
+def append_upload(upload_id):
+    """Append the request body to an upload at the Upload-Offset header."""
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+    except ValueError:
+        return jsonify({"error": "Upload-Offset header must be a number of bytes."}), 400
+    request.max_content_length = current_app.config["UPLOAD_CHUNK_MB"] * 1024 * 1024
+    with span("image_save"):
+        status = upload_sessions.append(upload_id, offset, request.stream)
+    if status["complete"]:
+        IMAGE_BYTES.inc(status["size"])
+    return jsonify(status)
+
+@bp.route('/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    upload_sessions.cancel(upload_id)
+    return jsonify({"success": True})
 
-    return lines
+def submitting_user():
+    """Fairness key of a quote form: who it is quoted by.
 
-@app.route('/')
-def index():
-    quotes = []
-    if os.path.exists(QUOTE_STORE_PATH):
-        with open(QUOTE_STORE_PATH, "r") as f:
-            try:
-                quotes = json.load(f)
-            except json.JSONDecodeError:
-                quotes = []
-        for quote in quotes:
-            images = quote["data"].get("Images", {})
-            for key in images:
-                images[key] = get_existing_image(images[key])
-            quote["data"]["Images"] = images
-            # Set defaults for older quotes
-            quote["is_generated"] = quote.get("is_generated", False)
-            quote["version"] = quote.get("version", 1)
-    logging.debug(f"Loaded quotes: {len(quotes)}")
-    return render_template('index.html', quotes=quotes)
-
-@app.route('/submit', methods=['POST'])
+    The page sends QuotedBy in the X-Quoted-By header (URI-encoded), as
+    reading the form would parse the whole upload before a slot is granted.
+    """
+    return unquote(request.headers.get("X-Quoted-By", "")).strip().lower()
+
+@bp.route('/submit', methods=['POST'])
+@admission_controlled("render", key=submitting_user)
 def submit_quote():
-    data = {k: request.form.get(k, '').strip() for k in request.form}
+    with span("form_parse"):
+        data = {k: request.form.get(k, '').strip() for k in request.form}
+        # Product errors are reported after the client name checks below
+        try:
+            products = parse_products(request.form)
+            products_error = None
+        except ValueError as e:
+            products, products_error = None, str(e)
     client_name = data.get("ClientName")
-    client_address = data.get("Address")
     quote_id = data.get("quoteId", "")
     is_update = data.get("is_update", "") == "true"
-    
-    logging.debug(f"Form data received: {data}")
-    logging.debug(f"Request files: {list(request.files.keys())}")
+
+    # Field names only: the values are customer details
+    logging.debug("Form fields received: %s", list(data))
+    logging.debug("Request files: %s", list(request.files.keys()))
 
     if not client_name:
         return jsonify({"error": "Client name is required."}), 400
@@ -218,114 +462,66 @@ def submit_quote():
     # Use sanitized client_name as base quote_id
     base_quote_id = "".join(c for c in client_name if c.isalnum() or c in (' ', '_')).rstrip().replace(' ', '_')
     if is_update:
-        quote_id = f"{base_quote_id}_version_2"
+        # Updates become the next version of the quote being edited
+        quote_id = quote_id or base_quote_id
     else:
         quote_id = base_quote_id if not quote_id else quote_id
 
     # Check for duplicate quote_id for new quotes
-    if not is_update and check_quote_exists(base_quote_id):
-        return jsonify({"error": f"Quote for '{client_name}' already exists. Use 'Update Quote' to create a new version."}), 400
+    if not is_update:
+        with span("store_read"):
+            duplicate = check_quote_exists(base_quote_id)
+        if duplicate:
+            return jsonify({"error": f"Quote for '{client_name}' already exists. Use 'Update Quote' to create a new version."}), 400
 
     # Process multiple products
-    products = []
-    product_pattern = re.compile(r'Products\[(\d+)\]\[(\w+)\]')
-    product_dict = {}
-    
-    for key, value in request.form.items():
-        match = product_pattern.match(key)
-        if match:
-            index, field = match.groups()
-            if index not in product_dict:
-                product_dict[index] = {}
-            product_dict[index][field] = value.strip()
-
-    for index in sorted(product_dict.keys()):
-        product = product_dict[index]
-        try:
-            footage = float(product.get("Footage", 0))
-            price_per_ft = float(product.get("PricePerFt", 0))
-            line_total = footage * price_per_ft
-            products.append({
-                "Product": product.get("Product", ""),
-                "Color": product.get("Color", ""),
-                "Footage": footage,
-                "PricePerFt": price_per_ft,
-                "LineTotal": line_total
-            })
-        except ValueError:
-            return jsonify({"error": f"Footage and Price for product {index} must be valid numbers."}), 400
+    if products_error:
+        return jsonify({"error": products_error}), 400
 
     if not products:
         return jsonify({"error": "At least one product is required."}), 400
 
-    gst_rate = 0.05
-    subtotal = sum(product["LineTotal"] for product in products)
-    gst = subtotal * gst_rate
-    total = subtotal + gst
-    deposit = total / 2
-
-    def round_up_to_2_decimals(value):
-        return math.ceil(value * 100) / 100
-
-    subtotal_rounded = round_up_to_2_decimals(subtotal)
-    gst_rounded = round_up_to_2_decimals(gst)
-    total_rounded = round_up_to_2_decimals(total)
-    deposit_rounded = round_up_to_2_decimals(deposit)
-
-    for product in products:
-        product["LineTotalRounded"] = round_up_to_2_decimals(product["LineTotal"])
-
-    def save_uploaded_image(field_name, quote_id, suffix):
+    def save_uploaded_image(field_name):
         file = request.files.get(field_name)
         if file and allowed_file(file.filename):
             ext = secure_filename(file.filename).rsplit('.', 1)[1].lower()
-            filename = f"{quote_id}_{suffix}.{ext}"
-            path = os.path.join(UPLOAD_FOLDER, filename)
             try:
-                file.save(path)
-                if os.path.exists(path):
-                    logging.debug(f"Successfully saved image: {path}")
-                    return filename
-                else:
-                    logging.error(f"Failed to save image: {path} does not exist after save")
-                    return None
+                # Identical photos resolve to the same stored blob
+                with span("image_save"):
+                    filename = blob_store.put_stream(
+                        file.stream, ext, max_bytes=current_app.config["UPLOAD_MAX_MB"] * 1024 * 1024
+                    )
+                IMAGE_BYTES.inc(os.path.getsize(blob_store.path(filename)))
+                logging.debug("Successfully saved image for %s: %s", field_name, filename)
+                return filename
+            except ValueError as e:
+                raise UploadError(str(e), 413)
             except Exception as e:
-                logging.error(f"Error saving image {field_name}: {e}")
+                logging.error("Error saving image %s: %s", field_name, e)
                 return None
         else:
-            logging.debug(f"No file or invalid file for {field_name}")
+            logging.debug("No file or invalid file for %s", field_name)
         return None
 
-    image_fields = [
-        ('fileUpload', 'primary'),
-        ('extraImage1', 'extra1'),
-        ('extraImage2', 'extra2'),
-        ('extraImage3', 'extra3'),
-        ('extraImage4', 'extra4'),
-        ('extraImage5', 'extra5')
-    ]
+    image_fields = ['fileUpload', 'extraImage1', 'extraImage2', 'extraImage3', 'extraImage4', 'extraImage5']
 
     images_data = {}
     # Load existing quote data if quote_id exists
     existing_images = {}
-    if os.path.exists(QUOTE_STORE_PATH):
-        with open(QUOTE_STORE_PATH, "r") as f:
-            try:
-                quotes = json.load(f)
-                for quote in quotes:
-                    if quote["id"] == quote_id or (is_update and quote["id"] == base_quote_id):
-                        existing_images = quote["data"].get("Images", {})
-                        break
-            except json.JSONDecodeError:
-                logging.error("Failed to parse quote_data.json")
-    logging.debug(f"Existing images from quote_data.json: {existing_images}")
-
-    for field, suffix in image_fields:
-        # Check for new upload first
-        new_filename = save_uploaded_image(field, quote_id, suffix)
+    with span("store_read"):
+        existing_quote = quote_store.get(quote_id)
+    if existing_quote is not None:
+        existing_images = existing_quote["data"].get("Images", {})
+    logging.debug("Existing images from quote store: %s", existing_images)
+
+    for field in image_fields:
+        # Check for new upload first, then for a photo sent to /uploads beforehand
+        new_filename = save_uploaded_image(field)
+        if not new_filename and data.get(f"{field}_photo"):
+            new_filename = upload_sessions.photo(data[f"{field}_photo"])
         if new_filename:
             images_data[field] = new_filename
-            logging.debug(f"New image uploaded for {field}: {new_filename}")
+            logging.debug("New image uploaded for %s: %s", field, new_filename)
         else:
             # Use existing filename from form data
             existing_filename = data.get(f"{field}_existing")
@@ -333,442 +529,292 @@ def submit_quote():
                 validated_filename = get_existing_image(existing_filename)
                 if validated_filename:
                     images_data[field] = validated_filename
-                    logging.debug(f"Using form-provided existing image for {field}: {validated_filename}")
+                    logging.debug("Using form-provided existing image for %s: %s", field, validated_filename)
                 else:
-                    logging.debug(f"Form-provided existing image not found for {field}: {existing_filename}")
-                    # Fallback to quote_data.json if form-provided filename is invalid
+                    logging.debug("Form-provided existing image not found for %s: %s", field, existing_filename)
+                    # Fallback to the quote store if form-provided filename is invalid
                     existing_filename = existing_images.get(field)
                     if existing_filename:
                         validated_filename = get_existing_image(existing_filename)
                         if validated_filename:
                             images_data[field] = validated_filename
-                            logging.debug(f"Using quote_data.json image for {field}: {validated_filename}")
+                            logging.debug("Using stored image for %s: %s", field, validated_filename)
                         else:
-                            logging.debug(f"quote_data.json image not found for {field}: {existing_filename}")
+                            logging.debug("Stored image not found for %s: %s", field, existing_filename)
                             images_data[field] = None
                     else:
                         images_data[field] = None
-                        logging.debug(f"No existing image for {field}")
+                        logging.debug("No existing image for %s", field)
             else:
-                # Fallback to quote_data.json if no form-provided filename
+                # Fallback to the quote store if no form-provided filename
                 existing_filename = existing_images.get(field)
                 if existing_filename:
                     validated_filename = get_existing_image(existing_filename)
                     if validated_filename:
                         images_data[field] = validated_filename
-                        logging.debug(f"Using quote_data.json image for {field}: {validated_filename}")
+                        logging.debug("Using stored image for %s: %s", field, validated_filename)
                     else:
-                        logging.debug(f"quote_data.json image not found for {field}: {existing_filename}")
+                        logging.debug("Stored image not found for %s: %s", field, existing_filename)
                         images_data[field] = None
                 else:
                     images_data[field] = None
-                    logging.debug(f"No existing image for {field}")
+                    logging.debug("No existing image for %s", field)
 
     data["Images"] = images_data
     data["Products"] = products
-    quote_id = save_quote_version(data, quote_id, is_update=is_update)
-
-    safe_name = "".join(c for c in client_name if c.isalnum() or c in (' ', '_')).rstrip().replace(' ', '_')
-    safe_address = ""
-    if client_address:
-        address_parts = client_address.split(',')[0].split()
-        if address_parts:
-            safe_address = "".join(c for c in address_parts[0] if c.isalnum()).rstrip()
-    
-    pdf_filename = f"quote_{safe_name}"
-    if safe_address:
-        pdf_filename += f"_{safe_address}"
-    if is_update:
-        pdf_filename += "_version_2"
-    pdf_filename += ".pdf"
-    
-    pdf_path = os.path.join(PDF_OUTPUT_FOLDER, pdf_filename)
-
-    c = canvas.Canvas(pdf_path, pagesize=letter)
-    width, height = letter
-
-    logging.debug(f"Generating PDF at: {pdf_path}")
-    logging.debug(f"Static images folder: {IMAGES_FOLDER}")
-    logging.debug(f"Home Rail Logo path: {LOGO_PATH}, exists: {os.path.exists(LOGO_PATH)}")
-    logging.debug(f"CHBA Logo path: {CHBA_LOGO_PATH}, exists: {os.path.exists(CHBA_LOGO_PATH)}")
-    logging.debug(f"WCB Logo path: {WCB_LOGO_PATH}, exists: {os.path.exists(WCB_LOGO_PATH)}")
-    logging.debug(f"Visa Logo path: {VISA_LOGO_PATH}, exists: {os.path.exists(VISA_LOGO_PATH)}")
-    logging.debug(f"Amex Logo path: {AMEX_LOGO_PATH}, exists: {os.path.exists(AMEX_LOGO_PATH)}")
-    logging.debug(f"MasterCard Logo path: {MASTERCARD_LOGO_PATH}, exists: {os.path.exists(MASTERCARD_LOGO_PATH)}")
-
-    draw_header(c, width, height)
-
-    y = height - 140
-    c.setFont("Helvetica", 8)
-
-    section1 = [
-        "5520-4th Street SE",
-        "Calgary, Alberta",
-        "T2H 1K7"
-    ]
-    section2 = [
-        "Our Regular Office Hours:",
-        "Monday – Friday: 8:00 am to 4:30pm",
-        "Closed: Saturdays & Sundays",
-        "Pickups before 4:00"
-    ]
-    section3 = [
-        "Web: www.home-rail.com",
-        "Phone: (403) 202-5493",
-        "Toll Free: 1-844-402-5493",
-        "Warehouse: (587) 317-6052"
-    ]
-    section4 = [
-        "Accounting: (587) 320-1116",
-        "Scheduling: (587) 320-1117",
-        "Sales: (587) 320-1118"
-    ]
-
-    section_width = 125
-    x_positions = [50, 175, 300, 425]
-
-    y_temp = y
-    for line in section1:
-        line_width = c.stringWidth(line, "Helvetica", 8)
-        c.drawString(x_positions[0] + (section_width - line_width) / 2, y_temp, line)
-        y_temp -= 9
-
-    y_temp = y
-    for line in section2:
-        line_width = c.stringWidth(line, "Helvetica", 8)
-        c.drawString(x_positions[1] + (section_width - line_width) / 2, y_temp, line)
-        y_temp -= 9
-
-    y_temp = y
-    for line in section3:
-        line_width = c.stringWidth(line, "Helvetica", 8)
-        c.drawString(x_positions[2] + (section_width - line_width) / 2, y_temp, line)
-        y_temp -= 9
-
-    y_temp = y
-    for line in section4:
-        line_width = c.stringWidth(line, "Helvetica", 8)
-        c.drawString(x_positions[3] + (section_width - line_width) / 2, y_temp, line)
-        y_temp -= 9
-
-    y = height - 190
-    c.setFont("Helvetica-Bold", 11)
-    c.drawString(50, y, "Basic Information")
-    y -= 5
-    c.line(50, y, 550, y)
-    y -= 15
-
-    info_fields = [
-        ("Name", data.get("ClientName")),
-        ("Phone", data.get("Phone")),
-        ("Email", data.get("Email")),
-        ("Address", data.get("Address")),
-        ("Area", data.get("Area")),
-        ("Date", data.get("QuoteDate")),
-        ("Quoted By", data.get("QuotedBy")),
-        ("Install Type", data.get("InstallType")),
-        ("Lead Time", data.get("LeadTime")),
-    ]
-
-    for label, val in info_fields:
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(55, y, f"{label}:")
-        label_width = c.stringWidth(f"{label}:", "Helvetica-Bold", 10)
-        c.setFont("Helvetica", 10)
-        c.drawString(55 + label_width + 5, y, f"{val}")
-        y -= 15
-
-    install_notes = data.get("InstallNotes", "")
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(55, y, "Install Notes:")
-    label_width = c.stringWidth("Install Notes:", "Helvetica-Bold", 10)
-    y -= 15
-
-    if install_notes:
-        c.setFont("Helvetica", 10)
-        max_width = 490
-        lines = wrap_text(c, install_notes, max_width, "Helvetica", 10)
-        for line in lines:
-            c.drawString(55, y, line)
-            y -= 15
+    with span("store_write"):
+        version = save_quote_version(quote_fields(data), quote_id)
+
+    # Unchanged quotes reuse the PDF already rendered for the same content
+    key = quote_render_key(data, current_app.config['UPLOAD_FOLDER'])
+    if render_cache.lookup(key):
+        logging.debug("PDF for quote %s is unchanged, skipping render", quote_id)
+        job_id = render_queue.record_done(quote_id, cache_filename(key))
+        status, status_code = "done", 200
     else:
-        c.drawString(55, y, "")
-        y -= 15
-
-    y -= 10
-    remaining_space_needed = (
-        20 +
-        80 +
-        60
-    )
-
-    c.setFont("Helvetica-Bold", 11)
-    c.drawString(50, y, "Quote Details")
-    y -= 5
-    c.line(50, y, 550, y)
-    y -= 20
-
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(50, y, "Product")
-    c.drawString(250, y, "Color")
-    c.drawString(350, y, "Footage")
-    c.drawString(420, y, "Price/FT")
-    c.drawString(490, y, "Line Total")
-    y -= 20
-
-    c.setFont("Helvetica", 10)
-    first_page = True
-    for product in products:
-        space_needed = 20 + remaining_space_needed
-        if y < space_needed:
-            c.showPage()
-            draw_header(c, width, height)
-            y = height - 150
-            c.setFont("Helvetica-Bold", 11)
-            c.drawString(50, y, "Quote Details (Continued)")
-            y -= 5
-            c.line(50, y, 550, y)
-            y -= 20
-            c.setFont("Helvetica-Bold", 10)
-            c.drawString(50, y, "Product")
-            c.drawString(250, y, "Color")
-            c.drawString(350, y, "Footage")
-            c.drawString(420, y, "Price/FT")
-            c.drawString(490, y, "Line Total")
-            y -= 20
-            c.setFont("Helvetica", 10)
-            first_page = False
-
-        c.drawString(50, y, product["Product"])
-        c.drawString(250, y, product["Color"])
-        c.drawString(350, y, str(product["Footage"]))
-        c.drawString(420, y, f"${product['PricePerFt']:.2f}")
-        c.drawString(490, y, f"${product['LineTotalRounded']:.2f}")
-        y -= 20
-
-    y -= 20
-    c.setFont("Helvetica-Bold", 10)
-    right_edge = 550
-    financial_fields = [
-        ("Subtotal:", f"${subtotal_rounded:.2f}"),
-        ("GST (5%):", f"${gst_rounded:.2f}"),
-        ("Total:", f"${total_rounded:.2f}"),
-        ("Deposit:", f"${deposit_rounded:.2f}")
-    ]
-
-    for label, value in financial_fields:
-        c.drawString(350, y, label)
-        value_width = c.stringWidth(value, "Helvetica-Bold", 10)
-        c.drawString(right_edge - value_width, y, value)
-        y -= 15
-
-    y -= 40
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(50, y, "Client Signature: __________________________")
-    c.drawString(350, y, "Date: __________")
-    y -= 20
-    c.drawString(50, y, "Home Rail Rep Signature: __________________")
-    c.drawString(350, y, "Date: __________")
-
-    c.showPage()
-    y = height - 190
-
-    img_width, img_height = 230, 172.5
-    img_spacing_x, img_spacing_y = 8, 8
-    img_positions = [
-        (50, y),
-        (50 + img_width + img_spacing_x, y),
-        (50, y - img_height - img_spacing_y),
-        (50 + img_width + img_spacing_x, y - img_height - img_spacing_y),
-        (50, y - 2 * (img_height + img_spacing_y)),
-        (50 + img_width + img_spacing_x, y - 2 * (img_height + img_spacing_y))
-    ]
-
-    images = [
-        (os.path.join(UPLOAD_FOLDER, data["Images"]["fileUpload"]) if data["Images"]["fileUpload"] else None, "Primary Image"),
-        (os.path.join(UPLOAD_FOLDER, data["Images"]["extraImage1"]) if data["Images"]["extraImage1"] else None, "Extra Image 1"),
-        (os.path.join(UPLOAD_FOLDER, data["Images"]["extraImage2"]) if data["Images"]["extraImage2"] else None, "Extra Image 2"),
-        (os.path.join(UPLOAD_FOLDER, data["Images"]["extraImage3"]) if data["Images"]["extraImage3"] else None, "Extra Image 3"),
-        (os.path.join(UPLOAD_FOLDER, data["Images"]["extraImage4"]) if data["Images"]["extraImage4"] else None, "Extra Image 4"),
-        (os.path.join(UPLOAD_FOLDER, data["Images"]["extraImage5"]) if data["Images"]["extraImage5"] else None, "Extra Image 5")
-    ]
-
-    logging.debug(f"Image paths for PDF: {[img[0] for img in images if img[0]]}")
-    for i, (img_path, img_name) in enumerate(images):
-        x_pos, y_pos = img_positions[i]
-        c.setLineWidth(1)
-        c.setStrokeColor(colors.grey)
-        c.rect(x_pos, y_pos, img_width, img_height)
-        if img_path:
-            logging.debug(f"Checking image: {img_path}, exists: {os.path.exists(img_path)}")
-            if os.path.exists(img_path):
-                try:
-                    c.drawImage(img_path, x_pos, y_pos, width=img_width, height=img_height, preserveAspectRatio=True)
-                    logging.debug(f"Successfully loaded {img_name} at {img_path}")
-                except Exception as e:
-                    logging.error(f"Failed to load {img_name} at {img_path}: {e}")
+        job_id = render_queue.enqueue(quote_id, cache_filename(key))
+        status, status_code = "queued", 202
+
+    return jsonify({
+        "quote_id": quote_id,
+        "version": version,
+        "job_id": job_id,
+        "status": status,
+        "status_url": f"/jobs/{job_id}",
+        "pdf_url": f"/retrieve/{quote_id}",
+    }), status_code
+
+@bp.route('/preview', methods=['POST'])
+def preview_quote():
+    """HTML preview of the first page of the PDF that /submit would render.
+
+    Takes the same form as /submit but saves nothing: the page is drawn as
+    SVG from the static layers, and photos are shown as cached thumbnails.
+    """
+    # Imported here so the app starts without ReportLab and PIL
+    from quote_pdf import IMAGE_FIELDS, IMAGE_NAMES
+    from quote_preview import render_first_page, thumbnail_cache, thumbnail_uri
+
+    with span("form_parse"):
+        data = {k: request.form.get(k, '').strip() for k in request.form}
+        try:
+            data["Products"] = parse_products(request.form)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    stored_images = {}
+    if data.get("quoteId"):
+        with span("store_read"):
+            existing_quote = quote_store.get(data["quoteId"])
+        if existing_quote is not None:
+            stored_images = existing_quote["data"].get("Images") or {}
+
+    with span("preview"):
+        photos = []
+        for field, name in zip(IMAGE_FIELDS, IMAGE_NAMES):
+            file = request.files.get(field)
+            if file and allowed_file(file.filename):
+                # Not stored, so not cached either
+                uri = thumbnail_uri(file.stream)
             else:
-                logging.error(f"Image file not found for {img_name}: {img_path}")
-
-    y = y - 2.87 * (img_height + img_spacing_y) - 28
-    c.setFont("Helvetica", 8)
-    max_width = 490
-
-    c.drawString(50, y, "Name of Cardholder: __________________________")
-    y -= 12
-
-    auth_text = (
-        "If payment is made by credit card, I hereby authorize Home-Rail Ltd. to credit the "
-        "balance of the proposal upon completion with the above credit card. Home-Rail Ltd. "
-        "shall not be responsible for any delays resulting from strikes, fires, accidents, or "
-        "shipping/freight delays beyond its reasonable control."
-    )
-    auth_lines = wrap_text(c, auth_text, max_width, "Helvetica", 8)
-    for line in auth_lines:
-        c.drawString(50, y, line)
-        y -= 6
-    y -= 6
-
-    auth_lines = wrap_text(c, auth_text, max_width, "Helvetica", 8)
-    for line in auth_lines:
-        c.drawString(50, y, line)
-        y -= 6
-    y -= 6
-
-    accept_text = (
-        "Acceptance of Proposal – The above prices, specifications, and conditions are "
-        "satisfactory and hereby accepted. You are authorized to do the work as specified. "
-        "Payment will be as outlined above."
-    )
-    accept_lines = wrap_text(c, accept_text, max_width, "Helvetica", 8)
-    for line in accept_lines:
-        c.drawString(50, y, line)
-        y -= 6
-    y -= 6
-
-    c.setFont("Helvetica-Bold", 8)
-    c.drawString(50, y, "Signature: X___________________________")
-    c.drawString(300, y, "Date of Acceptance: ___________________")
-    y -= 6
-    c.drawString(50, y, "Signature: ____________________________")
-    c.drawString(300, y, "Date: ________________________________")
-    y -= 6
-
-    footer_y = y - 10
-    c.setFont("Helvetica-Oblique", 8)
-    quoted_by = data.get("QuotedBy") or "System"
-    c.drawString(50, footer_y, f"Home-Rail Ltd. | www.homerailltd.com | Quote Generated by {quoted_by}")
-
-    c.save()
-
-    if not os.path.exists(pdf_path):
-        logging.error(f"Failed to generate PDF at: {pdf_path}")
-        return jsonify({"error": "Failed to generate PDF."}), 500
-
-    return send_file(pdf_path, as_attachment=True)
-
-@app.route('/debug/submit', methods=['POST'])
+                if data.get(f"{field}_photo"):
+                    filename = upload_sessions.photo(data[f"{field}_photo"])
+                else:
+                    filename = get_existing_image(data.get(f"{field}_existing")) or get_existing_image(stored_images.get(field))
+                uri = thumbnail_cache.get(current_app.config['UPLOAD_FOLDER'], filename) if filename else None
+            if uri:
+                photos.append((name, uri))
+        preview = render_first_page(quote_fields(data), static_url=url_for('static', filename='images/'))
+    return render_template("quote_preview.html", preview=preview, photos=photos)
+
+@bp.route('/debug/submit', methods=['POST'])
 def debug_submit():
     data = {k: request.form.get(k, '').strip() for k in request.form}
     files = {k: request.files[k].filename for k in request.files}
-    logging.debug(f"Debug form data: {data}")
-    logging.debug(f"Debug files: {files}")
+    logging.debug("Debug form data: %s", data)
+    logging.debug("Debug files: %s", files)
     return jsonify({"form_data": data, "files": files})
 
-@app.route('/retrieve/<quote_id>', methods=['GET'])
+@bp.route('/retrieve/<quote_id>', methods=['GET'])
 def retrieve_quote(quote_id):
-    if not os.path.exists(QUOTE_STORE_PATH):
-        logging.error("Quote store not found.")
-        return jsonify({"error": "No quotes stored."}), 404
-
-    with open(QUOTE_STORE_PATH, "r") as f:
-        try:
-            quotes = json.load(f)
-        except json.JSONDecodeError:
-            logging.error("Failed to parse quote_data.json")
-            return jsonify({"error": "Failed to parse quote data."}), 500
-
-    quote_data = None
-    for quote in quotes:
-        if quote["id"] == quote_id:
-            quote_data = quote["data"]
-            break
+    with span("store_read"):
+        quote = quote_store.get(quote_id)
+    quote_data = quote["data"] if quote else None
 
     if not quote_data:
-        logging.error(f"Quote not found for ID: {quote_id}")
+        logging.error("Quote not found for ID: %s", quote_id)
         return jsonify({"error": "Quote not found."}), 404
 
-    client_name = quote_data.get("ClientName", "")
-    client_address = quote_data.get("Address", "")
-
-    safe_name = "".join(c for c in client_name if c.isalnum() or c in (' ', '_')).rstrip().replace(' ', '_')
-    safe_address = ""
-    if client_address:
-        address_parts = client_address.split(',')[0].split()
-        if address_parts:
-            safe_address = "".join(c for c in address_parts[0] if c.isalnum()).rstrip()
-
-    pdf_filename = f"quote_{safe_name}"
-    if safe_address:
-        pdf_filename += f"_{safe_address}"
-    if quote_id.endswith("_version_2"):
-        pdf_filename += "_version_2"
-    pdf_filename += ".pdf"
-
-    pdf_path = os.path.join(PDF_OUTPUT_FOLDER, pdf_filename)
+    key = quote_render_key(quote_data, current_app.config['UPLOAD_FOLDER'])
+    download_name = pdf_filename_for(
+        quote_data.get("ClientName", ""),
+        quote_data.get("Address", ""),
+        versioned=quote_id.endswith("_version_2"),
+    )
+    pdf_path = render_cache.lookup(key)
+    if pdf_path:
+        logging.debug("Retrieving PDF: %s", pdf_path)
+        # The render key doubles as the ETag, so unchanged PDFs answer 304
+        with span("file_send"):
+            return send_file(pdf_path, as_attachment=True, download_name=download_name, etag=key, max_age=0)
+
+    job = previous = render_queue.latest_for_quote(quote_id)
+    failed = job is not None and job["status"] == "failed" and job["pdf_filename"] == cache_filename(key)
+    if not failed and (job is None or job["status"] not in ("queued", "running")):
+        # Never rendered, rendered from older data or evicted from the cache
+        job = render_queue.get(render_queue.enqueue(quote_id, cache_filename(key)))
+
+    # Quotes rendered before the render cache existed keep their PDF until
+    # a render of this quote has finished
+    legacy_path = os.path.join(current_app.config['PDF_OUTPUT_FOLDER'], download_name)
+    if (previous is None or previous["status"] != "done") and os.path.exists(legacy_path):
+        logging.debug("Retrieving legacy PDF: %s", legacy_path)
+        with span("file_send"):
+            return send_file(legacy_path, as_attachment=True, download_name=download_name, max_age=0)
+
+    if failed:
+        return jsonify({"error": "PDF generation failed.", "job": job}), 500
+    # Still rendering: tell the client where to poll
+    return jsonify({"job": job, "status_url": f"/jobs/{job['id']}"}), 202
+
+@debug_bp.route('/debug/render/<quote_id>', methods=['GET'])
+def debug_render(quote_id):
+    """Render a quote in this process, so X-Profile captures the renderer."""
+    from quote_pdf import render_quote_pdf
+
+    quote = quote_store.get(quote_id)
+    if quote is None:
+        return jsonify({"error": "Quote not found."}), 404
+    fd, tmp_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        started = time.perf_counter()
+        pages = render_quote_pdf(quote["data"], tmp_path, current_app.config['UPLOAD_FOLDER'])
+        render_ms = (time.perf_counter() - started) * 1000
+        size = os.path.getsize(tmp_path)
+    finally:
+        os.remove(tmp_path)
+    return jsonify({"quote_id": quote_id, "pages": pages, "bytes": size, "render_ms": round(render_ms, 3)})
+
+@bp.route('/jobs/<int:job_id>', methods=['GET'])
+def job_status(job_id):
+    job = render_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    job["pdf_url"] = f"/retrieve/{job['quote_id']}" if job["status"] == "done" else None
+    return jsonify(job)
+
+@bp.route('/download_all_pdfs', methods=['GET'])
+@admission_controlled("render")
+def download_all_pdfs():
+    filters = {
+        "date_from": request.args.get("date_from", "").strip() or None,
+        "date_to": request.args.get("date_to", "").strip() or None,
+        "quoted_by": request.args.get("quoted_by", "").strip() or None,
+        "area": request.args.get("area", "").strip() or None,
+    }
 
-    if os.path.exists(pdf_path):
-        logging.debug(f"Retrieving PDF: {pdf_path}")
-        return send_file(pdf_path, as_attachment=True)
-    else:
-        logging.error(f"PDF not found at: {pdf_path}")
-        return jsonify({"error": "PDF not found for this quote."}), 404
+    # Latest rendered PDF of each matching quote, named after the client
+    pdf_folder = current_app.config['PDF_OUTPUT_FOLDER']
+    pdf_files = []
+    for summary in quote_store.find_summaries(**filters):
+        pdf_filename = pdf_filename_for(
+            summary["ClientName"], summary["Address"], versioned=summary["id"].endswith("_version_2")
+        )
+        job = render_queue.latest_for_quote(summary["id"])
+        if job is not None and job["status"] == "done":
+            pdf_path = os.path.join(pdf_folder, job["pdf_filename"])
+        else:
+            # Quotes rendered before the render queue existed
+            pdf_path = os.path.join(pdf_folder, pdf_filename)
+        if os.path.exists(pdf_path):
+            pdf_files.append((pdf_filename, pdf_path))
 
-@app.route('/download_all_pdfs', methods=['GET'])
-def download_all_pdfs():
-    # Create a BytesIO buffer for the zip file
-    buffer = io.BytesIO()
-    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        # Iterate through all files in PDF_OUTPUT_FOLDER
-        for filename in os.listdir(PDF_OUTPUT_FOLDER):
-            if filename.endswith('.pdf'):
-                file_path = os.path.join(PDF_OUTPUT_FOLDER, filename)
-                # Add file to zip
-                zip_file.write(file_path, filename)
-                logging.debug(f"Added {filename} to zip archive")
-
-    # Reset buffer position to start
-    buffer.seek(0)
-
-    # Check if any PDFs were added
-    if not zip_file.namelist():
+    if not pdf_files:
         logging.error("No PDFs found in the output folder.")
         return jsonify({"error": "No PDFs available to download."}), 404
 
-    logging.debug("Serving zip file with all PDFs")
-    return send_file(
-        buffer,
+    logging.debug("Streaming zip file with %s PDFs", len(pdf_files))
+    return Response(
+        stream_with_context(timed_iter(iter_zip(unique_arcnames(pdf_files)), "file_send")),
         mimetype='application/zip',
-        as_attachment=True,
-        download_name='all_quotes.zip'
+        headers={"Content-Disposition": "attachment; filename=all_quotes.zip"},
     )
 
-@app.route('/delete/<quote_id>', methods=['DELETE'])
+@bp.route('/print_bundle', methods=['GET'])
+@admission_controlled("render")
+def print_bundle():
+    """One PDF of the quotes selected like /download_all_pdfs, or of the given ids."""
+    filters = {
+        "date_from": request.args.get("date_from", "").strip() or None,
+        "date_to": request.args.get("date_to", "").strip() or None,
+        "quoted_by": request.args.get("quoted_by", "").strip() or None,
+        "area": request.args.get("area", "").strip() or None,
+    }
+    quote_ids = [quote_id for quote_id in request.args.getlist("id") if quote_id.strip()]
+    quotes = select_quotes(quote_store, quote_ids, **filters)
+    first = next(quotes, None)
+    if first is None:
+        return jsonify({"error": "No quotes match."}), 404
+
+    # Rendered as it is sent, one quote at a time
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    return Response(
+        stream_with_context(timed_iter(iter_bundle(itertools.chain([first], quotes), upload_folder), "file_send")),
+        mimetype='application/pdf',
+        headers={"Content-Disposition": "attachment; filename=quotes_bundle.pdf"},
+    )
+
+@bp.route('/delete/<quote_id>', methods=['DELETE'])
 def delete_quote(quote_id):
-    if not os.path.exists(QUOTE_STORE_PATH):
-        logging.error("Quote store not found.")
-        return jsonify({"error": "No quotes stored."}), 404
+    with span("store_write"), quote_store.transaction() as conn:
+        previous = quote_store.get(quote_id)
+        if previous is None:
+            logging.debug("Delete requested for unknown quote ID: %s", quote_id)
+        else:
+            quote_store.delete(quote_id)
+            sales_rollups.record(conn, previous, None)
+            quote_history.delete(conn, quote_id)
+            blob_store.update_refs(conn, quote_blob_names(previous), [])
+    blob_store.collect_garbage()
+    if search_index.is_built:
+        search_index.sync(quote_store)
+
+    logging.debug("Deleted quote with ID: %s", quote_id)
+    return jsonify({"success": True})
 
-    with open(QUOTE_STORE_PATH, "r") as f:
-        quotes = json.load(f)
+def create_app(config=None):
+    """Build the Flask app. Nothing is read from or written to disk until a request needs it."""
+    config = load_config(config)
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.getLogger().setLevel(config["LOG_LEVEL"].upper())
+
+    app = Flask(__name__)
+    app.config.update(config)
+    app.config["MAX_CONTENT_LENGTH"] = config["MAX_REQUEST_MB"] * 1024 * 1024
+    app.extensions["admission"] = {
+        "render": AdmissionPool(
+            "render",
+            limit=config["ADMISSION_RENDER_LIMIT"],
+            queue_size=config["ADMISSION_QUEUE_SIZE"],
+            user_queue_size=config["ADMISSION_USER_QUEUE"],
+            max_wait=config["ADMISSION_MAX_WAIT"],
+        ),
+    }
+    app.register_blueprint(bp)
+    instrument_app(app)
+    if config["PROFILING"]:
+        from profiling import enable_profiling
 
-    updated_quotes = [q for q in quotes if q["id"] != quote_id]
+        app.register_blueprint(debug_bp)
+        enable_profiling(app, config["PROFILE_FOLDER"])
+    if config["TRAFFIC_CAPTURE"]:
+        from traffic_capture import enable_capture
 
-    with open(QUOTE_STORE_PATH, "w") as f:
-        json.dump(updated_quotes, f, indent=2)
+        enable_capture(app, config["TRAFFIC_CAPTURE_PATH"])
+    return app
 
-    logging.debug(f"Deleted quote with ID: {quote_id}")
-    return jsonify({"success": True})
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -1,11 +1,15 @@
 from flask import Flask, request, jsonify, send_file, render_template
-from werkzeug.utils import secure_filename
-from pdf2image import convert_from_path
 import os
+import shutil
+import hashlib
 import logging
+import tempfile
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+from admission import AdmissionPool, admission_controlled
+from metrics import instrument_app
+
+# Configure logging; LOG_LEVEL=DEBUG gives the detailed output
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format='%(asctime)s - %(levelname)s - %(message)s')
 
 app = Flask(__name__)
 base_dir = os.path.abspath(os.path.dirname(__file__))
@@ -14,18 +18,138 @@ base_dir = os.path.abspath(os.path.dirname(__file__))
 UPLOAD_FOLDER = os.path.join(base_dir, "uploads")
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Conversion options
+OUTPUT_FORMATS = {"png": "png", "jpeg": "jpg", "jpg": "jpg", "tiff": "tif"}
+DEFAULT_DPI = 200
+MIN_DPI, MAX_DPI = 36, 600
+MAX_PAGES_PER_REQUEST = 50
+# pdftoppm processes used for a multi-page request
+CONVERT_THREADS = int(os.environ.get("CONVERT_THREADS", os.cpu_count() or 1))
+CHUNK_SIZE = 64 * 1024
+# Conversions running at once per worker process; more wait in a queue of
+# CONVERT_QUEUE_SIZE (CONVERT_USER_QUEUE per client) for up to
+# CONVERT_MAX_WAIT seconds and are answered 503 beyond that
+app.extensions["admission"] = {
+    "convert": AdmissionPool(
+        "convert",
+        limit=int(os.environ.get("CONVERT_CONCURRENCY", 1)),
+        queue_size=int(os.environ.get("CONVERT_QUEUE_SIZE", 8)),
+        user_queue_size=int(os.environ.get("CONVERT_USER_QUEUE", 2)),
+        max_wait=int(os.environ.get("CONVERT_MAX_WAIT", 30)),
+    ),
+}
+# Request timings and the admission pool's queue on /metrics
+instrument_app(app)
+
 # Ensure the uploads folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-logging.debug(f"Upload folder: {UPLOAD_FOLDER}, exists: {os.path.exists(UPLOAD_FOLDER)}")
+logging.debug("Upload folder: %s", UPLOAD_FOLDER)
 
 def allowed_pdf(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() == 'pdf'
 
+def save_upload_by_hash(file):
+    """Save an upload as pdf_<sha256>.pdf, hashing it while it is written.
+
+    Returns (sha256, path). A re-upload of the same document reuses the
+    stored copy.
+    """
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=app.config['UPLOAD_FOLDER'])
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+        sha256 = digest.hexdigest()
+        pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], f"pdf_{sha256}.pdf")
+        if not os.path.exists(pdf_path):
+            os.replace(tmp_path, pdf_path)
+        return sha256, pdf_path
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def converted_filename(sha256, page, dpi, ext):
+    """Name of one converted page; the cache key is the whole name."""
+    return f"pdf_{sha256}_p{page}_{dpi}dpi.{ext}"
+
+def parse_conversion_options(form):
+    """Read page range, format and DPI from the form. Raises ValueError with a user-facing message."""
+    try:
+        first_page = int(form.get("first_page") or 1)
+        last_page = int(form.get("last_page") or first_page)
+        dpi = int(form.get("dpi") or DEFAULT_DPI)
+    except ValueError:
+        raise ValueError("first_page, last_page and dpi must be whole numbers.")
+    if first_page < 1 or last_page < first_page:
+        raise ValueError("Invalid page range.")
+    if last_page - first_page + 1 > MAX_PAGES_PER_REQUEST:
+        raise ValueError(f"At most {MAX_PAGES_PER_REQUEST} pages can be converted at once.")
+    if not MIN_DPI <= dpi <= MAX_DPI:
+        raise ValueError(f"dpi must be between {MIN_DPI} and {MAX_DPI}.")
+    fmt = (form.get("format") or "png").lower()
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported format. Choose one of: {', '.join(sorted(OUTPUT_FORMATS))}.")
+    return first_page, last_page, dpi, fmt
+
+def convert_pages(pdf_path, sha256, first_page, last_page, dpi, fmt):
+    """Rasterize a page range straight to files in the upload folder.
+
+    Pages already converted with the same DPI and format are reused. Returns
+    the image filenames in page order; pages past the end of the document
+    are left out.
+    """
+    # Imported on first use so the app starts without loading pdf2image
+    from pdf2image import convert_from_path, pdfinfo_from_path
+
+    ext = OUTPUT_FORMATS[fmt]
+    folder = app.config['UPLOAD_FOLDER']
+    pages = range(first_page, last_page + 1)
+    filenames = [converted_filename(sha256, page, dpi, ext) for page in pages]
+    if all(os.path.exists(os.path.join(folder, name)) for name in filenames):
+        logging.debug("Using cached conversion of pages %s-%s of %s", first_page, last_page, pdf_path)
+        return filenames
+
+    page_count = pdfinfo_from_path(pdf_path)["Pages"]
+    last_page = min(last_page, page_count)
+    if first_page > last_page:
+        return []
+    filenames = filenames[:last_page - first_page + 1]
+    missing = [
+        page for page, name in zip(range(first_page, last_page + 1), filenames)
+        if not os.path.exists(os.path.join(folder, name))
+    ]
+    if missing:
+        # pdftoppm writes into a private folder; finished pages are moved
+        # into place so concurrent requests never see partial files
+        work_dir = tempfile.mkdtemp(dir=folder)
+        try:
+            paths = convert_from_path(
+                pdf_path,
+                dpi=dpi,
+                fmt=fmt,
+                first_page=missing[0],
+                last_page=missing[-1],
+                output_folder=work_dir,
+                paths_only=True,
+                thread_count=min(CONVERT_THREADS, missing[-1] - missing[0] + 1),
+            )
+            for page, path in zip(range(missing[0], missing[-1] + 1), paths):
+                os.replace(path, os.path.join(folder, converted_filename(sha256, page, dpi, ext)))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return [name for name in filenames if os.path.exists(os.path.join(folder, name))]
+
 @app.route('/pdf_converter')
 def pdf_converter():
     return render_template('pdf_converter.html')
 
 @app.route('/convert_pdf', methods=['POST'])
+@admission_controlled("convert")
 def convert_pdf():
     if 'pdfUpload' not in request.files:
         logging.error("No pdfUpload part in the request")
@@ -37,44 +161,34 @@ def convert_pdf():
         return jsonify({"error": "No file selected."}), 400
 
     if not allowed_pdf(file.filename):
-        logging.error(f"File {file.filename} is not a valid PDF")
+        logging.error("File %s is not a valid PDF", file.filename)
         return jsonify({"error": "Invalid file type. Please upload a PDF."}), 400
 
-    # Generate a unique filename
-    base_filename = secure_filename(file.filename).rsplit('.', 1)[0]
-    pdf_filename = f"{base_filename}_{os.urandom(8).hex()}.pdf"
-    pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], pdf_filename)
+    try:
+        first_page, last_page, dpi, fmt = parse_conversion_options(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # Save the PDF
+    # Save the PDF under its content hash
     try:
-        file.save(pdf_path)
-        if not os.path.exists(pdf_path):
-            logging.error(f"Failed to save PDF: {pdf_path} does not exist after save")
-            return jsonify({"error": "Failed to save PDF."}), 500
-        logging.debug(f"Successfully saved PDF: {pdf_path}")
+        sha256, pdf_path = save_upload_by_hash(file)
+        logging.debug("Successfully saved PDF: %s", pdf_path)
     except Exception as e:
-        logging.error(f"Error saving PDF: {str(e)}")
+        logging.error("Error saving PDF: %s", str(e))
         return jsonify({"error": f"Error saving PDF: {str(e)}"}), 500
 
-    # Convert PDF to image
-    image_filename = f"{base_filename}_{os.urandom(8).hex()}.png"
-    image_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-
+    # Convert only the requested pages, directly to files
     try:
-        images = convert_from_path(pdf_path, dpi=200, fmt='png')
-        if not images:
+        image_filenames = convert_pages(pdf_path, sha256, first_page, last_page, dpi, fmt)
+        if not image_filenames:
             logging.error("No images extracted from PDF")
-            return jsonify({"error": "Failed to convert PDF to image."}), 500
-        images[0].save(image_path, 'PNG')
-        if not os.path.exists(image_path):
-            logging.error(f"Converted image not found at: {image_path}")
-            return jsonify({"error": "Failed to save converted image."}), 500
-        logging.debug(f"Successfully converted PDF to image: {image_path}")
+            return jsonify({"error": "Failed to convert PDF to image. Check the page range."}), 500
+        logging.debug("Successfully converted PDF to images: %s", image_filenames)
     except Exception as e:
-        logging.error(f"PDF conversion failed: {str(e)}")
+        logging.error("PDF conversion failed: %s", str(e))
         return jsonify({"error": f"PDF conversion failed: {str(e)}"}), 500
 
-    return jsonify({"image_path": image_filename})
+    return jsonify({"image_path": image_filenames[0], "image_paths": image_filenames})
 
 @app.route('/download_image/<filename>', methods=['GET'])
 def download_image(filename):
@@ -82,7 +196,7 @@ def download_image(filename):
     if os.path.exists(image_path):
         return send_file(image_path, as_attachment=True)
     else:
-        logging.error(f"Image not found for download: {image_path}")
+        logging.error("Image not found for download: %s", image_path)
         return jsonify({"error": "Image not found."}), 404
 
 if __name__ == '__main__':
@@ -0,0 +1,484 @@
+"""End-to-end benchmark and load test for the quote service.
+
+Seeds a temporary quote store with synthetic quotes and photos, then drives
+/, /submit, /retrieve/<quote_id>, /download_all_pdfs and /delete/<quote_id>
+either in process through Flask's test client (--mode client) or over HTTP
+against a local gunicorn with several workers (--mode server). Reports
+latency percentiles and throughput per endpoint, render throughput, PDF
+and zip sizes and the peak RSS of the serving processes (render workers
+included), and writes everything as JSON.
+
+`compare` prints the change between two result files, e.g. from two
+commits, and with --fail-on-regression exits 1 when a latency or
+throughput got worse by more than --threshold percent.
+
+Usage:
+  python benchmarks/bench_e2e.py run [--mode client|server] [--quotes 1000] [--requests 100]
+                                     [--concurrency 8] [--workers 4] [--output results.json]
+  python benchmarks/bench_e2e.py compare old.json new.json [--threshold 10] [--fail-on-regression]
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import platform
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import statistics
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from quote_store import SQLiteQuoteStore  # noqa: E402
+from blob_store import BlobStore, quote_blob_names  # noqa: E402
+from synthetic import make_quote, make_quotes, make_photos, quote_form  # noqa: E402
+
+IMAGE_FIELDS = ['fileUpload', 'extraImage1', 'extraImage2', 'extraImage3', 'extraImage4', 'extraImage5']
+# Quotes inserted per transaction while seeding
+SEED_BATCH = 1000
+# Statuses that count as success for each endpoint
+OK_STATUSES = {
+    "index": (200,),
+    "submit": (200, 202),
+    "retrieve": (200,),
+    "download_all_pdfs": (200,),
+    "delete": (200,),
+}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def summarize(latencies, errors, wall_seconds):
+    """Latency percentiles (ms) and throughput of one phase."""
+    stats = {"count": len(latencies) + errors, "errors": errors}
+    if latencies:
+        ms = [seconds * 1000 for seconds in latencies]
+        stats.update({
+            "p50_ms": round(percentile(ms, 50), 3),
+            "p90_ms": round(percentile(ms, 90), 3),
+            "p99_ms": round(percentile(ms, 99), 3),
+            "max_ms": round(max(ms), 3),
+            "mean_ms": round(statistics.mean(ms), 3),
+        })
+    stats["throughput_rps"] = round(len(latencies) / wall_seconds, 3) if wall_seconds else 0.0
+    return stats
+
+
+def encode_multipart(form, files):
+    """Encode form fields (a dict or name, value pairs) and (filename, bytes) files as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in (form.items() if isinstance(form, dict) else form):
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8")
+        )
+    for name, (filename, content) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode("utf-8") + content + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode("ascii"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class RSSSampler(threading.Thread):
+    """Tracks the peak resident memory of a process and all its descendants.
+
+    Reads /proc, so on other platforms only the peak of this process
+    (getrusage) is reported.
+    """
+
+    def __init__(self, root_pid, interval=0.1):
+        super().__init__(name="rss-sampler", daemon=True)
+        self.root_pid = root_pid
+        self.interval = interval
+        self.peak_total = 0
+        self.peak_process = 0
+        self._finished = threading.Event()
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def _tree(self):
+        children = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The command name may contain spaces; fields resume after ")"
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+        pids, stack = [], [self.root_pid]
+        while stack:
+            pid = stack.pop()
+            pids.append(pid)
+            stack.extend(children.get(pid, ()))
+        return pids
+
+    def _rss(self, pid):
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                return int(f.read().split()[1]) * self._page_size
+        except (OSError, IndexError, ValueError):
+            return 0
+
+    def sample(self):
+        if not os.path.isdir("/proc"):
+            return
+        sizes = [self._rss(pid) for pid in self._tree()]
+        self.peak_total = max(self.peak_total, sum(sizes))
+        self.peak_process = max(self.peak_process, max(sizes, default=0))
+
+    def run(self):
+        while not self._finished.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._finished.set()
+        self.join()
+        self.sample()
+        if not self.peak_total:
+            # ru_maxrss is in KiB on Linux
+            self.peak_total = self.peak_process = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return {"total": self.peak_total, "largest_process": self.peak_process}
+
+
+class ClientDriver:
+    """Sends requests to an in-process app through Flask's test client."""
+
+    mode = "client"
+
+    def __init__(self, config):
+        from app import create_app
+
+        self.app = create_app(config)
+        self.pid = os.getpid()
+        self._local = threading.local()
+
+    def request(self, method, path, form=None, files=None):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        data = dict(form or {})
+        for name, (filename, content) in (files or {}).items():
+            data[name] = (io.BytesIO(content), filename)
+        response = client.open(path, method=method, data=data or None)
+        try:
+            return response.status_code, response.get_data()
+        finally:
+            response.close()
+
+    def close(self):
+        pass
+
+
+class ServerDriver:
+    """Sends requests over HTTP to a local gunicorn serving app:app."""
+
+    mode = "server"
+
+    def __init__(self, config, workers, log_path, startup_timeout=60):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        env = dict(os.environ)
+        env.update({key: str(int(value) if isinstance(value, bool) else value) for key, value in config.items()})
+        self._log = open(log_path, "wb")
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "--workers", str(workers), "--bind", f"127.0.0.1:{self.port}",
+             "--timeout", "600", "app:app"],
+            cwd=ROOT, env=env, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+        self.pid = self.proc.pid
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            try:
+                self.request("GET", "/")
+                break
+            except OSError:
+                if self.proc.poll() is not None or time.monotonic() > deadline:
+                    self.close()
+                    raise SystemExit(f"gunicorn did not start, see {log_path}")
+                time.sleep(0.2)
+
+    def request(self, method, path, form=None, files=None):
+        body, headers = None, {}
+        if form or files:
+            body, headers["Content-Type"] = encode_multipart(form or {}, files or {})
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=600)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def close(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self._log.close()
+
+
+def seed_store(config, quotes, photos, photo_ratio, rng):
+    """Insert synthetic quotes, a share of them referencing stored photos."""
+    store = SQLiteQuoteStore(config["QUOTE_DB_PATH"])
+    blobs = BlobStore(store, config["UPLOAD_FOLDER"])
+    names = [blobs.put_stream(io.BytesIO(photo), "jpg") for photo in photos]
+    for start in range(0, len(quotes), SEED_BATCH):
+        with store.transaction() as conn:
+            for entry in quotes[start:start + SEED_BATCH]:
+                if names and rng.random() < photo_ratio:
+                    entry["data"]["Images"] = {"fileUpload": rng.choice(names)}
+                store.upsert(entry)
+                blobs.update_refs(conn, [], quote_blob_names(entry))
+
+
+def run_phase(driver, name, calls, concurrency):
+    """Send the (method, path, form, files) calls. Returns (stats, [(status, body), ...])."""
+    def send(call):
+        method, path, form, files = call
+        started = time.perf_counter()
+        try:
+            status, body = driver.request(method, path, form, files)
+        except (OSError, http.client.HTTPException) as e:
+            status, body = None, str(e).encode("utf-8")
+        return time.perf_counter() - started, status, body
+
+    latencies, errors, responses = [], 0, []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for seconds, status, body in pool.map(send, calls):
+            responses.append((status, body))
+            if status in OK_STATUSES[name]:
+                latencies.append(seconds)
+            else:
+                errors += 1
+    stats = summarize(latencies, errors, time.perf_counter() - started)
+    print(f"{name}: {stats['count']} requests, {errors} errors, p50 {stats.get('p50_ms', 0):.1f} ms, "
+          f"p99 {stats.get('p99_ms', 0):.1f} ms, {stats['throughput_rps']:.1f} req/s")
+    return stats, responses
+
+
+def wait_for_renders(driver, job_urls, timeout):
+    """Poll render jobs until all are finished. Returns (seconds, failed)."""
+    started = time.perf_counter()
+    pending = list(job_urls)
+    failed = 0
+    while pending:
+        if time.perf_counter() - started > timeout:
+            raise SystemExit(f"{len(pending)} renders still pending after {timeout} s")
+        still_pending = []
+        for url in pending:
+            status, body = driver.request("GET", url)
+            job = json.loads(body) if status == 200 else {"status": "failed"}
+            if job["status"] == "failed":
+                failed += 1
+            elif job["status"] != "done":
+                still_pending.append(url)
+        pending = still_pending
+        if pending:
+            time.sleep(0.05)
+    return time.perf_counter() - started, failed
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    commit, dirty = git_revision()
+    results = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "mode": args.mode,
+            "quotes": args.quotes,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "workers": args.workers if args.mode == "server" else 1,
+            "render_workers": args.render_workers,
+            "products": args.products,
+            "photos_per_quote": args.photos_per_quote,
+            "seed": args.seed,
+        },
+        "endpoints": {},
+    }
+
+    with tempfile.TemporaryDirectory(dir=args.tmp) as tmp:
+        config = {
+            "UPLOAD_FOLDER": os.path.join(tmp, "uploads"),
+            "PDF_OUTPUT_FOLDER": os.path.join(tmp, "pdfs"),
+            "QUOTE_DB_PATH": os.path.join(tmp, "quotes.db"),
+            "QUOTE_STORE_PATH": os.path.join(tmp, "quote_data.json"),
+            "RENDER_WORKERS": args.render_workers,
+            "LOG_LEVEL": "WARNING",
+            "PROFILING": False,
+        }
+        os.makedirs(config["UPLOAD_FOLDER"])
+
+        started = time.perf_counter()
+        photos = make_photos(args.photos, seed=args.seed)
+        seed_store(config, make_quotes(args.quotes, seed=args.seed, max_products=args.products), photos, args.photo_ratio, rng)
+        results["seed_seconds"] = round(time.perf_counter() - started, 3)
+        print(f"Seeded {args.quotes} quotes and {len(photos)} photos in {results['seed_seconds']:.1f} s")
+
+        if args.mode == "server":
+            driver = ServerDriver(config, args.workers, os.path.join(tmp, "gunicorn.log"))
+        else:
+            driver = ClientDriver(config)
+        sampler = RSSSampler(driver.pid)
+        sampler.start()
+        try:
+            endpoints = results["endpoints"]
+            endpoints["index"], _ = run_phase(driver, "index", [("GET", "/", None, None)] * args.requests, args.concurrency)
+
+            calls = []
+            for i in range(args.requests):
+                data = make_quote(i, rng, max_products=args.products)["data"]
+                data["ClientName"] = f"Load Test {i}"
+                files = {
+                    field: (f"photo{j}.jpg", photos[(i + j) % len(photos)])
+                    for j, field in enumerate(IMAGE_FIELDS[:args.photos_per_quote])
+                } if photos else {}
+                calls.append(("POST", "/submit", quote_form(data), files))
+            endpoints["submit"], responses = run_phase(driver, "submit", calls, args.concurrency)
+            submitted = [json.loads(body) for status, body in responses if status in OK_STATUSES["submit"]]
+
+            render_seconds, render_failed = wait_for_renders(driver, [s["status_url"] for s in submitted], args.render_timeout)
+            results["render"] = {
+                "documents": len(submitted),
+                "failed": render_failed,
+                "seconds_after_submit": round(render_seconds, 3),
+            }
+            print(f"renders: {len(submitted)} finished {render_seconds:.1f} s after the last submit, {render_failed} failed")
+
+            quote_ids = [s["quote_id"] for s in submitted]
+            calls = [("GET", f"/retrieve/{quote_ids[i % len(quote_ids)]}", None, None) for i in range(args.requests)] if quote_ids else []
+            endpoints["retrieve"], responses = run_phase(driver, "retrieve", calls, args.concurrency)
+            pdf_sizes = [len(body) for status, body in responses if status == 200]
+            if pdf_sizes:
+                results["pdf_bytes"] = {"median": statistics.median(pdf_sizes), "max": max(pdf_sizes)}
+
+            calls = [("GET", "/download_all_pdfs", None, None)] * args.zip_requests
+            endpoints["download_all_pdfs"], responses = run_phase(driver, "download_all_pdfs", calls, 1)
+            zip_sizes = [len(body) for status, body in responses if status == 200]
+            if zip_sizes:
+                results["zip_bytes"] = max(zip_sizes)
+
+            calls = [("DELETE", f"/delete/{quote_id}", None, None) for quote_id in quote_ids]
+            endpoints["delete"], _ = run_phase(driver, "delete", calls, args.concurrency)
+        finally:
+            results["peak_rss_bytes"] = sampler.stop()
+            driver.close()
+
+    print(f"peak RSS: {results['peak_rss_bytes']['total'] / 2**20:.0f} MiB in total, "
+          f"{results['peak_rss_bytes']['largest_process'] / 2**20:.0f} MiB largest process")
+    output = args.output or f"bench_e2e-{args.mode}-{(commit or 'unknown')[:12]}.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"Results written to {output}")
+
+
+def compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    # (label, value getter, True if higher is better)
+    rows = []
+    for endpoint in sorted(set(old["endpoints"]) | set(new["endpoints"])):
+        for metric, higher_is_better in (("p50_ms", False), ("p99_ms", False), ("throughput_rps", True)):
+            rows.append((f"{endpoint} {metric}", lambda r, e=endpoint, m=metric: r["endpoints"].get(e, {}).get(m), higher_is_better))
+    rows.append(("render seconds_after_submit", lambda r: r.get("render", {}).get("seconds_after_submit"), False))
+    rows.append(("pdf_bytes median", lambda r: r.get("pdf_bytes", {}).get("median"), False))
+    rows.append(("peak_rss_bytes total", lambda r: r.get("peak_rss_bytes", {}).get("total"), False))
+
+    print(f"old: {old['meta'].get('commit')} ({old['meta'].get('mode')}), new: {new['meta'].get('commit')} ({new['meta'].get('mode')})")
+    settings = ("mode", "quotes", "requests", "concurrency", "workers", "render_workers", "products", "photos_per_quote")
+    differing = [key for key in settings if old["meta"].get(key) != new["meta"].get(key)]
+    if differing:
+        print(f"warning: the runs used different settings: {', '.join(differing)}")
+    print(f"{'metric':<40} {'old':>14} {'new':>14} {'change':>9}")
+    regressions = []
+    for label, value, higher_is_better in rows:
+        before, after = value(old), value(new)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        worse = -change if higher_is_better else change
+        flag = " !" if worse > args.threshold else ""
+        if flag:
+            regressions.append(label)
+        print(f"{label:<40} {before:>14.2f} {after:>14.2f} {change:>+8.1f}%{flag}")
+
+    if regressions:
+        print(f"{len(regressions)} metrics worse by more than {args.threshold}%: {', '.join(regressions)}")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmark and write a result file")
+    run_parser.add_argument("--mode", choices=("client", "server"), default="client",
+                            help="Flask test client in this process, or HTTP against a local gunicorn")
+    run_parser.add_argument("--quotes", type=int, default=1000, help="Synthetic quotes in the store before the run")
+    run_parser.add_argument("--requests", type=int, default=100, help="Requests per endpoint; also the number of submitted quotes")
+    run_parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    run_parser.add_argument("--workers", type=int, default=4, help="gunicorn workers (server mode)")
+    run_parser.add_argument("--render-workers", type=int, default=2, help="Render processes per app process")
+    run_parser.add_argument("--products", type=int, default=6, help="Maximum products per quote")
+    run_parser.add_argument("--photos", type=int, default=8, help="Distinct synthetic photos")
+    run_parser.add_argument("--photos-per-quote", type=int, default=2, help="Photos uploaded with each submit")
+    run_parser.add_argument("--photo-ratio", type=float, default=0.3, help="Share of seeded quotes that reference a photo")
+    run_parser.add_argument("--zip-requests", type=int, default=3, help="Sequential /download_all_pdfs requests")
+    run_parser.add_argument("--render-timeout", type=float, default=600, help="Seconds to wait for submitted quotes to render")
+    run_parser.add_argument("--seed", type=int, default=1234)
+    run_parser.add_argument("--tmp", default=None, help="Parent folder of the temporary store (default: system temp)")
+    run_parser.add_argument("--output", default=None, help="Result file (default: bench_e2e-<mode>-<commit>.json)")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="Percent change reported as a regression")
+    compare_parser.add_argument("--fail-on-regression", action="store_true", help="Exit 1 if any metric regressed")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Render-time benchmark for quote PDFs.
+
+Renders synthetic quotes with quote_pdf.render_quote_pdf and reports the
+time per document and per page. Run it before and after a renderer change
+to compare.
+
+Usage: python benchmarks/bench_render.py [--docs 50] [--products 60]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quote_pdf import render_quote_pdf  # noqa: E402
+from synthetic import make_quotes  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--products", type=int, default=60, help="Products per quote; more products means more pages")
+    args = parser.parse_args()
+
+    quotes = make_quotes(args.docs, max_products=args.products)
+    for quote in quotes:
+        # Fixed product count so every document has the same page count
+        quote["data"]["Products"] = (quote["data"]["Products"] * args.products)[:args.products]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        timings = []
+        sizes = []
+        for i, quote in enumerate(quotes):
+            pdf_path = os.path.join(tmp, f"{i}.pdf")
+            started = time.perf_counter()
+            render_quote_pdf(quote["data"], pdf_path, tmp)
+            timings.append((time.perf_counter() - started) * 1000)
+            sizes.append(os.path.getsize(pdf_path))
+            os.remove(pdf_path)
+
+    print(f"documents: {args.docs}, products per quote: {args.products}")
+    print(f"first render: {timings[0]:.1f} ms")
+    print(f"median render: {statistics.median(timings):.1f} ms, mean: {statistics.mean(timings):.1f} ms")
+    print(f"median size: {statistics.median(sizes) / 1024:.1f} KiB")
+
+
+if __name__ == '__main__':
+    main()
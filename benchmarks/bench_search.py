@@ -0,0 +1,56 @@
+"""Micro-benchmark for the in-process quote search index.
+
+Usage: python benchmarks/bench_search.py [--quotes 100000] [--repeat 200]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quote_search import QuoteSearchIndex  # noqa: E402
+from synthetic import make_quotes  # noqa: E402
+
+QUERIES = ["darrin", "kor", "main st", "calgary", "glass", "403", "smith 12", "okotoks picket", "tuscany", "z", "nguyen elbow", "example com"]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--quotes", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    quotes = make_quotes(args.quotes)
+    index = QuoteSearchIndex()
+
+    started = time.perf_counter()
+    index.build(quotes)
+    print(f"build: {args.quotes} quotes in {time.perf_counter() - started:.2f} s")
+
+    rng = random.Random(7)
+    started = time.perf_counter()
+    for quote in rng.sample(quotes, 1000):
+        quote["data"]["Address"] = f"{rng.randint(1, 9999)} Updated Ave"
+        index.add(quote)
+    print(f"incremental update: {(time.perf_counter() - started) * 1000 / 1000:.3f} ms/quote")
+
+    print(f"{'query':<18}{'hits':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for query in QUERIES:
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            results = index.search(query, limit=20)
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f"{query:<18}{len(results):>8}{statistics.median(timings):>10.3f}{percentile(timings, 95):>10.3f}{max(timings):>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
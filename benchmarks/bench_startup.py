@@ -0,0 +1,104 @@
+"""Cold-start benchmark for the Vercel entry point.
+
+Each run starts a fresh interpreter, imports api/index.py and sends the
+first requests through its ``handler``: "/" (the page shell, which should
+not touch the quote store) and "/api/quotes" (which opens it). All paths
+point at a temporary folder, so /persistent is never touched.
+
+--max-import-ms and --max-first-request-ms turn the benchmark into a
+check that exits 1 when the median exceeds them.
+
+Usage: python benchmarks/bench_startup.py [--runs 10] [--max-import-ms 400]
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the fresh interpreter; prints one JSON line of timings in ms
+CHILD = r"""
+import sys, time, json
+started = time.perf_counter()
+sys.path.insert(0, ROOT)
+from api.index import handler
+import_ms = (time.perf_counter() - started) * 1000
+
+from werkzeug.test import EnvironBuilder
+
+def request(path):
+    environ = EnvironBuilder(path=path).get_environ()
+    status = []
+    started = time.perf_counter()
+    body = b"".join(handler(environ, lambda s, h, e=None: status.append(s)))
+    elapsed = (time.perf_counter() - started) * 1000
+    if not status[0].startswith("200"):
+        raise SystemExit(f"{path} answered {status[0]}: {body[:200]!r}")
+    return elapsed
+
+first_ms = request("/")
+data_ms = request("/api/quotes")
+print(json.dumps({
+    "import_ms": import_ms,
+    "first_request_ms": first_ms,
+    "first_data_request_ms": data_ms,
+    "heavy_modules": sorted(m for m in ("reportlab", "PIL", "pdf2image") if m in sys.modules),
+}))
+"""
+
+
+def run_once(tmp):
+    env = dict(os.environ)
+    env.update({
+        "UPLOAD_FOLDER": os.path.join(tmp, "uploads"),
+        "PDF_OUTPUT_FOLDER": os.path.join(tmp, "pdfs"),
+        "QUOTE_DB_PATH": os.path.join(tmp, "quotes.db"),
+        "QUOTE_STORE_PATH": os.path.join(tmp, "quote_data.json"),
+        "LOG_LEVEL": "WARNING",
+    })
+    env.pop("PROFILING", None)
+    result = subprocess.run(
+        [sys.executable, "-c", f"ROOT = {ROOT!r}\n{CHILD}"],
+        env=env, cwd=tmp, capture_output=True, text=True, check=False,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"startup run failed:\n{result.stderr}{result.stdout}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-import-ms", type=float, default=None, help="Fail if the median import time is higher")
+    parser.add_argument("--max-first-request-ms", type=float, default=None, help="Fail if the median first request is slower")
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.runs):
+        # A fresh folder per run, so the first data request also creates the database
+        with tempfile.TemporaryDirectory() as tmp:
+            runs.append(run_once(tmp))
+
+    for name in ("import_ms", "first_request_ms", "first_data_request_ms"):
+        values = [run[name] for run in runs]
+        print(f"{name}: median {statistics.median(values):.1f}, min {min(values):.1f}, max {max(values):.1f}")
+    heavy = sorted({m for run in runs for m in run["heavy_modules"]})
+    print(f"heavy modules loaded: {', '.join(heavy) or 'none'}")
+
+    failed = False
+    if args.max_import_ms is not None and statistics.median(run["import_ms"] for run in runs) > args.max_import_ms:
+        print(f"import is slower than {args.max_import_ms} ms")
+        failed = True
+    if args.max_first_request_ms is not None and statistics.median(run["first_request_ms"] for run in runs) > args.max_first_request_ms:
+        print(f"first request is slower than {args.max_first_request_ms} ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Benchmark for quotes with very large product tables.
+
+Renders one synthetic quote per size with quote_pdf.render_quote_pdf and
+reports the render time, pages, PDF size and peak traced memory. Every
+--long-every-th product gets a long name that wraps in the Product column.
+Memory is measured in a second render under tracemalloc, so tracing does
+not skew the timing.
+
+Usage: python benchmarks/bench_table.py [--sizes 1000 10000] [--long-every 10]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quote_pdf import render_quote_pdf, warm_assets  # noqa: E402
+from synthetic import make_products, make_quotes  # noqa: E402
+
+LONG_NAME = (
+    "Commercial glass railing system with top-mount posts, 12 mm tempered panels, "
+    "stainless spigots and a continuous handrail"
+)
+
+
+def make_large_quote(size, long_every, seed=1234):
+    data = make_quotes(1, seed=seed)[0]["data"]
+    products = make_products(random.Random(seed), size)
+    if long_every:
+        for product in products[::long_every]:
+            product["Product"] = LONG_NAME
+    data["Products"] = products
+    return data
+
+
+def render(data, pdf_path):
+    started = time.perf_counter()
+    pages = render_quote_pdf(data, pdf_path, os.path.dirname(pdf_path))
+    return pages, (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="Line items per quote")
+    parser.add_argument("--long-every", type=int, default=10, help="Every Nth product gets a wrapping name; 0 for none")
+    args = parser.parse_args()
+
+    warm_assets()
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "quote.pdf")
+        for size in args.sizes:
+            # render_quote_pdf adds LineTotalRounded to the products, so
+            # each render gets fresh data
+            pages, render_ms = render(make_large_quote(size, args.long_every), pdf_path)
+            pdf_bytes = os.path.getsize(pdf_path)
+
+            data = make_large_quote(size, args.long_every)
+            tracemalloc.start()
+            render(data, pdf_path)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            print(
+                f"{size} items: {pages} pages, {render_ms:.0f} ms ({render_ms / pages:.1f} ms/page), "
+                f"{pdf_bytes / 1024:.0f} KiB, peak traced memory {peak / 1024 / 1024:.1f} MiB"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,482 @@
+"""Replay captured traffic against a local instance and compare the runs.
+
+`run` re-sends the requests of a capture written with TRAFFIC_CAPTURE=1
+(see traffic_capture.py) to a running instance, keeping their recorded
+spacing at --speed 1, compressing it at --speed N, or sending them as fast
+as --concurrency allows at --speed 0. Uploaded photos are replaced by
+synthetic images of the recorded sizes, identical where the originals
+were, and the upload and job ids the instance hands out are mapped onto
+the recorded ones. The requests for one upload or one quote are sent in
+their recorded order at any speed, so chunks, the submits using them and
+a quote's later reads and deletion see the state they saw when captured. Request bodies that cannot be rebuilt from a
+capture (/api/import) are skipped and counted. Latency percentiles are
+reported per route and written as JSON with the raw latencies.
+
+Replay into an instance whose store matches the one captured from, or
+into an empty one; requests for quotes that do not exist there are
+answered 404, and the number of statuses that differ from the capture is
+reported so such a mismatch shows.
+
+`compare` prints the per-route change in latency between two result files
+(or a capture file, for the latencies recorded in production) with the
+largest gap between their latency distributions (the Kolmogorov-Smirnov
+statistic), and with --fail-on-regression exits 1 when a percentile got
+worse by more than --threshold percent.
+
+Usage:
+  python benchmarks/replay.py run traffic.jsonl [--base-url http://127.0.0.1:5000] [--speed 1]
+                                  [--concurrency 16] [--output replay.json]
+  python benchmarks/replay.py compare old.json new.json [--threshold 10] [--fail-on-regression]
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import http.client
+from urllib.parse import urlencode, urlsplit
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_e2e import percentile, summarize, encode_multipart, git_revision  # noqa: E402
+from synthetic import make_sized_photo  # noqa: E402
+
+# Seconds a request waits for the upload or job it refers to
+ID_WAIT_SECONDS = 60
+# Percentiles compared between runs
+COMPARED_PERCENTILES = (50, 90, 99)
+
+
+def load_capture(path, limit=None):
+    """Records of a capture file in the order they were received."""
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A worker killed mid-write leaves a partial last line
+                continue
+            if record.get("route") and record.get("ts") is not None:
+                records.append(record)
+    records.sort(key=lambda record: record["ts"])
+    return records[:limit] if limit else records
+
+
+def route_key(record):
+    return f"{record['method']} {record['route']}"
+
+
+class IdMap:
+    """Ids handed out by the replayed instance, by kind and recorded id."""
+
+    def __init__(self):
+        self._ids = {}
+        self._changed = threading.Condition()
+
+    def set(self, kind, recorded, actual):
+        with self._changed:
+            self._ids[(kind, str(recorded))] = actual
+            self._changed.notify_all()
+
+    def get(self, kind, recorded, timeout=ID_WAIT_SECONDS):
+        """The replayed id for ``recorded``, waiting for it to be handed out; None if it never is."""
+        with self._changed:
+            self._changed.wait_for(lambda: (kind, str(recorded)) in self._ids, timeout)
+            return self._ids.get((kind, str(recorded)))
+
+
+class Sequencer:
+    """Runs the requests of one upload or quote in the order they were recorded."""
+
+    def __init__(self):
+        self._done = defaultdict(int)
+        self._changed = threading.Condition()
+
+    def wait(self, key, position, timeout=ID_WAIT_SECONDS):
+        with self._changed:
+            return self._changed.wait_for(lambda: self._done[key] >= position, timeout)
+
+    def done(self, key):
+        with self._changed:
+            self._done[key] += 1
+            self._changed.notify_all()
+
+
+class PhotoCache:
+    """Synthetic stand-ins for captured photos, kept on disk between runs."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, seed, size, ext):
+        return os.path.join(self.directory, f"{hashlib.sha256(str(seed).encode()).hexdigest()[:32]}-{size}.{ext or 'jpg'}")
+
+    def prepare(self, seed, size, ext):
+        path = self.path(seed, size, ext)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(make_sized_photo(seed, size, ext or "jpg"))
+            os.replace(tmp_path, path)
+        return path
+
+    def read(self, seed, size, ext, start=0, length=None):
+        with open(self.path(seed, size, ext), "rb") as f:
+            f.seek(start)
+            return f.read(-1 if length is None else length)
+
+
+def _upload_photo(record):
+    """(seed, size, ext) of the photo a POST /uploads record starts."""
+    body = record.get("json") or {}
+    filename = str(body.get("filename", ""))
+    ext = filename.rsplit(".", 1)[1].lower() if "." in filename else "jpg"
+    # The digest of the sender's checksum ties identical photos together
+    seed = body.get("sha256") or record["ids"]["upload_id"]
+    return seed, int(body.get("size") or 0), ext
+
+
+class Replay:
+    """Turns captured records into requests against ``base_url``."""
+
+    def __init__(self, records, base_url, photos):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.records = records
+        self.photos = photos
+        self.ids = IdMap()
+        self.sequencer = Sequencer()
+        # Recorded upload id -> (seed, size, ext), and each record's place
+        # among the requests for its uploads and quote
+        self.uploads = {}
+        self.positions = {}
+
+    def prepare(self):
+        """Make the synthetic photos and work out the order within each upload and quote.
+
+        Returns the records that cannot be replayed, by route.
+        """
+        skipped = defaultdict(int)
+        replayable = []
+        for record in self.records:
+            if self._can_build(record):
+                replayable.append(record)
+            else:
+                skipped[route_key(record)] += 1
+        self.records = replayable
+
+        counts = defaultdict(int)
+        for index, record in enumerate(self.records):
+            if record["route"] == "/uploads" and record["method"] == "POST" and "upload_id" in record.get("ids", {}):
+                seed, size, ext = _upload_photo(record)
+                if size:
+                    self.uploads[record["ids"]["upload_id"]] = (seed, size, ext)
+            for key in self._ordering_keys(record):
+                self.positions[(index, key)] = counts[key]
+                counts[key] += 1
+
+        photos = set(self.uploads.values())
+        for record in self.records:
+            for file in record.get("files") or []:
+                if file.get("size"):
+                    photos.add((file["digest"], file["size"], file["ext"]))
+        print(f"Preparing {len(photos)} synthetic photos in {self.photos.directory}")
+        for seed, size, ext in photos:
+            self.photos.prepare(seed, size, ext)
+        return dict(skipped)
+
+    def _can_build(self, record):
+        if record.get("files") and any(file.get("size") is None for file in record["files"]):
+            return False
+        if record.get("form") is not None or record.get("json") is not None or not record.get("request_bytes"):
+            return True
+        # A chunk of an upload is rebuilt from its synthetic photo
+        return record["route"] == "/uploads/<upload_id>" and record["method"] == "PATCH"
+
+    def _ordering_keys(self, record):
+        """The uploads and quote a record reads or changes, which it replays in order with."""
+        keys = []
+        view_args = record.get("view_args") or {}
+        if view_args.get("upload_id"):
+            keys.append(("upload", view_args["upload_id"]))
+        elif record["route"] == "/uploads" and "upload_id" in record.get("ids", {}):
+            keys.append(("upload", record["ids"]["upload_id"]))
+        if view_args.get("quote_id"):
+            keys.append(("quote", view_args["quote_id"]))
+        form = dict(record.get("form") or [])
+        for name, value in form.items():
+            if name.endswith("_photo") and value:
+                keys.append(("upload", value))
+        # The quote id /submit derives from the client name
+        quote_id = form.get("quoteId") or "".join(
+            c for c in form.get("ClientName", "") if c.isalnum() or c in (" ", "_")
+        ).rstrip().replace(" ", "_")
+        if quote_id:
+            keys.append(("quote", quote_id))
+        return keys
+
+    def build(self, record):
+        """(method, path, body, headers) of a record, with ids mapped to this run's."""
+        view_args = dict(record.get("view_args") or {})
+        if "upload_id" in view_args:
+            view_args["upload_id"] = self.ids.get("upload_id", view_args["upload_id"]) or view_args["upload_id"]
+        if "job_id" in view_args:
+            view_args["job_id"] = self.ids.get("job_id", view_args["job_id"]) or view_args["job_id"]
+        path = record["route"]
+        for name, value in view_args.items():
+            path = path.replace(f"<int:{name}>", str(value)).replace(f"<{name}>", str(value))
+        if record.get("query"):
+            path += "?" + urlencode([tuple(pair) for pair in record["query"]])
+
+        headers = dict(record.get("headers") or {})
+        body = None
+        if record.get("form") is not None:
+            form = []
+            for name, value in record["form"]:
+                if name.endswith("_photo") and value:
+                    value = self.ids.get("upload_id", value) or value
+                form.append((name, value))
+            files = {}
+            for file in record.get("files") or []:
+                if file.get("size"):
+                    content = self.photos.read(file["digest"], file["size"], file["ext"])
+                    files[file["field"]] = (f"photo.{file['ext']}", content)
+            if files or record.get("content_type") == "multipart/form-data":
+                body, headers["Content-Type"] = encode_multipart(form, files)
+            else:
+                body, headers["Content-Type"] = urlencode(form).encode("utf-8"), "application/x-www-form-urlencoded"
+        elif record.get("json") is not None:
+            payload = dict(record["json"]) if isinstance(record["json"], dict) else record["json"]
+            upload = self.uploads.get(record.get("ids", {}).get("upload_id"))
+            if upload and isinstance(payload, dict) and payload.get("sha256"):
+                # The checksum the server will verify: that of the stand-in photo
+                payload["sha256"] = hashlib.sha256(self.photos.read(*upload)).hexdigest()
+            body, headers["Content-Type"] = json.dumps(payload).encode("utf-8"), "application/json"
+        elif record.get("request_bytes"):
+            upload = self.uploads.get(record["view_args"]["upload_id"])
+            offset = int(headers.get("Upload-Offset", 0))
+            body = self.photos.read(*upload, start=offset, length=record["request_bytes"]) if upload else b""
+            headers["Content-Type"] = record.get("content_type") or "application/octet-stream"
+        return record["method"], path, body, headers
+
+    def send(self, index, record):
+        """Replay one record. Returns (seconds, status, response bytes)."""
+        keys = [key for key in self._ordering_keys(record) if (index, key) in self.positions]
+        for key in keys:
+            self.sequencer.wait(key, self.positions[(index, key)])
+        try:
+            method, path, body, headers = self.build(record)
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=600)
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                content = response.read()
+                seconds = time.perf_counter() - started
+                status = response.status
+                is_json = (response.getheader("Content-Type") or "").startswith("application/json")
+            except (OSError, http.client.HTTPException):
+                return time.perf_counter() - started, None, 0
+            finally:
+                conn.close()
+            returned = {}
+            if record.get("ids") and is_json:
+                try:
+                    returned = json.loads(content)
+                except ValueError:
+                    pass
+            for name in record.get("ids") or {}:
+                actual = returned.get(name) if isinstance(returned, dict) else None
+                self.ids.set(name, record["ids"][name], actual if actual is not None else record["ids"][name])
+            return seconds, status, len(content)
+        finally:
+            # Requests waiting on ids this one did not get go ahead and fail
+            for name in record.get("ids") or {}:
+                if self.ids.get(name, record["ids"][name], timeout=0) is None:
+                    self.ids.set(name, record["ids"][name], record["ids"][name])
+            for key in keys:
+                self.sequencer.done(key)
+
+
+def ks_statistic(a, b):
+    """Largest gap between the empirical distributions of two samples."""
+    a, b = sorted(a), sorted(b)
+    gap = 0.0
+    for x in a + b:
+        gap = max(gap, abs(bisect.bisect_right(a, x) / len(a) - bisect.bisect_right(b, x) / len(b)))
+    return gap
+
+
+def run(args):
+    records = load_capture(args.capture, args.limit)
+    if not records:
+        raise SystemExit(f"No records in {args.capture}")
+    replay = Replay(records, args.base_url, PhotoCache(args.photo_cache))
+    skipped = replay.prepare()
+    records = replay.records
+    t0 = records[0]["ts"]
+
+    latencies = defaultdict(list)
+    response_bytes = defaultdict(list)
+    errors = defaultdict(int)
+    mismatches = defaultdict(int)
+    lags = []
+
+    def send(index, record, due):
+        lags.append(max(0.0, time.perf_counter() - due))
+        key = route_key(record)
+        try:
+            seconds, status, size = replay.send(index, record)
+        except Exception as e:
+            print(f"Could not replay {key}: {e}")
+            status = None
+        if status is None:
+            errors[key] += 1
+            return
+        latencies[key].append(seconds)
+        response_bytes[key].append(size)
+        if status != record.get("status"):
+            mismatches[key] += 1
+
+    print(f"Replaying {len(records)} requests spanning {records[-1]['ts'] - t0:.1f} s at speed {args.speed or 'max'}")
+    commit, dirty = git_revision()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for index, record in enumerate(records):
+            due = started + (record["ts"] - t0) / args.speed if args.speed else time.perf_counter()
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, index, record, due)
+    wall_seconds = time.perf_counter() - started
+
+    routes = {}
+    for key in sorted(set(latencies) | set(errors)):
+        stats = summarize(latencies[key], errors[key], wall_seconds)
+        stats["status_mismatches"] = mismatches[key]
+        if response_bytes[key]:
+            stats["response_bytes_median"] = statistics.median(response_bytes[key])
+        routes[key] = stats
+    all_latencies = [seconds for values in latencies.values() for seconds in values]
+    results = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "capture": os.path.abspath(args.capture),
+            "base_url": args.base_url,
+            "speed": args.speed,
+            "concurrency": args.concurrency,
+            "requests": len(records),
+            "skipped": skipped,
+            "wall_seconds": round(wall_seconds, 3),
+            # How late requests were sent; large values mean the driver or
+            # --concurrency could not keep up with the recorded rate
+            "lag_ms": {
+                "p50": round(percentile(lags, 50) * 1000, 3) if lags else 0.0,
+                "max": round(max(lags) * 1000, 3) if lags else 0.0,
+            },
+        },
+        "overall": summarize(all_latencies, sum(errors.values()), wall_seconds),
+        "routes": routes,
+        "latencies_ms": {key: [round(seconds * 1000, 3) for seconds in values] for key, values in latencies.items()},
+    }
+
+    print(f"{'route':<40} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'mismatch':>8}")
+    for key, stats in routes.items():
+        print(f"{key:<40} {stats['count']:>6} {stats['errors']:>6} {stats.get('p50_ms', 0):>9.1f} "
+              f"{stats.get('p90_ms', 0):>9.1f} {stats.get('p99_ms', 0):>9.1f} {stats['status_mismatches']:>8}")
+    if skipped:
+        print(f"skipped: {', '.join(f'{key} ({count})' for key, count in sorted(skipped.items()))}")
+    print(f"send lag: p50 {results['meta']['lag_ms']['p50']:.1f} ms, max {results['meta']['lag_ms']['max']:.1f} ms")
+    output = args.output or f"replay-{(commit or 'unknown')[:12]}.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"Results written to {output}")
+
+
+def load_latencies(path):
+    """Latencies (ms) by route from a result file, or from the recorded durations of a capture."""
+    if path.endswith(".jsonl"):
+        latencies = defaultdict(list)
+        for record in load_capture(path):
+            if record.get("duration_ms") is not None:
+                latencies[route_key(record)].append(record["duration_ms"])
+        return path, dict(latencies)
+    with open(path) as f:
+        result = json.load(f)
+    return result["meta"].get("commit"), result["latencies_ms"]
+
+
+def compare(args):
+    old_label, old = load_latencies(args.old)
+    new_label, new = load_latencies(args.new)
+    print(f"old: {old_label}, new: {new_label}")
+    print(f"{'route':<40} {'pct':>4} {'old ms':>10} {'new ms':>10} {'change':>9}   {'KS':>5}")
+    regressions = []
+    for key in sorted(set(old) & set(new)):
+        if not old[key] or not new[key]:
+            continue
+        ks = ks_statistic(old[key], new[key])
+        for pct in COMPARED_PERCENTILES:
+            before, after = percentile(old[key], pct), percentile(new[key], pct)
+            change = (after - before) / before * 100 if before else 0.0
+            flag = " !" if change > args.threshold else ""
+            if flag:
+                regressions.append(f"{key} p{pct}")
+            # The route and KS statistic on the first line of each route
+            first = pct == COMPARED_PERCENTILES[0]
+            print(f"{key if first else '':<40} p{pct:<3} {before:>10.2f} {after:>10.2f} {change:>+8.1f}%{flag:<2} "
+                  f"{f'{ks:>5.2f}' if first else ''}".rstrip())
+    for key in sorted(set(old) ^ set(new)):
+        print(f"{key:<40} only in {'old' if key in old else 'new'}")
+
+    if regressions:
+        print(f"{len(regressions)} percentiles worse by more than {args.threshold}%: {', '.join(regressions)}")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Replay a capture and write a result file")
+    run_parser.add_argument("capture", help="Capture file written with TRAFFIC_CAPTURE=1")
+    run_parser.add_argument("--base-url", default="http://127.0.0.1:5000", help="Instance to replay against")
+    run_parser.add_argument("--speed", type=float, default=1.0,
+                            help="1 keeps the recorded spacing, N sends N times faster, 0 as fast as possible")
+    run_parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight at most")
+    run_parser.add_argument("--limit", type=int, default=None, help="Replay only the first N records")
+    run_parser.add_argument("--photo-cache", default=os.path.join(tempfile.gettempdir(), "quote-replay-photos"),
+                            help="Folder for the synthetic photos, reused between runs")
+    run_parser.add_argument("--output", default=None, help="Result file (default: replay-<commit>.json)")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("old", help="Result file, or a capture file for its recorded latencies")
+    compare_parser.add_argument("new", help="Result file, or a capture file")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="Percent change reported as a regression")
+    compare_parser.add_argument("--fail-on-regression", action="store_true", help="Exit 1 if any percentile regressed")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
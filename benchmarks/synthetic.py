@@ -0,0 +1,129 @@
+"""Synthetic quote data for the benchmarks in this directory."""
+import io
+import random
+
+FIRST_NAMES = ["Darrin", "Kevin", "Sean", "Sue", "Carl", "Maria", "Priya", "Liam", "Chen", "Olivia", "Noah", "Fatima", "Jonas", "Aiko", "Mateo"]
+LAST_NAMES = ["Joncas", "Smith", "Nguyen", "Patel", "Brown", "Martin", "Wilson", "Tremblay", "Roy", "Gagnon", "Lee", "Campbell", "Anderson"]
+STREETS = ["Kornbrust Cir", "Main St", "Elbow Dr", "Macleod Trail", "Crowchild Trail", "Bow Valley Rd", "Sunridge Way", "Edgemont Blvd", "Cougar Ridge Dr", "Tuscany Hills Pt"]
+AREAS = ["Calgary", "Cochrane", "Airdrie", "Okotoks", "Chestermere", "Canmore", "Strathmore"]
+QUOTED_BY = ["Kevin", "Sean", "Darrin", "Sue"]
+PRODUCTS = [
+    'Clear Windwall 90" 2 panel', 'clear windwall 72"', "Stair Glass", "Solar Grey Glass",
+    "Solar Grey Stairs", "68 mm Vinyl", 'Topless Glass 42" High', 'Urban 42" High', "Glass Gate",
+    "Side Mount Glass 42 clear", "Side mount Picket 42", 'Wide Picket 42" High', 'Cross Hatch 42" High',
+]
+COLORS = ["Black", "White", "Linen", "Sable", "Bronze", "Silver", "Brown", "Granite"]
+
+
+def make_products(rng, count):
+    products = []
+    for _ in range(count):
+        footage = round(rng.uniform(4, 120), 1)
+        price_per_ft = round(rng.uniform(25, 180), 2)
+        products.append({
+            "Product": rng.choice(PRODUCTS),
+            "Color": rng.choice(COLORS),
+            "Footage": footage,
+            "PricePerFt": price_per_ft,
+            "LineTotal": footage * price_per_ft,
+        })
+    return products
+
+
+def make_quote(i, rng, max_products=4):
+    """Return a quote entry shaped like the records in the quote store."""
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    name = f"{first} {last} {i}"
+    month, day = rng.randint(1, 12), rng.randint(1, 28)
+    data = {
+        "ClientName": name,
+        "Phone": f"({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(0, 9999):04d}",
+        "Area": rng.choice(AREAS),
+        "QuoteDate": f"2025-{month:02d}-{day:02d}",
+        "Address": f"{rng.randint(1, 9999)} {rng.choice(STREETS)}",
+        "Email": f"{first.lower()}.{last.lower()}{i}@example.com",
+        "QuotedBy": rng.choice(QUOTED_BY),
+        "RailColor": rng.choice(COLORS),
+        "VinylColor": "Granite",
+        "InstallType": rng.choice(["Installed", "Pickup"]),
+        "LeadTime": "2-3 weeks",
+        "InstallNotes": "Synthetic quote generated for benchmarking.",
+        "Images": {},
+        "Products": make_products(rng, rng.randint(1, max_products)),
+    }
+    return {"id": name.replace(" ", "_"), "data": data, "is_generated": True, "version": 1}
+
+
+def make_quotes(count, seed=1234, **kwargs):
+    rng = random.Random(seed)
+    return [make_quote(i, rng, **kwargs) for i in range(count)]
+
+
+def _draw_photo(rng, size, noise):
+    from PIL import Image, ImageDraw
+
+    img = Image.new("RGB", size, tuple(rng.randint(0, 255) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(60):
+        x, y = rng.randint(0, size[0]), rng.randint(0, size[1])
+        w, h = rng.randint(20, size[0] // 3), rng.randint(20, size[1] // 3)
+        draw.rectangle((x, y, x + w, y + h), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    # Per-pixel noise keeps the JPEG from compressing unrealistically well
+    return Image.blend(img, noise.convert("RGB"), 0.25)
+
+
+def make_photos(count, seed=1234, size=(1600, 1200)):
+    """Return ``count`` distinct JPEG images as bytes, roughly the size of phone photos."""
+    from PIL import Image
+
+    rng = random.Random(seed)
+    photos = []
+    for _ in range(count):
+        out = io.BytesIO()
+        _draw_photo(rng, size, Image.effect_noise(size, 40)).save(out, "JPEG", quality=85)
+        photos.append(out.getvalue())
+    return photos
+
+
+PHOTO_FORMATS = {"jpg": "JPEG", "jpeg": "JPEG", "png": "PNG", "gif": "GIF"}
+# Widest synthetic photo, about what a phone camera takes
+MAX_PHOTO_WIDTH = 4000
+
+
+def make_sized_photo(seed, size, ext="jpg"):
+    """A valid image of exactly ``size`` bytes in the format of ``ext``.
+
+    The image is scaled to come out just under ``size`` and padded after
+    its end marker, which decoders ignore; a size below the smallest
+    image the format allows gives a truncated one. The same seed gives
+    the same bytes.
+    """
+    from PIL import Image
+
+    rng = random.Random(seed)
+    fmt = PHOTO_FORMATS.get(ext.lower(), "JPEG")
+    width = 1600
+    for attempt in range(6):
+        dimensions = (width, width * 3 // 4)
+        # Noise from the seeded generator; effect_noise is not reproducible
+        noise = Image.frombytes("L", dimensions, rng.randbytes(dimensions[0] * dimensions[1]))
+        out = io.BytesIO()
+        _draw_photo(rng, dimensions, noise).save(out, fmt, **({"quality": 85} if fmt == "JPEG" else {}))
+        data = out.getvalue()
+        if len(data) <= size and (len(data) >= 0.8 * size or width >= MAX_PHOTO_WIDTH or attempt >= 2):
+            break
+        if len(data) > size and width <= 80:
+            break
+        # Bytes grow with the pixel count; aim a little under
+        width = min(MAX_PHOTO_WIDTH, max(80, int(width * (size / len(data)) ** 0.5 * 0.95)))
+    padding = size - len(data)
+    return (data + rng.randbytes(padding)) if padding > 0 else data[:size]
+
+
+def quote_form(data):
+    """The /submit form fields for quote data, products as Products[i][field]."""
+    form = {key: value for key, value in data.items() if key not in ("Images", "Products")}
+    for i, product in enumerate(data.get("Products", [])):
+        for field in ("Product", "Color", "Footage", "PricePerFt"):
+            form[f"Products[{i}][{field}]"] = str(product[field])
+    return form
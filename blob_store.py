@@ -0,0 +1,203 @@
+"""Content-addressed storage for uploaded images.
+
+Usage: python blob_store.py [--db PATH] [--uploads PATH] gc [--grace-hours H]
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+import argparse
+
+from image_ingest import derived_filename
+from quote_store import SQLiteQuoteStore
+
+BLOB_DIR = "blobs"
+CHUNK_SIZE = 64 * 1024
+# Unreferenced blobs younger than this are kept, so an upload is not
+# collected between being stored and its quote being saved.
+GC_GRACE_SECONDS = 3600
+# Blob names as they appear in quote data and in version history payloads
+BLOB_NAME_PATTERN = re.compile(re.escape(BLOB_DIR) + r"/[0-9a-f]{2}/[0-9a-f]{64}\.[\w-]+")
+# Blobs no quote counts a reference to and no upload session holds
+_UNREFERENCED_BLOBS = """
+    SELECT sha256, name FROM blobs
+    WHERE refcount = 0 AND name NOT IN (SELECT blob_name FROM uploads WHERE blob_name IS NOT NULL)
+"""
+
+
+def is_blob_name(filename):
+    return bool(filename) and filename.startswith(BLOB_DIR + "/")
+
+
+def is_upload_name(filename):
+    """Whether an image name stored on a quote stays inside the upload folder."""
+    return not os.path.isabs(filename) and ".." not in filename.replace("\\", "/").split("/")
+
+
+class BlobStore:
+    """Content-addressed storage for uploaded images.
+
+    Files live under <root>/blobs/<aa>/<sha256>.<ext>, so an image uploaded
+    many times, or reused across quotes and versions, is stored once. The
+    blobs table in the quote store counts how many quotes reference each
+    blob; blobs that no quote and no recorded version references are
+    removed by collect_garbage().
+    """
+
+    def __init__(self, store, root):
+        self.store = store
+        self.root = root
+        self.tmp_dir = os.path.join(root, BLOB_DIR, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def put_stream(self, stream, ext, chunk_size=CHUNK_SIZE, max_bytes=None):
+        """Store the contents of a file-like object. Returns the blob name.
+
+        The stream is hashed while it is copied to a temporary file, so large
+        uploads are never held in memory. Raises ValueError once more than
+        ``max_bytes`` have been read.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.tmp_dir, f"{os.getpid()}_{time.monotonic_ns()}.part")
+        try:
+            with open(tmp_path, "wb") as out:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise ValueError(f"Photos can be at most {max_bytes // (1024 * 1024)} MB.")
+                    digest.update(chunk)
+                    out.write(chunk)
+            return self._commit(tmp_path, digest.hexdigest(), ext.lower(), size)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _commit(self, tmp_path, sha256, ext, size):
+        now = time.time()
+        with self.store.transaction() as conn:
+            row = conn.execute("SELECT name FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            name = row["name"] if row else f"{BLOB_DIR}/{sha256[:2]}/{sha256}.{ext}"
+            path = self.path(name)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            conn.execute(
+                """
+                INSERT INTO blobs (sha256, name, size, refcount, touched_at) VALUES (?, ?, ?, 0, ?)
+                ON CONFLICT(sha256) DO UPDATE SET touched_at = excluded.touched_at
+                """,
+                (sha256, name, size, now),
+            )
+        logging.debug("Stored blob %s (%s bytes, %s)", name, size, 'new' if not row else 'deduplicated')
+        return name
+
+    def total_size(self):
+        return self.store.conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def update_refs(self, conn, old_names, new_names):
+        """Adjust reference counts when a quote's images change.
+
+        Must run inside the same transaction as the quote write. Names that
+        are not blobs (uploads from before the blob store) are ignored.
+        """
+        old = [name for name in old_names if is_blob_name(name)]
+        new = [name for name in new_names if is_blob_name(name)]
+        now = time.time()
+        for name in new:
+            conn.execute("UPDATE blobs SET refcount = refcount + 1, touched_at = ? WHERE name = ?", (now, name))
+        for name in old:
+            conn.execute("UPDATE blobs SET refcount = MAX(refcount - 1, 0), touched_at = ? WHERE name = ?", (now, name))
+
+    def collect_garbage(self, grace_seconds=GC_GRACE_SECONDS, limit=500):
+        """Delete unreferenced blobs, and their print copies. Returns the count removed.
+
+        Photos of upload sessions that have not expired are kept, since a
+        quote may still be submitted with them, and so are photos of older
+        quote versions, which can still be viewed and restored.
+        """
+        cutoff = time.time() - grace_seconds
+        candidates = [
+            row["name"] for row in self.store.conn.execute(_UNREFERENCED_BLOBS + " AND touched_at < ?", (cutoff,))
+        ]
+        if not candidates:
+            return 0
+        # Searched before taking the write lock; a blob referenced again
+        # since has been touched, so the check below leaves it
+        in_history = self.history_refs(candidates)
+        removed = 0
+        with self.store.transaction() as conn:
+            for name in [name for name in candidates if name not in in_history][:limit]:
+                row = conn.execute(
+                    _UNREFERENCED_BLOBS + " AND touched_at < ? AND name = ?", (cutoff, name)
+                ).fetchone()
+                if row is None:
+                    continue
+                for path in (self.path(name), self.path(derived_filename(name))):
+                    if os.path.exists(path):
+                        os.remove(path)
+                conn.execute("DELETE FROM blobs WHERE sha256 = ?", (row["sha256"],))
+                removed += 1
+        if removed:
+            logging.debug("Removed %s unreferenced blobs", removed)
+        return removed
+
+    def history_refs(self, names):
+        """The blobs among ``names`` that a recorded quote version refers to.
+
+        Every photo of a version is named in the payload of its snapshot or
+        of a later delta, and compaction rewrites the oldest version kept as
+        a snapshot, so searching the payloads finds them all without
+        rebuilding each version.
+        """
+        names = set(names)
+        found = set()
+        for row in self.store.conn.execute("SELECT payload FROM quote_versions"):
+            found.update(names.intersection(BLOB_NAME_PATTERN.findall(row["payload"])))
+            if found == names:
+                break
+        return found
+
+def quote_blob_names(entry):
+    """Image names referenced by a quote entry."""
+    if not entry:
+        return []
+    images = (entry.get("data") or {}).get("Images") or {}
+    return [name for name in images.values() if name]
+
+
+def collect_all(blob_store, grace_seconds=GC_GRACE_SECONDS, batch=500):
+    """Run collect_garbage until nothing more is removed. Returns the count removed."""
+    removed = 0
+    while True:
+        count = blob_store.collect_garbage(grace_seconds=grace_seconds, limit=batch)
+        removed += count
+        if count < batch:
+            return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage stored quote images.")
+    parser.add_argument("--db", default="/persistent/quotes.db", help="Path to the SQLite quote store")
+    parser.add_argument("--uploads", default="/persistent/uploads", help="Upload folder holding quote images")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    gc_parser = subparsers.add_parser("gc", help="Remove images no quote or version uses")
+    gc_parser.add_argument(
+        "--grace-hours", type=float, default=GC_GRACE_SECONDS / 3600, help="Keep unreferenced images this recent"
+    )
+    args = parser.parse_args(argv)
+
+    blob_store = BlobStore(SQLiteQuoteStore(args.db), args.uploads)
+    if args.command == "gc":
+        print(f"Removed {collect_all(blob_store, grace_seconds=args.grace_hours * 3600)} unreferenced images")
+
+
+if __name__ == '__main__':
+    main()
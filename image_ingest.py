@@ -0,0 +1,102 @@
+import io
+import os
+import math
+import logging
+
+# Photo boxes on the quote's photo page, in points (1/72 inch)
+PRINT_BOX_WIDTH = 230
+PRINT_BOX_HEIGHT = 172.5
+# Resolution the photos are prepared for; plenty for a printed letter page
+PRINT_DPI = 200
+JPEG_QUALITY = 82
+
+PRINT_SIZE = (
+    math.ceil(PRINT_BOX_WIDTH / 72 * PRINT_DPI),
+    math.ceil(PRINT_BOX_HEIGHT / 72 * PRINT_DPI),
+)
+
+DERIVED_SUFFIX = ".print.jpg"
+# Bounding box of on-screen previews of a photo, in pixels
+THUMBNAIL_SIZE = (240, 180)
+
+
+def derived_filename(filename):
+    """Name of the print-ready copy of an uploaded image."""
+    return filename.rsplit('.', 1)[0] + DERIVED_SUFFIX
+
+
+def _to_rgb(img):
+    """A PIL image as RGB, with transparency flattened onto white."""
+    from PIL import Image
+
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+
+def ingest_image(upload_folder, filename):
+    """Write a downscaled, EXIF-oriented JPEG next to an uploaded image.
+
+    The original upload is kept as is. Returns the derived filename, or
+    None if the image could not be read.
+    """
+    # Imported here so modules that only need the filenames stay light
+    from PIL import Image, ImageOps
+
+    src_path = os.path.join(upload_folder, filename)
+    derived = derived_filename(filename)
+    dst_path = os.path.join(upload_folder, derived)
+    tmp_path = f"{dst_path}.{os.getpid()}.tmp"
+    try:
+        with Image.open(src_path) as img:
+            # Let the JPEG decoder skip detail we are about to throw away
+            img.draft("RGB", PRINT_SIZE)
+            img = _to_rgb(ImageOps.exif_transpose(img))
+            img.thumbnail(PRINT_SIZE, Image.LANCZOS)
+            img.save(tmp_path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp_path, dst_path)
+    except Exception as e:
+        logging.error("Failed to prepare print copy of %s: %s", src_path, e)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("Prepared print copy %s (%s -> %s bytes)", dst_path, os.path.getsize(src_path), os.path.getsize(dst_path))
+    return derived
+
+
+def thumbnail_jpeg(src, size=THUMBNAIL_SIZE):
+    """A small JPEG of an image file or file-like object, as bytes.
+
+    Nothing is written to disk. Raises whatever PIL raises for an
+    unreadable image.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as img:
+        img.draft("RGB", size)
+        img = _to_rgb(ImageOps.exif_transpose(img))
+        img.thumbnail(size, Image.BILINEAR)
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=75)
+    return out.getvalue()
+
+
+def print_image_path(upload_folder, filename):
+    """Path of the print-ready copy of an upload, creating it if needed.
+
+    Falls back to the original upload if no copy can be made.
+    """
+    derived_path = os.path.join(upload_folder, derived_filename(filename))
+    src_path = os.path.join(upload_folder, filename)
+    if os.path.exists(derived_path) and os.path.getmtime(derived_path) >= os.path.getmtime(src_path):
+        return derived_path
+    if ingest_image(upload_folder, filename):
+        return derived_path
+    return src_path
@@ -0,0 +1,111 @@
+import os
+import copy
+import time
+import hashlib
+import logging
+import threading
+
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfdoc import PDFImageXObject, pdfdocEnc
+from reportlab.pdfgen.canvas import aspectRatioFix
+
+# How often (seconds) a cached asset's file is stat'ed for changes
+CHECK_INTERVAL = 30.0
+
+
+class ImageAsset:
+    """A static image decoded and encoded once as a PDF image XObject."""
+
+    def __init__(self, path, mtime):
+        self.path = path
+        self.mtime = mtime
+        self.name = hashlib.md5(f"{path}:{mtime}".encode("utf-8")).hexdigest()
+        self.reader = ImageReader(path)
+        self.xobject = PDFImageXObject(self.name, self.reader)
+        # Encode the stream text once; saving a document otherwise runs it
+        # through the PDF text codec again for every render
+        self.xobject.streamContent = pdfdocEnc(self.xobject.streamContent)
+        self.width = self.xobject.width
+        self.height = self.xobject.height
+
+
+class AssetCache:
+    """Process-wide cache of static images used on every PDF page.
+
+    Each file is checked for existence and decoded once. Its mtime is
+    rechecked at most every ``check_interval`` seconds, so an updated logo
+    is picked up without a restart. Missing files are remembered too, and
+    logged once instead of on every page.
+    """
+
+    def __init__(self, check_interval=CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._assets = {}
+        self._checked = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Return the ImageAsset for path, or None if it is missing or unreadable."""
+        now = time.monotonic()
+        checked = self._checked.get(path)
+        if checked is not None and now - checked < self.check_interval:
+            return self._assets.get(path)
+
+        with self._lock:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                if path in self._assets or path not in self._checked:
+                    logging.error("Image asset not found: %s", path)
+                self._assets.pop(path, None)
+                self._checked[path] = now
+                return None
+
+            asset = self._assets.get(path)
+            if asset is None or asset.mtime != mtime:
+                try:
+                    asset = ImageAsset(path, mtime)
+                    logging.debug("Loaded image asset %s (%sx%s)", path, asset.width, asset.height)
+                except Exception as e:
+                    logging.error("Could not load image asset %s: %s", path, e)
+                    asset = None
+                if asset is None:
+                    self._assets.pop(path, None)
+                else:
+                    self._assets[path] = asset
+            self._checked[path] = now
+            return asset
+
+    def warm(self, paths):
+        for path in paths:
+            self.get(path)
+
+
+def draw_asset(c, asset, x, y, width, height, preserveAspectRatio=False, anchor='c'):
+    """Draw a cached asset like Canvas.drawImage, reusing its encoded XObject.
+
+    Canvas.drawImage re-reads and re-compresses an image for every new
+    document; here the encoded stream is shared and only registered with
+    each document once.
+    """
+    doc = c._doc
+    reg_name = doc.getXObjectName(asset.name)
+    if not doc.idToObject.get(reg_name):
+        # The canvas records per-document state on the object, so register a copy
+        xobject = copy.copy(asset.xobject)
+        c._setXObjects(xobject)
+        doc.Reference(xobject, reg_name)
+        doc.addForm(asset.name, xobject)
+
+    x, y, width, height, scaled = aspectRatioFix(preserveAspectRatio, anchor, x, y, width, height, asset.width, asset.height)
+    c._currentPageHasImages = 1
+    c.saveState()
+    c.translate(x, y)
+    c.scale(width, height)
+    c._code.append("/%s Do" % reg_name)
+    c.restoreState()
+    c._formsinuse.append(asset.name)
+    return asset.width, asset.height
+
+
+asset_cache = AssetCache()
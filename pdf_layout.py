@@ -0,0 +1,287 @@
+import io
+import copy
+import zlib
+import tempfile
+import threading
+from functools import lru_cache
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfbase.pdfdoc import PDFArray, PDFName, PDFStream
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+
+# Fonts registered in this order at the start of every document, so their
+# internal names (/F1, /F2, ...) match those in the compiled layers.
+PINNED_FONTS = ("Helvetica", "Helvetica-Bold", "Helvetica-Oblique")
+
+# Characters written as escapes in PDF literal strings
+_PDF_ESCAPES = {i: f"\\{i:03o}" for i in list(range(32)) + list(range(127, 256))}
+_PDF_ESCAPES.update({ord("\\"): "\\\\", ord("("): "\\(", ord(")"): "\\)"})
+
+
+@lru_cache(maxsize=8192)
+def string_width(text, font_name, font_size):
+    """Memoized pdfmetrics.stringWidth."""
+    return stringWidth(text, font_name, font_size)
+
+
+@lru_cache(maxsize=1024)
+def wrap_lines(text, max_width, font_name, font_size):
+    """Break text into lines no wider than max_width. Returns a tuple of lines.
+
+    Word widths come from string_width, so repeated words and repeated
+    texts are measured once per process.
+    """
+    lines = []
+    current_line = []
+    current_width = 0
+
+    for word in text.split():
+        word_width = string_width(word + " ", font_name, font_size)
+        if current_width + word_width <= max_width or not current_line:
+            current_line.append(word)
+            current_width += word_width
+        else:
+            lines.append(" ".join(current_line))
+            current_line = [word]
+            current_width = word_width
+    if current_line:
+        lines.append(" ".join(current_line))
+    return tuple(lines)
+
+
+def pin_fonts(c):
+    """Give the PINNED_FONTS fixed internal names in the canvas's document."""
+    for font_name in PINNED_FONTS:
+        c._doc.getInternalFontName(font_name)
+
+
+class StaticLayer:
+    """Constant page content compiled once per process into a form XObject.
+
+    ``draw`` is called with a scratch canvas the first time the layer is
+    used; the resulting form is registered with each later document as a
+    copy and placed with doForm, so drawing it costs one operator instead
+    of re-measuring and re-emitting every string. Layers may only use
+    PINNED_FONTS and must not draw images.
+    """
+
+    def __init__(self, name, draw, pagesize=letter):
+        self.name = name
+        self._draw = draw
+        self._pagesize = pagesize
+        self._form = None
+        self._lock = threading.Lock()
+
+    def compile(self):
+        """Compile the layer now if it is not yet. Returns its form."""
+        with self._lock:
+            if self._form is None:
+                width, height = self._pagesize
+                scratch = canvas.Canvas(io.BytesIO(), pagesize=self._pagesize)
+                pin_fonts(scratch)
+                # Layers are placed with a translation, so allow content
+                # below and above the origin
+                scratch.beginForm(self.name, 0, -height, width, height)
+                self._draw(scratch)
+                scratch.endForm()
+                form = scratch._doc.idToObject[scratch._doc.getXObjectName(self.name)]
+                # Forget the scratch document's registration so the form
+                # can be registered with real documents
+                vars(form).pop("__InternalName__", None)
+                self._form = form
+        return self._form
+
+    def draw(self, c, x=0, y=0):
+        """Place the layer on the current page with its origin at (x, y)."""
+        form = self._form or self.compile()
+        doc = c._doc
+        if not doc.idToObject.get(doc.getXObjectName(self.name)):
+            # Formatting a document mutates the form, so register a copy
+            doc.addForm(self.name, copy.copy(form))
+        if x or y:
+            c.saveState()
+            c.translate(x, y)
+            c.doForm(self.name)
+            c.restoreState()
+        else:
+            c.doForm(self.name)
+
+    def replay(self, c):
+        """Run the layer's drawing calls on ``c`` at the origin, without compiling
+        it; for canvas-like objects that do not produce PDF.
+        """
+        self._draw(c)
+
+
+def _number(value):
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+def _pdf_string(text):
+    try:
+        encoded = text.encode("cp1252")
+    except UnicodeEncodeError:
+        return None
+    return "(" + encoded.decode("latin-1").translate(_PDF_ESCAPES) + ")"
+
+
+@lru_cache(maxsize=2048)
+def pdf_string(text):
+    """Text as an escaped PDF literal string in WinAnsiEncoding, the encoding
+    of the standard fonts, or None if it has characters outside it.
+
+    Memoized; use it for text that repeats.
+    """
+    return _pdf_string(text)
+
+
+def split_word(word, max_width, font_name, font_size):
+    """Break a word wider than max_width into pieces that fit."""
+    pieces = []
+    current = ""
+    current_width = 0
+    for char in word:
+        char_width = string_width(char, font_name, font_size)
+        if current and current_width + char_width > max_width:
+            pieces.append(current)
+            current, current_width = "", 0
+        current += char
+        current_width += char_width
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+class TableLayout:
+    """Places table rows for tables of any length.
+
+    ``columns`` is a list of (x, width, wrap). Cells of wrapping columns
+    break into lines no wider than the column, words too long for it are
+    split, and a row grows by ``line_height`` for each extra line of its
+    tallest cell. Wrapping cells are memoized, so values repeated down a
+    table are measured once. The rows of a page are written as a single
+    text block of positioned strings instead of one ReportLab text object
+    per cell, which is where rendering thousands of rows spent its time.
+    """
+
+    def __init__(self, columns, font_name="Helvetica", font_size=10, row_height=20, line_height=12, max_lines=10):
+        self.columns = columns
+        self.font_name = font_name
+        self.font_size = font_size
+        self.row_height = row_height
+        self.line_height = line_height
+        # Cells longer than this many lines are cut short
+        self.max_lines = max_lines
+        self.cell_lines = lru_cache(maxsize=2048)(self._cell_lines)
+
+    def _cell_lines(self, text, column):
+        width = self.columns[column][1]
+        if string_width(text, self.font_name, self.font_size) <= width:
+            return (text,)
+        lines = []
+        for line in wrap_lines(text, width, self.font_name, self.font_size):
+            if string_width(line, self.font_name, self.font_size) > width:
+                lines.extend(split_word(line, width, self.font_name, self.font_size))
+            else:
+                lines.append(line)
+        if len(lines) > self.max_lines:
+            lines = lines[:self.max_lines - 1] + [lines[self.max_lines - 1].rstrip() + "..."]
+        return tuple(lines)
+
+    def measure(self, row):
+        """The lines of each cell of a row, and the row's height."""
+        cells = []
+        for column, ((_, _, wrap), text) in enumerate(zip(self.columns, row)):
+            # Only wrapping cells are memoized; the others are drawn as they are
+            cells.append(self.cell_lines(str(text), column) if wrap else (str(text),))
+        return cells, self.row_height + (max(len(lines) for lines in cells) - 1) * self.line_height
+
+    def draw_rows(self, c, rows, y, bottom, new_page):
+        """Draw rows with the first baseline at ``y``. Returns the y below the last row.
+
+        A row whose last line would fall below ``bottom`` goes on a new
+        page: ``new_page(c)`` must start it and return the baseline for the
+        row. ``rows`` can be any iterable, so the table is never held in
+        memory as laid-out rows.
+        """
+        font = c._doc.getInternalFontName(self.font_name)
+        block = []
+
+        def flush():
+            if block:
+                # q/Q keeps the font set here out of the canvas's text state
+                c._code.append(f"q BT {font} {_number(self.font_size)} Tf\n" + "\n".join(block) + "\nET Q")
+                block.clear()
+
+        for row in rows:
+            cells, height = self.measure(row)
+            if y - (height - self.row_height) < bottom:
+                flush()
+                y = new_page(c)
+            for (x, _, wrap), lines in zip(self.columns, cells):
+                line_y = y
+                for line in lines:
+                    if line:
+                        string = pdf_string(line) if wrap else _pdf_string(line)
+                        if string is not None:
+                            block.append(f"1 0 0 1 {_number(x)} {_number(line_y)} Tm {string} Tj")
+                        else:
+                            # ReportLab substitutes fonts for characters the
+                            # standard encoding lacks
+                            flush()
+                            c.setFont(self.font_name, self.font_size)
+                            c.drawString(x, line_y, line)
+                    line_y -= self.line_height
+            y -= height
+        flush()
+        return y
+
+
+class _SpooledStream(PDFStream):
+    """A compressed page content stream kept in a PageSpool's file."""
+
+    def __init__(self, spool, offset, length):
+        super().__init__(content=b"", filters=())
+        self.dictionary["Filter"] = PDFArray([PDFName("FlateDecode")])
+        self.spool = spool
+        self.offset = offset
+        self.length = length
+
+    def format(self, document):
+        self.spool.seek(self.offset)
+        self.content = self.spool.read(self.length)
+        try:
+            return super().format(document)
+        finally:
+            self.content = b""
+
+
+class PageSpool:
+    """Moves each finished page of a canvas out of memory.
+
+    ReportLab keeps the content of every page until the document is
+    saved. As the canvas's page callback, the spool compresses each page
+    when it is finished and writes it to a temporary file, from which
+    saving reads it back, so a document of any length holds one page of
+    uncompressed content at a time.
+    """
+
+    def __init__(self, c):
+        self._doc = c._doc
+        self._file = tempfile.TemporaryFile()
+        c.setPageCallBack(self._spool_page)
+
+    def _spool_page(self, page_number):
+        page = self._doc.Pages.pages[-1]
+        if not page.stream:
+            return
+        # The same encoding and compression ReportLab applies when saving
+        data = zlib.compress(page.stream.encode("utf8"))
+        offset = self._file.seek(0, io.SEEK_END)
+        self._file.write(data)
+        page.Contents = _SpooledStream(self._file, offset, len(data))
+        page.stream = None
+
+    def close(self):
+        self._file.close()
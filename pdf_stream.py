@@ -0,0 +1,190 @@
+"""Writing a ReportLab document out while it is still being drawn.
+
+Canvas.save builds the whole file in memory from every object the
+document has collected, so a document's memory grows with its length.
+StreamedDocument instead writes the objects drawn so far each time it is
+flushed and forgets them, keeping only what later pages may refer to
+again: the fonts, and the images and forms (logos, static layers,
+repeated photos), which are therefore stored once however often they
+are placed. The page tree, whose list of pages is only complete at the
+end, and the cross-reference table are spooled to temporary files.
+"""
+import io
+import tempfile
+from collections import OrderedDict
+
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfdoc import PDFIndirectObject, PDFPage, PDFTrailer
+from reportlab.pdfgen import canvas
+
+from pdf_layout import pin_fonts
+
+CHUNK_SIZE = 1024 * 1024
+# Images and forms kept registered after they are written, so pages drawn
+# later refer to the written object instead of embedding another copy;
+# the least recently placed are forgotten beyond this
+MAX_SHARED_XOBJECTS = 1024
+
+_XREF_ENTRY = 20
+_BASIC_FONTS = "BasicFonts"
+_XOBJECT_PREFIX = "FormXob."
+
+
+class _WrittenXObject:
+    """Stands in for an image or form that has been written.
+
+    Registered under the original's name, so the canvas places it again
+    by reference; drawImage only needs its size.
+    """
+
+    __slots__ = ("width", "height")
+
+    def __init__(self, xobject):
+        self.width = getattr(xobject, "width", None)
+        self.height = getattr(xobject, "height", None)
+
+
+class StreamedDocument:
+    """A canvas whose finished pages are written out on each flush.
+
+    Draw on ``canvas``, finishing each page with showPage, and pass the
+    chunks returned by ``flush`` and ``close`` on in order; together they
+    are the PDF file. Memory depends on what is drawn between two flushes,
+    not on the length of the document.
+    """
+
+    def __init__(self, pagesize=letter, title=None, max_shared=MAX_SHARED_XOBJECTS):
+        self.canvas = canvas.Canvas(io.BytesIO(), pagesize=pagesize)
+        pin_fonts(self.canvas)
+        if title:
+            self.canvas.setTitle(title)
+        doc = self._doc = self.canvas._doc
+        doc.encrypt.prepare(doc)
+        # Written last, with the list of pages spooled until then
+        self._pages_ref = doc.Reference(doc.Pages)
+        self._max_shared = max_shared
+        self._shared = OrderedDict()
+        self._keep = set()
+        self._kids = tempfile.TemporaryFile()
+        self._xref = tempfile.TemporaryFile()
+        self._chunks = []
+        self._offset = 0
+        self._next_number = 1
+        self.page_count = 0
+        self._write(b"%%PDF-%d.%d\n%%\x93\x8c\x8b\x9e\n" % doc._pdfVersion)
+
+    def _write(self, data):
+        self._chunks.append(data)
+        self._offset += len(data)
+
+    def _drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+    def _start_object(self, name):
+        number, version = self._doc.idToObjectNumberAndVersion[name]
+        self._xref.seek((number - 1) * _XREF_ENTRY)
+        self._xref.write(b"%010d %05d n \n" % (self._offset, version))
+
+    def _write_object(self, name):
+        doc = self._doc
+        obj = doc.idToObject[name]
+        self._start_object(name)
+        self._write(PDFIndirectObject(name, obj).format(doc))
+        return obj
+
+    def _unregister(self, name):
+        doc = self._doc
+        number, _ = doc.idToObjectNumberAndVersion.pop(name)
+        del doc.numberToId[number]
+        del doc.idToObject[name]
+
+    def _written(self, name, obj):
+        """Forget a written object, keeping what later pages may refer to."""
+        doc = self._doc
+        if name in self._keep:
+            return
+        if isinstance(obj, PDFPage):
+            number, version = doc.idToObjectNumberAndVersion[name]
+            self._kids.write(b"%d %d R\n" % (number, version))
+            self.page_count += 1
+            xobjects = getattr(obj, "XObjects", None)
+            for ref in xobjects.dict.values() if xobjects else ():
+                if ref.name in self._shared:
+                    self._shared.move_to_end(ref.name)
+            self._unregister(name)
+        elif name.startswith(_XOBJECT_PREFIX):
+            doc.idToObject[name] = _WrittenXObject(obj)
+            self._shared[name] = None
+        elif name.startswith("R") and name[1:].isdigit():
+            # Anonymous objects (content streams, annotations) belong to
+            # the one object that refers to them
+            self._unregister(name)
+        # Named objects such as fonts are kept: few, small, and shared
+
+    def flush(self):
+        """Write every object drawn on finished pages. Returns the chunks written."""
+        doc = self._doc
+        deferred = (_BASIC_FONTS, self._pages_ref.name)
+        # Formatting an object can register new ones, such as a page's
+        # content stream, so the counter is read on every pass
+        while self._next_number <= doc.objectcounter:
+            name = doc.numberToId[self._next_number]
+            self._next_number += 1
+            if name not in deferred:
+                self._written(name, self._write_object(name))
+        doc.Pages.pages = []
+        # Forgotten only now, as the objects just written may refer to them
+        while len(self._shared) > self._max_shared:
+            name, _ = self._shared.popitem(last=False)
+            self._unregister(name)
+        return self._drain()
+
+    def close(self, chunk_size=CHUNK_SIZE):
+        """Write the rest of the document and its trailer. Yields the chunks written."""
+        c = self.canvas
+        if c._code:
+            c.showPage()
+        yield from self.flush()
+        doc = self._doc
+        # What Canvas.save does before formatting a document
+        for font in doc.delayedFonts:
+            font.addObjects(doc)
+        doc.info.invariant = doc.invariant
+        doc.info.digest(doc.signature)
+        catalog_ref = doc.Reference(doc.Catalog)
+        info_ref = doc.Reference(doc.info)
+        # The trailer refers to these by name
+        self._keep.update((catalog_ref.name, info_ref.name))
+        doc.Outlines.prepare(doc, c)
+        if doc.Outlines.ready < 0:
+            doc.Catalog.Outlines = None
+        yield from self.flush()
+
+        self._write_object(_BASIC_FONTS)
+        self._start_object(self._pages_ref.name)
+        number, version = doc.idToObjectNumberAndVersion[self._pages_ref.name]
+        self._write(b"%d %d obj\n<<\n/Count %d /Kids [ " % (number, version, self.page_count))
+        yield from self._drain()
+        yield from self._copy(self._kids, chunk_size)
+        self._write(b"] /Type /Pages\n>>\nendobj\n")
+
+        startxref = self._offset
+        size = doc.objectcounter + 1
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        yield from self._drain()
+        yield from self._copy(self._xref, chunk_size)
+        trailer = PDFTrailer(startxref, Size=size, Root=catalog_ref, Info=info_ref, ID=doc.ID())
+        self._write(trailer.format(doc))
+        yield from self._drain()
+        self._kids.close()
+        self._xref.close()
+
+    def _copy(self, spool, chunk_size):
+        spool.seek(0)
+        while True:
+            chunk = spool.read(chunk_size)
+            if not chunk:
+                break
+            self._offset += len(chunk)
+            yield chunk
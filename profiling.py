@@ -0,0 +1,170 @@
+import os
+import io
+import re
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+
+# A request is profiled when it carries "X-Profile: 1" or "?_profile=1"
+PROFILE_HEADER = "HTTP_X_PROFILE"
+PROFILE_PARAM = "&_profile=1&"
+# Older profiles beyond this many are deleted
+MAX_PROFILES = 200
+# Frames kept per tracemalloc traceback
+TRACEMALLOC_FRAMES = 10
+
+_NAME_PATTERN = re.compile(r"^[0-9A-Za-z_.-]+$")
+
+
+def _slug(path):
+    return re.sub(r"[^0-9A-Za-z]+", "_", path).strip("_")[:60] or "root"
+
+
+class ProfilingMiddleware:
+    """WSGI middleware that profiles requests which ask for it.
+
+    The request runs under cProfile with tracemalloc tracking allocations,
+    and its response body is consumed inside the profile so streamed work
+    is included. Each capture writes <name>.prof (load it with pstats or
+    snakeviz), <name>.txt (top functions and allocation sites) and
+    <name>.json (timing and peak memory) to ``profile_dir``. One request is
+    profiled at a time; others that ask meanwhile run normally. Requests
+    that do not ask only pay for a header and query string check.
+    """
+
+    def __init__(self, wsgi_app, profile_dir, max_profiles=MAX_PROFILES):
+        self.wsgi_app = wsgi_app
+        self.profile_dir = profile_dir
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def __call__(self, environ, start_response):
+        if environ.get(PROFILE_HEADER) != "1" and PROFILE_PARAM not in f"&{environ.get('QUERY_STRING', '')}&":
+            return self.wsgi_app(environ, start_response)
+        if not self._lock.acquire(blocking=False):
+            logging.info("Profiler busy, not profiling %s", environ.get("PATH_INFO"))
+            return self.wsgi_app(environ, start_response)
+        try:
+            return self._profile(environ, start_response)
+        finally:
+            self._lock.release()
+
+    def _profile(self, environ, start_response):
+        method = environ.get("REQUEST_METHOD", "GET")
+        path = environ.get("PATH_INFO", "/")
+        now = time.time()
+        # Names sort chronologically; the pid keeps gunicorn workers apart
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+        name = f"{stamp}-{int(now * 1000) % 1000:03d}-{os.getpid()}-{method}-{_slug(path)}"
+        response = {}
+
+        def capture(status, headers, exc_info=None):
+            response["status"] = status
+            headers = list(headers) + [("X-Profile-Id", name)]
+            return start_response(status, headers, exc_info)
+
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            result = self.wsgi_app(environ, capture)
+            try:
+                body = list(result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+        finally:
+            profiler.disable()
+            wall_ms = (time.perf_counter() - started) * 1000
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            if not was_tracing:
+                tracemalloc.stop()
+            try:
+                self._save(name, profiler, snapshot, {
+                    "name": name,
+                    "method": method,
+                    "path": path,
+                    "query": environ.get("QUERY_STRING", ""),
+                    "status": response.get("status"),
+                    "wall_ms": round(wall_ms, 3),
+                    "peak_memory_bytes": peak,
+                    "created_at": time.time(),
+                })
+            except OSError as e:
+                logging.error("Could not save profile %s: %s", name, e)
+        return body
+
+    def _save(self, name, profiler, snapshot, meta):
+        base = os.path.join(self.profile_dir, name)
+        profiler.dump_stats(base + ".prof")
+
+        report = io.StringIO()
+        report.write(f"{meta['method']} {meta['path']} -> {meta['status']}\n")
+        report.write(f"wall: {meta['wall_ms']:.1f} ms, peak traced memory: {meta['peak_memory_bytes'] / 1024:.1f} KiB\n\n")
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(40)
+        report.write("\nTop allocation sites still held at the end of the request:\n")
+        for stat in snapshot.statistics("lineno")[:20]:
+            report.write(f"{stat}\n")
+        with open(base + ".txt", "w") as f:
+            f.write(report.getvalue())
+        with open(base + ".json", "w") as f:
+            json.dump(meta, f)
+
+        logging.info("Saved profile %s (%.1f ms, peak %d bytes)", name, meta["wall_ms"], meta["peak_memory_bytes"])
+        self._prune()
+
+    def _prune(self):
+        names = sorted(f[:-5] for f in os.listdir(self.profile_dir) if f.endswith(".json"))
+        for name in names[:-self.max_profiles]:
+            for ext in (".prof", ".txt", ".json"):
+                path = os.path.join(self.profile_dir, name + ext)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def list_profiles(self):
+        """Metadata of the captured profiles, newest first."""
+        profiles = []
+        for filename in sorted(os.listdir(self.profile_dir), reverse=True):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.profile_dir, filename)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+
+def enable_profiling(app, profile_dir, max_profiles=MAX_PROFILES):
+    """Install ProfilingMiddleware on a Flask app and add the /profiles endpoints."""
+    from flask import jsonify, send_from_directory
+
+    middleware = ProfilingMiddleware(app.wsgi_app, profile_dir, max_profiles)
+    app.wsgi_app = middleware
+
+    @app.route('/profiles', methods=['GET'])
+    def list_profiles():
+        profiles = middleware.list_profiles()
+        for profile in profiles:
+            profile["prof_url"] = f"/profiles/{profile['name']}.prof"
+            profile["report_url"] = f"/profiles/{profile['name']}.txt"
+        return jsonify({"profiles": profiles})
+
+    @app.route('/profiles/<filename>', methods=['GET'])
+    def get_profile(filename):
+        if not _NAME_PATTERN.match(filename) or not filename.endswith((".prof", ".txt", ".json")):
+            return jsonify({"error": "Profile not found."}), 404
+        return send_from_directory(profile_dir, filename, as_attachment=filename.endswith(".prof"))
+
+    logging.info("Request profiling enabled, writing to %s", profile_dir)
+    return middleware
@@ -0,0 +1,251 @@
+"""Bulk export and import of quotes as NDJSON, one quote entry per line.
+
+Export streams the quote store in batches; import reads its input line
+by line and commits in batches, so memory use does not depend on the
+number of quotes. Imported quotes are validated like /submit: a client
+name and at least one product are required, and products are re-parsed
+with quote_pricing's rules, so line totals are recomputed and rounded the
+same way. Lines that fail are reported by line number and skipped.
+
+Usage:
+  python quote_bulk.py [--db PATH] export [-o quotes.ndjson]
+  python quote_bulk.py [--db PATH] [--uploads PATH] import quotes.ndjson [--batch-size 500] [--skip-existing]
+A file name of "-" means stdout or stdin.
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+
+from quote_store import SQLiteQuoteStore
+from quote_history import QuoteHistory
+from quote_pricing import normalize_products
+from blob_store import BlobStore, quote_blob_names, is_upload_name
+from analytics import SalesRollups
+
+DEFAULT_BATCH_SIZE = 500
+# Longer lines are rejected without being read into memory
+MAX_LINE_BYTES = 1024 * 1024
+# Failed lines listed in an import report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+LEGACY_PRODUCT_FIELDS = ("Product", "Color", "Footage", "PricePerFt")
+
+
+def iter_export_lines(store):
+    """Yield every quote entry as one NDJSON line (bytes)."""
+    for entry in store.iter_quotes():
+        yield json.dumps(entry, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def read_lines(stream, max_line_bytes=MAX_LINE_BYTES):
+    """Yield (line_number, line) from a binary stream, reading one line at a time.
+
+    A line longer than ``max_line_bytes`` is yielded as None after the
+    rest of it has been skipped.
+    """
+    line_number = 0
+    while True:
+        line = stream.readline(max_line_bytes + 1)
+        if not line:
+            return
+        line_number += 1
+        if len(line) > max_line_bytes and not line.endswith(b"\n"):
+            # Skip to the end of the oversized line
+            while True:
+                rest = stream.readline(max_line_bytes)
+                if not rest or rest.endswith(b"\n"):
+                    break
+            yield line_number, None
+            continue
+        yield line_number, line
+
+
+def validate_entry(entry):
+    """Check an imported quote entry and normalize its products. Raises ValueError."""
+    if not isinstance(entry, dict):
+        raise ValueError("Expected a JSON object.")
+    quote_id = entry.get("id")
+    if not isinstance(quote_id, str) or not quote_id.strip():
+        raise ValueError("Quote id is required.")
+    data = entry.get("data")
+    if not isinstance(data, dict):
+        raise ValueError("Quote data must be an object.")
+    if not isinstance(data.get("ClientName"), str) or not data["ClientName"].strip():
+        raise ValueError("Client name is required.")
+    if "Products" in data:
+        products = normalize_products(data["Products"])
+        data = dict(data, Products=products)
+    elif "Product" in data:
+        # Quotes saved before multiple products keep their single product
+        # in top-level fields; check it, but store it as it was
+        products = normalize_products([{field: data[field] for field in LEGACY_PRODUCT_FIELDS if field in data}])
+    else:
+        products = []
+    if not products:
+        raise ValueError("At least one product is required.")
+    images = data.get("Images")
+    if images is not None and (
+        not isinstance(images, dict) or not all(name is None or isinstance(name, str) for name in images.values())
+    ):
+        raise ValueError("Images must map fields to file names.")
+    if images and not all(is_upload_name(name) for name in images.values() if name):
+        raise ValueError("Image file names must be inside the upload folder.")
+    version = entry.get("version", 1)
+    if not isinstance(version, int) or version < 1:
+        raise ValueError("Version must be a positive integer.")
+    # Other entry keys (such as the legacy timestamp) are kept
+    return dict(entry, id=quote_id, data=data, is_generated=bool(entry.get("is_generated", False)), version=version)
+
+
+class ImportReport:
+    """Counts and the first MAX_REPORTED_ERRORS failures of an import."""
+
+    def __init__(self):
+        self.lines = 0
+        self.imported = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.error_count = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    def error(self, line_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_number, "error": message})
+
+    def as_dict(self):
+        return {
+            "lines": self.lines,
+            "imported": self.imported,
+            "unchanged": self.unchanged,
+            "skipped": self.skipped,
+            "error_count": self.error_count,
+            "errors": self.errors,
+            "seconds": round(time.perf_counter() - self.started, 3),
+        }
+
+
+def import_lines(store, lines, history=None, blob_store=None, rollups=None, batch_size=DEFAULT_BATCH_SIZE, skip_existing=False, progress=None):
+    """Import (line_number, line) pairs from read_lines. Returns an ImportReport.
+
+    Each batch is one transaction in which the quotes, their history,
+    their image reference counts and the sales rollups are written
+    together. An existing quote
+    is replaced, recording the import as its next version, unless
+    ``skip_existing`` is set. ``progress`` is called with the report after
+    every batch.
+    """
+    history = history or QuoteHistory(store)
+    report = ImportReport()
+    batch = []
+
+    def flush():
+        previous = store.get_many(entry["id"] for _, entry in batch)
+        with store.transaction() as conn:
+            for line_number, entry in batch:
+                old = previous.get(entry["id"])
+                if old is not None and skip_existing:
+                    report.skipped += 1
+                    continue
+                version = history.append(conn, entry["id"], old, entry["data"], first_version=entry["version"])
+                if old is not None and version == old.get("version", 1):
+                    report.unchanged += 1
+                    continue
+                entry["version"] = version
+                store._upsert(conn, entry)
+                if rollups is not None:
+                    rollups.record(conn, old, entry)
+                if blob_store is not None:
+                    blob_store.update_refs(conn, quote_blob_names(old), quote_blob_names(entry))
+                # Later lines for the same quote build on this one
+                previous[entry["id"]] = entry
+                report.imported += 1
+            store._prune_changes(conn)
+        batch.clear()
+        if progress is not None:
+            progress(report)
+
+    for line_number, line in lines:
+        report.lines = line_number
+        if line is None:
+            report.error(line_number, f"Line is longer than {MAX_LINE_BYTES} bytes.")
+            continue
+        if not line.strip():
+            continue
+        try:
+            entry = validate_entry(json.loads(line))
+        except ValueError as e:
+            # json.JSONDecodeError and UnicodeDecodeError are ValueErrors too
+            report.error(line_number, str(e))
+            continue
+        batch.append((line_number, entry))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import quotes as NDJSON.")
+    parser.add_argument("--db", default="/persistent/quotes.db", help="Path to the SQLite quote store")
+    parser.add_argument("--uploads", default="/persistent/uploads", help="Upload folder holding quote images")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write every quote as NDJSON")
+    export_parser.add_argument("-o", "--output", default="-", help="Output file (default: stdout)")
+    import_parser = subparsers.add_parser("import", help="Import quotes from NDJSON")
+    import_parser.add_argument("input", help="NDJSON file, or - for stdin")
+    import_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Quotes per transaction")
+    import_parser.add_argument("--skip-existing", action="store_true", help="Leave quotes that already exist unchanged")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = SQLiteQuoteStore(args.db)
+
+    if args.command == "export":
+        out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+        try:
+            count = 0
+            for line in iter_export_lines(store):
+                out.write(line)
+                count += 1
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        print(f"Exported {count} quotes", file=sys.stderr)
+        return
+
+    def progress(report):
+        print(f"\r{report.lines} lines, {report.imported} imported, {report.error_count} errors", end="", file=sys.stderr, flush=True)
+
+    stream = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    try:
+        report = import_lines(
+            store, read_lines(stream),
+            blob_store=BlobStore(store, args.uploads),
+            rollups=SalesRollups(store),
+            batch_size=args.batch_size,
+            skip_existing=args.skip_existing,
+            progress=progress,
+        )
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+    print(file=sys.stderr)
+    for error in report.errors:
+        print(f"line {error['line']}: {error['error']}", file=sys.stderr)
+    if report.error_count > len(report.errors):
+        print(f"... and {report.error_count - len(report.errors)} more errors", file=sys.stderr)
+    result = report.as_dict()
+    print(
+        f"{result['imported']} imported, {result['unchanged']} unchanged, {result['skipped']} skipped, "
+        f"{result['error_count']} errors in {result['lines']} lines ({result['seconds']:.1f} s)"
+    )
+    if report.error_count:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""One printable PDF holding many quotes, such as a day's or an Area's.
+
+The quotes are drawn one after another on a single StreamedDocument, so
+the logos, the static page layers and the fonts are stored once in the
+bundle instead of once per quote, and each quote is written out as soon
+as it is drawn: memory stays that of one quote however many are bundled.
+
+Usage: python quote_bundle.py [--date-from D] [--date-to D] [--quoted-by NAME]
+       [--area AREA] [--output PATH] [quote_id ...]
+"""
+import sys
+import time
+import itertools
+import argparse
+import logging
+
+from quote_store import SQLiteQuoteStore
+
+# Same locations as app.py
+QUOTE_DB_PATH = "/persistent/quotes.db"
+UPLOAD_FOLDER = "/persistent/uploads"
+
+
+def select_quotes(store, quote_ids=None, **filters):
+    """The stored quotes to bundle: ``quote_ids`` in order if given, else
+    those matching ``filters`` (see find_quotes). Missing ids are skipped.
+    """
+    if not quote_ids:
+        return store.find_quotes(**filters)
+    return (quote for quote in map(store.get, quote_ids) if quote is not None)
+
+
+def iter_bundle(quotes, upload_folder, title="Quotes"):
+    """Yield a PDF of every quote in ``quotes`` chunk by chunk.
+
+    ``quotes`` is an iterable of stored quote entries; it is consumed as
+    the bundle is written.
+    """
+    from pdf_stream import StreamedDocument
+    from quote_pdf import draw_quote
+
+    document = StreamedDocument(title=title)
+    count = 0
+    for quote in quotes:
+        draw_quote(document.canvas, quote["data"], upload_folder)
+        count += 1
+        yield from document.flush()
+    yield from document.close()
+    logging.debug("Bundled %s quotes in %s pages", count, document.page_count)
+
+
+def write_bundle(quotes, upload_folder, out):
+    """Write the bundle of ``quotes`` to the binary file object ``out``. Returns the bytes written."""
+    written = 0
+    for chunk in iter_bundle(quotes, upload_folder):
+        out.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write stored quotes to one printable PDF.")
+    parser.add_argument("--db", default=QUOTE_DB_PATH, help="Path to the SQLite quote store")
+    parser.add_argument("--uploads", default=UPLOAD_FOLDER, help="Upload folder holding quote images")
+    parser.add_argument("--date-from", help="First quote date (YYYY-MM-DD)")
+    parser.add_argument("--date-to", help="Last quote date (YYYY-MM-DD)")
+    parser.add_argument("--quoted-by", help="Only quotes by this person")
+    parser.add_argument("--area", help="Only quotes in this Area")
+    parser.add_argument("--output", default="quotes_bundle.pdf", help="Output file, or - for stdout")
+    parser.add_argument("quote_ids", nargs="*", help="Bundle these quotes instead of filtering")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = SQLiteQuoteStore(args.db)
+    quotes = select_quotes(
+        store, args.quote_ids,
+        date_from=args.date_from, date_to=args.date_to, quoted_by=args.quoted_by, area=args.area,
+    )
+    first = next(quotes, None)
+    if first is None:
+        print("No quotes match.", file=sys.stderr)
+        sys.exit(1)
+    quotes = itertools.chain([first], quotes)
+
+    started = time.perf_counter()
+    if args.output == "-":
+        written = write_bundle(quotes, args.uploads, sys.stdout.buffer)
+    else:
+        with open(args.output, "wb") as out:
+            written = write_bundle(quotes, args.uploads, out)
+    print(
+        f"Wrote {written / 1e6:.1f} MB in {time.perf_counter() - started:.1f} s",
+        file=sys.stderr if args.output == "-" else sys.stdout,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""Append-only version history of quotes.
+
+Every save that changes a quote appends a row to the quote_versions table.
+Most rows hold a field-level delta against the previous version; every
+SNAPSHOT_INTERVAL-th version holds the full quote data, so rebuilding any
+version reads one snapshot and at most SNAPSHOT_INTERVAL - 1 deltas. The
+latest version is also the quote's row in the quotes table, so reading it
+never touches the history.
+
+Usage: python quote_history.py [--db PATH] compact --keep N [quote_id ...]
+"""
+import json
+import time
+import logging
+import argparse
+
+from quote_store import SQLiteQuoteStore
+
+# A full copy of the quote data is stored every this many versions
+SNAPSHOT_INTERVAL = 10
+
+SNAPSHOT = "snapshot"
+DELTA = "delta"
+
+
+def diff(old, new):
+    """Field-level delta turning dict ``old`` into dict ``new``.
+
+    Nested dicts (such as Images) are diffed recursively; any other changed
+    value, lists included, is stored whole. Returns {} when nothing changed.
+    """
+    changed = {}
+    nested = {}
+    for key, value in new.items():
+        if key not in old:
+            changed[key] = value
+        elif old[key] != value:
+            if isinstance(value, dict) and isinstance(old[key], dict):
+                nested[key] = diff(old[key], value)
+            else:
+                changed[key] = value
+    removed = [key for key in old if key not in new]
+
+    delta = {}
+    if changed:
+        delta["set"] = changed
+    if removed:
+        delta["unset"] = removed
+    if nested:
+        delta["nested"] = nested
+    return delta
+
+
+def apply(data, delta):
+    """Apply a delta from diff() to ``data`` in place and return it."""
+    for key in delta.get("unset", ()):
+        data.pop(key, None)
+    data.update(delta.get("set", {}))
+    for key, sub_delta in delta.get("nested", {}).items():
+        apply(data.setdefault(key, {}), sub_delta)
+    return data
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"))
+
+
+class QuoteHistory:
+    """Version history of the quotes in a quote store.
+
+    Writes take the connection of an open store transaction, so a version
+    is recorded atomically with the quote it belongs to. With ``keep`` set,
+    older versions are compacted away as new ones are appended.
+    """
+
+    def __init__(self, store, snapshot_interval=SNAPSHOT_INTERVAL, keep=None):
+        self.store = store
+        self.snapshot_interval = max(1, snapshot_interval)
+        # Versions kept per quote; None keeps all of them
+        self.keep = keep
+
+    def latest_version(self, quote_id):
+        row = self.store.conn.execute(
+            "SELECT MAX(version) FROM quote_versions WHERE quote_id = ?", (quote_id,)
+        ).fetchone()
+        return row[0] or 0
+
+    def append(self, conn, quote_id, previous, data, created_at=None, first_version=1):
+        """Record ``data`` as the next version of a quote. Returns its version number.
+
+        ``previous`` is the quote entry being replaced, or None for a new
+        quote, whose history starts at ``first_version``. A quote saved
+        before history was kept gets its previous data recorded first, so
+        its history starts from what was stored. Saving unchanged data
+        records nothing and returns the current version.
+        """
+        created_at = time.time() if created_at is None else created_at
+        row = conn.execute(
+            """
+            SELECT version FROM quote_versions WHERE quote_id = ?
+            ORDER BY version DESC LIMIT 1
+            """,
+            (quote_id,),
+        ).fetchone()
+        if row is None and previous is not None:
+            last_version = previous.get("version") or 1
+            self._insert(conn, quote_id, last_version, SNAPSHOT, previous["data"], created_at)
+        elif row is None:
+            return self._insert(conn, quote_id, first_version, SNAPSHOT, data, created_at)
+        else:
+            last_version = row["version"]
+
+        delta = diff(previous["data"] if previous is not None else {}, data)
+        if not delta:
+            return last_version
+        version = last_version + 1
+        # Also snapshot when the stored quote was written without recording
+        # history, since a delta against it would not rebuild
+        in_sync = previous is not None and (previous.get("version") or 1) == last_version
+        if (version - 1) % self.snapshot_interval == 0 or not in_sync:
+            self._insert(conn, quote_id, version, SNAPSHOT, data, created_at)
+        else:
+            self._insert(conn, quote_id, version, DELTA, delta, created_at)
+        if self.keep and version % self.snapshot_interval == 0:
+            # Amortized: at most once per snapshot interval
+            self.compact(quote_id, self.keep)
+        return version
+
+    def _insert(self, conn, quote_id, version, kind, payload, created_at):
+        payload_json = _dumps(payload)
+        conn.execute(
+            """
+            INSERT INTO quote_versions (quote_id, version, kind, payload, size, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (quote_id, version, kind, payload_json, len(payload_json), created_at),
+        )
+        return version
+
+    def versions(self, quote_id):
+        """Metadata of every recorded version of a quote, oldest first."""
+        versions = []
+        for row in self.store.conn.execute(
+            "SELECT version, kind, payload, size, created_at FROM quote_versions WHERE quote_id = ? ORDER BY version",
+            (quote_id,),
+        ):
+            payload = json.loads(row["payload"])
+            if row["kind"] == DELTA:
+                changed = sorted(set(payload.get("set", {})) | set(payload.get("unset", ())) | set(payload.get("nested", {})))
+            else:
+                changed = None
+            versions.append({
+                "version": row["version"],
+                "kind": row["kind"],
+                "created_at": row["created_at"],
+                "bytes": row["size"],
+                # None for snapshots, which record the whole quote
+                "changed_fields": changed,
+            })
+        return versions
+
+    def get_version(self, quote_id, version, conn=None):
+        """Rebuild the quote data of one version, or return None if it is not recorded."""
+        conn = conn or self.store.conn
+        rows = conn.execute(
+            """
+            SELECT version, kind, payload FROM quote_versions
+            WHERE quote_id = ? AND version <= ? AND version >= (
+                SELECT MAX(version) FROM quote_versions
+                WHERE quote_id = ? AND version <= ? AND kind = 'snapshot'
+            )
+            ORDER BY version
+            """,
+            (quote_id, version, quote_id, version),
+        ).fetchall()
+        if not rows or rows[-1]["version"] != version:
+            return None
+        data = json.loads(rows[0]["payload"])
+        for row in rows[1:]:
+            apply(data, json.loads(row["payload"]))
+        return data
+
+    def delete(self, conn, quote_id):
+        """Forget the history of a deleted quote."""
+        conn.execute("DELETE FROM quote_versions WHERE quote_id = ?", (quote_id,))
+
+    def compact(self, quote_id, keep):
+        """Drop all but the newest ``keep`` versions of a quote. Returns the count removed.
+
+        The oldest version kept is rewritten as a snapshot, so the versions
+        that remain still rebuild.
+        """
+        keep = max(1, keep)
+        with self.store.transaction() as conn:
+            latest = conn.execute(
+                "SELECT MAX(version) FROM quote_versions WHERE quote_id = ?", (quote_id,)
+            ).fetchone()[0]
+            if latest is None:
+                return 0
+            oldest_kept = latest - keep + 1
+            row = conn.execute(
+                "SELECT kind, created_at FROM quote_versions WHERE quote_id = ? AND version = ?",
+                (quote_id, oldest_kept),
+            ).fetchone()
+            if row is None:
+                # Fewer than keep versions, or already compacted this far
+                return 0
+            if row["kind"] != SNAPSHOT:
+                data = self.get_version(quote_id, oldest_kept, conn=conn)
+                payload_json = _dumps(data)
+                conn.execute(
+                    "UPDATE quote_versions SET kind = ?, payload = ?, size = ? WHERE quote_id = ? AND version = ?",
+                    (SNAPSHOT, payload_json, len(payload_json), quote_id, oldest_kept),
+                )
+            cursor = conn.execute(
+                "DELETE FROM quote_versions WHERE quote_id = ? AND version < ?", (quote_id, oldest_kept)
+            )
+        if cursor.rowcount:
+            logging.debug("Compacted history of %s to versions %s-%s", quote_id, oldest_kept, latest)
+        return cursor.rowcount
+
+    def compact_all(self, keep, quote_ids=None):
+        """Compact the history of every quote (or of ``quote_ids``). Returns the count removed."""
+        if quote_ids is None:
+            quote_ids = [
+                row["quote_id"]
+                for row in self.store.conn.execute(
+                    "SELECT quote_id FROM quote_versions GROUP BY quote_id HAVING COUNT(*) > ?", (keep,)
+                )
+            ]
+        return sum(self.compact(quote_id, keep) for quote_id in quote_ids)
+
+    def total_size(self):
+        return self.store.conn.execute("SELECT COALESCE(SUM(size), 0) FROM quote_versions").fetchone()[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage quote version history.")
+    parser.add_argument("--db", default="/persistent/quotes.db", help="Path to the SQLite quote store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser("compact", help="Drop old versions")
+    compact_parser.add_argument("--keep", type=int, required=True, help="Versions to keep per quote")
+    compact_parser.add_argument("quote_ids", nargs="*", help="Only compact these quotes")
+    args = parser.parse_args(argv)
+
+    history = QuoteHistory(SQLiteQuoteStore(args.db))
+    if args.command == "compact":
+        before = history.total_size()
+        removed = history.compact_all(args.keep, quote_ids=args.quote_ids or None)
+        print(f"Removed {removed} versions ({before - history.total_size()} bytes)")
+
+
+if __name__ == '__main__':
+    main()
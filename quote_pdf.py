@@ -0,0 +1,384 @@
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+from reportlab.lib import colors
+import os
+import logging
+
+from quote_pricing import calculate_totals, quote_products, round_up_to_2_decimals
+from pdf_assets import asset_cache, draw_asset
+from pdf_layout import PageSpool, StaticLayer, TableLayout, pin_fonts, string_width, wrap_lines
+from image_ingest import print_image_path
+
+base_dir = os.path.abspath(os.path.dirname(__file__))
+
+# Static images are in the app directory
+IMAGES_FOLDER = os.path.join(base_dir, "static", "images")
+
+# Define paths to static images
+LOGO_PATH = os.path.join(IMAGES_FOLDER, "logo.png")
+CHBA_LOGO_PATH = os.path.join(IMAGES_FOLDER, "CHB.png")
+WCB_LOGO_PATH = os.path.join(IMAGES_FOLDER, "wcb.png")
+VISA_LOGO_PATH = os.path.join(IMAGES_FOLDER, "visa.png")
+AMEX_LOGO_PATH = os.path.join(IMAGES_FOLDER, "amex_logo.png")
+MASTERCARD_LOGO_PATH = os.path.join(IMAGES_FOLDER, "mastercard_logo.png")
+
+IMAGE_FIELDS = ["fileUpload", "extraImage1", "extraImage2", "extraImage3", "extraImage4", "extraImage5"]
+IMAGE_NAMES = ["Primary Image", "Extra Image 1", "Extra Image 2", "Extra Image 3", "Extra Image 4", "Extra Image 5"]
+
+# Header logos: (path, x, offset from the top of the page, width, height)
+HEADER_LOGOS = [
+    (LOGO_PATH, 40, 60, 100, 50),
+    (CHBA_LOGO_PATH, 220, 60, 80, 40),
+    (WCB_LOGO_PATH, 310, 60, 80, 40),
+    (VISA_LOGO_PATH, 430, 50, 50, 30),
+    (AMEX_LOGO_PATH, 490, 50, 50, 30),
+    (MASTERCARD_LOGO_PATH, 550, 50, 50, 30),
+]
+
+OFFICE_SECTIONS = [
+    [
+        "5520-4th Street SE",
+        "Calgary, Alberta",
+        "T2H 1K7"
+    ],
+    [
+        "Our Regular Office Hours:",
+        "Monday – Friday: 8:00 am to 4:30pm",
+        "Closed: Saturdays & Sundays",
+        "Pickups before 4:00"
+    ],
+    [
+        "Web: www.home-rail.com",
+        "Phone: (403) 202-5493",
+        "Toll Free: 1-844-402-5493",
+        "Warehouse: (587) 317-6052"
+    ],
+    [
+        "Accounting: (587) 320-1116",
+        "Scheduling: (587) 320-1117",
+        "Sales: (587) 320-1118"
+    ],
+]
+OFFICE_SECTION_WIDTH = 125
+OFFICE_X_POSITIONS = [50, 175, 300, 425]
+
+INFO_LABELS = ["Name", "Phone", "Email", "Address", "Area", "Date", "Quoted By", "Install Type", "Lead Time"]
+INFO_KEYS = ["ClientName", "Phone", "Email", "Address", "Area", "QuoteDate", "QuotedBy", "InstallType", "LeadTime"]
+
+# Product table: (heading, x, width, wrap); Product and Color wrap within
+# their columns, the amounts stay on one line
+TABLE_COLUMNS = [
+    ("Product", 50, 195, True),
+    ("Color", 250, 95, True),
+    ("Footage", 350, 65, False),
+    ("Price/FT", 420, 65, False),
+    ("Line Total", 490, 60, False),
+]
+PRODUCT_TABLE = TableLayout([(x, width, wrap) for _, x, width, wrap in TABLE_COLUMNS])
+# Lowest baseline for table rows, and the height of the totals and
+# signature lines that follow the last row
+TABLE_BOTTOM = 50
+TOTALS_HEIGHT = 20 + 4 * 15 + 40 + 20
+# Baseline of the heading on continuation pages
+CONTINUED_TOP = 150
+
+TERMS_MAX_WIDTH = 490
+AUTH_TEXT = (
+    "If payment is made by credit card, I hereby authorize Home-Rail Ltd. to credit the "
+    "balance of the proposal upon completion with the above credit card. Home-Rail Ltd. "
+    "shall not be responsible for any delays resulting from strikes, fires, accidents, or "
+    "shipping/freight delays beyond its reasonable control."
+)
+ACCEPT_TEXT = (
+    "Acceptance of Proposal – The above prices, specifications, and conditions are "
+    "satisfactory and hereby accepted. You are authorized to do the work as specified. "
+    "Payment will be as outlined above."
+)
+
+
+def _draw_first_page(c):
+    """Office details, the Basic Information heading and its field labels."""
+    _, height = letter
+    c.setFont("Helvetica", 8)
+    for x, section in zip(OFFICE_X_POSITIONS, OFFICE_SECTIONS):
+        y_temp = height - 140
+        for line in section:
+            line_width = string_width(line, "Helvetica", 8)
+            c.drawString(x + (OFFICE_SECTION_WIDTH - line_width) / 2, y_temp, line)
+            y_temp -= 9
+
+    y = height - 190
+    c.setFont("Helvetica-Bold", 11)
+    c.drawString(50, y, "Basic Information")
+    y -= 5
+    c.line(50, y, 550, y)
+    y -= 15
+
+    c.setFont("Helvetica-Bold", 10)
+    for label in INFO_LABELS + ["Install Notes"]:
+        c.drawString(55, y, f"{label}:")
+        y -= 15
+
+
+def _table_heading(title):
+    """Drawing of the product table's section heading, rule and column headings, from y=0 down."""
+    def draw(c):
+        c.setFont("Helvetica-Bold", 11)
+        c.drawString(50, 0, title)
+        c.line(50, -5, 550, -5)
+        c.setFont("Helvetica-Bold", 10)
+        for label, x, _, _ in TABLE_COLUMNS:
+            c.drawString(x, -25, label)
+    return draw
+
+# Offset from the heading's baseline to the first row's
+TABLE_HEADING_HEIGHT = 45
+
+
+def _draw_approval(c):
+    """Signature lines under the totals, with the first at y=0."""
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(50, 0, "Client Signature: __________________________")
+    c.drawString(350, 0, "Date: __________")
+    c.drawString(50, -20, "Home Rail Rep Signature: __________________")
+    c.drawString(350, -20, "Date: __________")
+
+
+def _draw_terms(c):
+    """Card authorization, acceptance and signature block, from y=0 down."""
+    y = 0
+    c.setFont("Helvetica", 8)
+    c.drawString(50, y, "Name of Cardholder: __________________________")
+    y -= 12
+
+    # The authorization paragraph appears twice on the printed form
+    auth_lines = wrap_lines(AUTH_TEXT, TERMS_MAX_WIDTH, "Helvetica", 8)
+    for _ in range(2):
+        for line in auth_lines:
+            c.drawString(50, y, line)
+            y -= 6
+        y -= 6
+
+    for line in wrap_lines(ACCEPT_TEXT, TERMS_MAX_WIDTH, "Helvetica", 8):
+        c.drawString(50, y, line)
+        y -= 6
+    y -= 6
+
+    c.setFont("Helvetica-Bold", 8)
+    c.drawString(50, y, "Signature: X___________________________")
+    c.drawString(300, y, "Date of Acceptance: ___________________")
+    y -= 6
+    c.drawString(50, y, "Signature: ____________________________")
+    c.drawString(300, y, "Date: ________________________________")
+
+
+def terms_height():
+    """Distance from the top of the terms block to the line below it."""
+    auth = len(wrap_lines(AUTH_TEXT, TERMS_MAX_WIDTH, "Helvetica", 8))
+    accept = len(wrap_lines(ACCEPT_TEXT, TERMS_MAX_WIDTH, "Helvetica", 8))
+    return 12 + 2 * (auth * 6 + 6) + (accept * 6 + 6) + 12
+
+
+FIRST_PAGE_LAYER = StaticLayer("QuoteFirstPage", _draw_first_page)
+TABLE_HEADING_LAYER = StaticLayer("QuoteTableHeading", _table_heading("Quote Details"))
+TABLE_CONTINUED_LAYER = StaticLayer("QuoteTableContinued", _table_heading("Quote Details (Continued)"))
+APPROVAL_LAYER = StaticLayer("QuoteApproval", _draw_approval)
+TERMS_LAYER = StaticLayer("QuoteTerms", _draw_terms)
+STATIC_LAYERS = [FIRST_PAGE_LAYER, TABLE_HEADING_LAYER, TABLE_CONTINUED_LAYER, APPROVAL_LAYER, TERMS_LAYER]
+
+
+def warm_assets():
+    """Load the header logos and compile the static page layers for this process."""
+    asset_cache.warm(path for path, *_ in HEADER_LOGOS)
+    for layer in STATIC_LAYERS:
+        layer.compile()
+
+def draw_header(c, width, height):
+    for path, x, top_offset, logo_width, logo_height in HEADER_LOGOS:
+        # Missing logos are logged once by the asset cache
+        asset = asset_cache.get(path)
+        if asset is None:
+            continue
+        try:
+            draw_asset(c, asset, x, height - top_offset, logo_width, logo_height, preserveAspectRatio=True)
+        except Exception as e:
+            logging.error("Could not draw logo %s: %s", path, e)
+
+    c.setFont("Helvetica-Bold", 14)
+    c.drawCentredString(width / 2, height - 120, "Home Rail – Quote Summary")
+
+def draw_basic_info(c, data, height):
+    """The quote's Basic Information values and install notes, under the
+    labels of the first page layer. Returns the y of the table heading.
+    """
+    y = height - 210
+    for label, key in zip(INFO_LABELS, INFO_KEYS):
+        label_width = string_width(f"{label}:", "Helvetica-Bold", 10)
+        c.setFont("Helvetica", 10)
+        c.drawString(55 + label_width + 5, y, f"{data.get(key)}")
+        y -= 15
+
+    # The Install Notes label is part of the first page layer
+    install_notes = data.get("InstallNotes", "")
+    y -= 15
+
+    if install_notes:
+        c.setFont("Helvetica", 10)
+        max_width = 490
+        lines = wrap_lines(install_notes, max_width, "Helvetica", 10)
+        for line in lines:
+            c.drawString(55, y, line)
+            y -= 15
+    else:
+        y -= 15
+
+    return y - 10
+
+
+def draw_totals(c, totals, y):
+    """Subtotal, GST, total and deposit below the table's last row at y.
+    Returns the y of the approval lines.
+    """
+    y -= 20
+    c.setFont("Helvetica-Bold", 10)
+    right_edge = 550
+    financial_fields = [
+        ("Subtotal:", f"${totals['subtotal']:.2f}"),
+        ("GST (5%):", f"${totals['gst']:.2f}"),
+        ("Total:", f"${totals['total']:.2f}"),
+        ("Deposit:", f"${totals['deposit']:.2f}")
+    ]
+
+    for label, value in financial_fields:
+        c.drawString(350, y, label)
+        value_width = string_width(value, "Helvetica-Bold", 10)
+        c.drawString(right_edge - value_width, y, value)
+        y -= 15
+
+    return y - 40
+
+
+def product_rows(products):
+    """Cell texts of the product table, one row per product."""
+    for product in products:
+        yield (
+            product["Product"],
+            product.get("Color", ""),
+            str(product["Footage"]),
+            f"${product['PricePerFt']:.2f}",
+            # Quotes saved before rounding was stored only carry LineTotal
+            f"${product.get('LineTotalRounded', round_up_to_2_decimals(product.get('LineTotal', 0))):.2f}",
+        )
+
+
+def render_quote_pdf(data, pdf_path, upload_folder, progress=None):
+    """Render the quote PDF for a stored quote's data to pdf_path.
+
+    ``progress`` is called with a percentage as rendering advances. Returns
+    the number of pages.
+    """
+    c = canvas.Canvas(pdf_path, pagesize=letter)
+    pin_fonts(c)
+    # Finished pages wait on disk until the document is saved
+    spool = PageSpool(c)
+
+    logging.debug("Generating PDF at: %s", pdf_path)
+    pages = draw_quote(c, data, upload_folder, progress)
+    try:
+        c.save()
+    finally:
+        spool.close()
+    if progress is not None:
+        progress(100)
+    return pages
+
+
+def draw_quote(c, data, upload_folder, progress=None):
+    """Draw every page of a quote on ``c``, finishing its last page.
+
+    ``progress`` is called with a percentage as drawing advances. Returns
+    the number of pages drawn.
+    """
+    def report(percent):
+        if progress is not None:
+            progress(percent)
+
+    products = quote_products(data)
+    totals = calculate_totals(products)
+    stored_images = data.get("Images") or {}
+    width, height = letter
+    first_page = c.getPageNumber()
+
+    draw_header(c, width, height)
+    report(10)
+
+    FIRST_PAGE_LAYER.draw(c)
+    y = draw_basic_info(c, data, height)
+    TABLE_HEADING_LAYER.draw(c, 0, y)
+    y -= TABLE_HEADING_HEIGHT
+
+    def continue_table(c):
+        c.showPage()
+        draw_header(c, width, height)
+        TABLE_CONTINUED_LAYER.draw(c, 0, height - CONTINUED_TOP)
+        return height - CONTINUED_TOP - TABLE_HEADING_HEIGHT
+
+    y = PRODUCT_TABLE.draw_rows(c, product_rows(products), y, TABLE_BOTTOM, continue_table)
+    if y - TOTALS_HEIGHT < TABLE_BOTTOM:
+        # The totals and signatures stay together below the table
+        c.showPage()
+        draw_header(c, width, height)
+        y = height - CONTINUED_TOP
+
+    y = draw_totals(c, totals, y)
+    APPROVAL_LAYER.draw(c, 0, y)
+
+    c.showPage()
+    report(40)
+    y = height - 190
+
+    img_width, img_height = 230, 172.5
+    img_spacing_x, img_spacing_y = 8, 8
+    img_positions = [
+        (50, y),
+        (50 + img_width + img_spacing_x, y),
+        (50, y - img_height - img_spacing_y),
+        (50 + img_width + img_spacing_x, y - img_height - img_spacing_y),
+        (50, y - 2 * (img_height + img_spacing_y)),
+        (50 + img_width + img_spacing_x, y - 2 * (img_height + img_spacing_y))
+    ]
+
+    images = [(stored_images.get(field), name) for field, name in zip(IMAGE_FIELDS, IMAGE_NAMES)]
+
+    logging.debug("Images for PDF: %s", [img[0] for img in images if img[0]])
+    for i, (filename, img_name) in enumerate(images):
+        x_pos, y_pos = img_positions[i]
+        c.setLineWidth(1)
+        c.setStrokeColor(colors.grey)
+        c.rect(x_pos, y_pos, img_width, img_height)
+        if filename:
+            img_path = os.path.join(upload_folder, filename)
+            if os.path.exists(img_path):
+                # Embed the downscaled print copy rather than the full-size upload
+                print_path = print_image_path(upload_folder, filename)
+                try:
+                    c.drawImage(print_path, x_pos, y_pos, width=img_width, height=img_height, preserveAspectRatio=True)
+                    logging.debug("Successfully loaded %s at %s", img_name, print_path)
+                except Exception as e:
+                    logging.error("Failed to load %s at %s: %s", img_name, print_path, e)
+            else:
+                logging.error("Image file not found for %s: %s", img_name, img_path)
+        report(40 + 8 * (i + 1))
+
+    y = y - 2.87 * (img_height + img_spacing_y) - 28
+    TERMS_LAYER.draw(c, 0, y)
+    y -= terms_height()
+
+    footer_y = y - 10
+    c.setFont("Helvetica-Oblique", 8)
+    quoted_by = data.get("QuotedBy") or "System"
+    c.drawString(50, footer_y, f"Home-Rail Ltd. | www.homerailltd.com | Quote Generated by {quoted_by}")
+
+    pages = c.getPageNumber() - first_page + 1
+    c.showPage()
+    return pages
@@ -0,0 +1,245 @@
+"""Quick on-screen preview of a quote's first page.
+
+The page is drawn as SVG by replaying quote_pdf's layout: the static
+layers and the header are converted once per process and reused, and the
+quote's own text is placed with the same helpers and table layout as the
+PDF. Nothing is written to disk and no PDF is produced, so a preview
+costs a few milliseconds. Photos, which the PDF puts on its second page,
+are shown as thumbnails kept in a process-wide cache.
+"""
+import os
+import base64
+import logging
+import threading
+from html import escape
+from collections import OrderedDict
+from functools import lru_cache
+
+from reportlab.lib.pagesizes import letter
+
+from quote_pricing import calculate_totals, quote_products
+from image_ingest import derived_filename, thumbnail_jpeg
+from quote_pdf import (
+    HEADER_LOGOS, FIRST_PAGE_LAYER, TABLE_HEADING_LAYER, TABLE_HEADING_HEIGHT, APPROVAL_LAYER,
+    PRODUCT_TABLE, TABLE_BOTTOM, TOTALS_HEIGHT, draw_basic_info, draw_totals, product_rows,
+)
+
+# SVG attributes of the fonts the layout uses
+FONT_ATTRIBUTES = {
+    "Helvetica": "",
+    "Helvetica-Bold": ' font-weight="bold"',
+    "Helvetica-Oblique": ' font-style="italic"',
+}
+# Thumbnails kept per process
+THUMBNAIL_CACHE_ENTRIES = 256
+
+
+def _number(value):
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+class SvgCanvas:
+    """The subset of the ReportLab canvas the page layout uses, recorded as SVG.
+
+    Coordinates are PDF points with the origin at the bottom left, as on
+    the canvas; they are flipped into SVG's top-left origin as elements are
+    recorded.
+    """
+
+    def __init__(self, height=letter[1]):
+        self.height = height
+        self.parts = []
+        self._font = ("Helvetica", 10)
+        self._stroke = "#000"
+        self._line_width = 1
+        self._origin = (0, 0)
+        self._states = []
+
+    def setFont(self, font_name, font_size):
+        self._font = (font_name, font_size)
+
+    def setLineWidth(self, width):
+        self._line_width = width
+
+    def setStrokeColor(self, color):
+        self._stroke = "#%02x%02x%02x" % tuple(round(value * 255) for value in color.rgb())
+
+    def saveState(self):
+        self._states.append((self._font, self._stroke, self._line_width, self._origin))
+
+    def restoreState(self):
+        self._font, self._stroke, self._line_width, self._origin = self._states.pop()
+
+    def translate(self, dx, dy):
+        self._origin = (self._origin[0] + dx, self._origin[1] + dy)
+
+    def _point(self, x, y):
+        return _number(x + self._origin[0]), _number(self.height - (y + self._origin[1]))
+
+    def drawString(self, x, y, text, anchor="start"):
+        if not text:
+            return
+        font_name, font_size = self._font
+        sx, sy = self._point(x, y)
+        self.parts.append(
+            f'<text x="{sx}" y="{sy}" font-size="{_number(font_size)}"{FONT_ATTRIBUTES.get(font_name, "")}'
+            + (f' text-anchor="{anchor}"' if anchor != "start" else "")
+            + f">{escape(text)}</text>"
+        )
+
+    def drawCentredString(self, x, y, text):
+        self.drawString(x, y, text, anchor="middle")
+
+    def drawRightString(self, x, y, text):
+        self.drawString(x, y, text, anchor="end")
+
+    def line(self, x1, y1, x2, y2):
+        (sx1, sy1), (sx2, sy2) = self._point(x1, y1), self._point(x2, y2)
+        self.parts.append(
+            f'<line x1="{sx1}" y1="{sy1}" x2="{sx2}" y2="{sy2}" stroke="{self._stroke}" '
+            f'stroke-width="{_number(self._line_width)}"/>'
+        )
+
+    def rect(self, x, y, width, height):
+        sx, sy = self._point(x, y + height)
+        self.parts.append(
+            f'<rect x="{sx}" y="{sy}" width="{_number(width)}" height="{_number(height)}" fill="none" '
+            f'stroke="{self._stroke}" stroke-width="{_number(self._line_width)}"/>'
+        )
+
+    def image(self, href, x, y, width, height):
+        """Like drawImage with preserveAspectRatio, for an image the browser loads."""
+        sx, sy = self._point(x, y + height)
+        self.parts.append(
+            f'<image href="{escape(href)}" x="{sx}" y="{sy}" width="{_number(width)}" height="{_number(height)}" '
+            'preserveAspectRatio="xMidYMid meet"/>'
+        )
+
+    def layer(self, layer, x=0, y=0):
+        """Place a static layer like StaticLayer.draw; its SVG is built once per process."""
+        x, y = x + self._origin[0], y + self._origin[1]
+        self.parts.append(f'<g transform="translate({_number(x)} {_number(-y)})">{_layer_svg(layer)}</g>')
+
+    def svg(self):
+        return "".join(self.parts)
+
+
+@lru_cache(maxsize=None)
+def _layer_svg(layer):
+    c = SvgCanvas()
+    layer.replay(c)
+    return c.svg()
+
+
+@lru_cache(maxsize=8)
+def _header_svg(static_url):
+    """The logos and title of quote_pdf.draw_header. Logos are linked, not embedded."""
+    width, height = letter
+    c = SvgCanvas()
+    for path, x, top_offset, logo_width, logo_height in HEADER_LOGOS:
+        if os.path.exists(path):
+            c.image(static_url + os.path.basename(path), x, height - top_offset, logo_width, logo_height)
+    c.setFont("Helvetica-Bold", 14)
+    c.drawCentredString(width / 2, height - 120, "Home Rail – Quote Summary")
+    return c.svg()
+
+
+def render_first_page(data, static_url="/static/images/"):
+    """SVG of the first page of the PDF a quote's data would render to.
+
+    ``data`` is quote data as stored, legacy single-product quotes
+    included. Returns a dict
+    with the SVG markup, the number of products that continue on later
+    pages, and the totals, which are drawn on the page when they fit there.
+    """
+    width, height = letter
+    products = quote_products(data)
+    totals = calculate_totals(products)
+
+    c = SvgCanvas()
+    c.parts.append(_header_svg(static_url))
+    c.layer(FIRST_PAGE_LAYER)
+    y = draw_basic_info(c, data, height)
+    c.layer(TABLE_HEADING_LAYER, 0, y)
+    y -= TABLE_HEADING_HEIGHT
+
+    drawn = 0
+    c.setFont(PRODUCT_TABLE.font_name, PRODUCT_TABLE.font_size)
+    for row in product_rows(products):
+        cells, row_height = PRODUCT_TABLE.measure(row)
+        if y - (row_height - PRODUCT_TABLE.row_height) < TABLE_BOTTOM:
+            break
+        for (x, _, _), lines in zip(PRODUCT_TABLE.columns, cells):
+            for i, line in enumerate(lines):
+                c.drawString(x, y - i * PRODUCT_TABLE.line_height, line)
+        y -= row_height
+        drawn += 1
+
+    totals_on_page = drawn == len(products) and y - TOTALS_HEIGHT >= TABLE_BOTTOM
+    if totals_on_page:
+        y = draw_totals(c, totals, y)
+        c.layer(APPROVAL_LAYER, 0, y)
+
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {_number(width)} {_number(height)}" '
+        'font-family="Helvetica, Arial, sans-serif" style="white-space: pre">'
+        f'<rect width="100%" height="100%" fill="#fff"/>{c.svg()}</svg>'
+    )
+    return {
+        "svg": svg,
+        "more_products": len(products) - drawn,
+        "totals_on_page": totals_on_page,
+        "totals": totals,
+    }
+
+
+class ThumbnailCache:
+    """Process-wide cache of photo thumbnails as data: URIs.
+
+    Entries are keyed on the file's path, size and mtime, so a replaced
+    file gets a new thumbnail. The print copy is used when one has been
+    made, since it decodes much faster than a full-size upload.
+    """
+
+    def __init__(self, max_entries=THUMBNAIL_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, upload_folder, filename):
+        """Thumbnail of an upload, or None if it cannot be read."""
+        path = os.path.join(upload_folder, filename)
+        print_path = os.path.join(upload_folder, derived_filename(filename))
+        try:
+            st = os.stat(path)
+            if os.path.exists(print_path) and os.path.getmtime(print_path) >= st.st_mtime:
+                path = print_path
+                st = os.stat(path)
+        except OSError:
+            return None
+        key = (path, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            uri = self._entries.get(key)
+            if uri is not None:
+                self._entries.move_to_end(key)
+                return uri
+        uri = thumbnail_uri(path)
+        if uri is not None:
+            with self._lock:
+                self._entries[key] = uri
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return uri
+
+
+def thumbnail_uri(src):
+    """A thumbnail of an image path or file-like object as a data: URI, or None."""
+    try:
+        jpeg = thumbnail_jpeg(src)
+    except Exception as e:
+        logging.error("Could not make a preview thumbnail of %s: %s", src, e)
+        return None
+    return "data:image/jpeg;base64," + base64.b64encode(jpeg).decode("ascii")
+
+
+thumbnail_cache = ThumbnailCache()
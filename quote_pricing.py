@@ -0,0 +1,100 @@
+import re
+import math
+
+GST_RATE = 0.05
+
+PRODUCT_PATTERN = re.compile(r'Products\[(\d+)\]\[(\w+)\]')
+
+
+def round_up_to_2_decimals(value):
+    return math.ceil(value * 100) / 100
+
+
+def parse_products(form):
+    """Build the product list from Products[i][field] form keys.
+
+    Raises ValueError with a user-facing message if a footage or price is
+    not a number.
+    """
+    product_dict = {}
+    for key, value in form.items():
+        match = PRODUCT_PATTERN.match(key)
+        if match:
+            index, field = match.groups()
+            if index not in product_dict:
+                product_dict[index] = {}
+            product_dict[index][field] = value.strip()
+
+    products = []
+    # Numeric order, so product 10 comes after product 9
+    for index in sorted(product_dict.keys(), key=int):
+        product = product_dict[index]
+        try:
+            footage = float(product.get("Footage", 0))
+            price_per_ft = float(product.get("PricePerFt", 0))
+        except ValueError:
+            raise ValueError(f"Footage and Price for product {index} must be valid numbers.")
+        line_total = footage * price_per_ft
+        products.append({
+            "Product": product.get("Product", ""),
+            "Color": product.get("Color", ""),
+            "Footage": footage,
+            "PricePerFt": price_per_ft,
+            "LineTotal": line_total,
+            "LineTotalRounded": round_up_to_2_decimals(line_total),
+        })
+    return products
+
+
+def normalize_products(items):
+    """Re-parse a product list (e.g. from an import) with the same rules as the submit form.
+
+    Raises ValueError like parse_products, or if ``items`` is not a list of
+    objects.
+    """
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise ValueError("Products must be a list of objects.")
+    form = {
+        f"Products[{index}][{field}]": "" if item.get(field) is None else str(item[field])
+        for index, item in enumerate(items)
+        for field in ("Product", "Color", "Footage", "PricePerFt")
+        if field in item
+    }
+    # Products without any of the fields still count, as an empty form row would
+    for index, item in enumerate(items):
+        form.setdefault(f"Products[{index}][Product]", "")
+    return parse_products(form)
+
+
+def quote_products(data):
+    """The product list of stored quote data, as drawn on its PDF.
+
+    Quotes saved before multiple products keep their one product in
+    top-level fields, with the colour in RailColor; that line is parsed
+    like a form row. A legacy line that is not a number is left out.
+    """
+    products = data.get("Products")
+    if isinstance(products, list):
+        return products
+    if data.get("Product") is None:
+        return []
+    legacy = {field: data[field] for field in ("Product", "Footage", "PricePerFt") if field in data}
+    legacy["Color"] = data.get("RailColor", "")
+    try:
+        return normalize_products([legacy])
+    except ValueError:
+        return []
+
+
+def calculate_totals(products):
+    """Return the rounded subtotal, GST, total and 50% deposit for a product list."""
+    subtotal = sum(product["LineTotal"] for product in products)
+    gst = subtotal * GST_RATE
+    total = subtotal + gst
+    deposit = total / 2
+    return {
+        "subtotal": round_up_to_2_decimals(subtotal),
+        "gst": round_up_to_2_decimals(gst),
+        "total": round_up_to_2_decimals(total),
+        "deposit": round_up_to_2_decimals(deposit),
+    }
@@ -0,0 +1,308 @@
+import re
+import heapq
+import bisect
+import logging
+import threading
+
+# Relative weight of a match in each searchable field
+FIELD_WEIGHTS = {
+    "ClientName": 5.0,
+    "Address": 3.0,
+    "Phone": 2.0,
+    "Email": 2.0,
+    "Area": 1.5,
+    "Product": 1.0,
+}
+
+# Score multiplier for a prefix match compared to a whole-token match
+PREFIX_FACTOR = 0.5
+
+# Score levels up to this size are sorted directly; larger ones are
+# walked in date order instead.
+SORT_LIMIT = 2000
+
+# Once this few quotes match the earlier terms, later terms are checked
+# against each candidate's own tokens instead of the whole vocabulary.
+CANDIDATE_SCAN_LIMIT = 1000
+
+TOKEN_PATTERN = re.compile(r"[0-9a-z]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower()) if text else []
+
+
+def quote_tokens(entry):
+    """Return {token: weight} for the searchable fields of a quote entry."""
+    data = entry.get("data") or {}
+    weights = {}
+
+    def add(text, weight):
+        for token in tokenize(text):
+            if weights.get(token, 0) < weight:
+                weights[token] = weight
+
+    for field in ("ClientName", "Address", "Email", "Area"):
+        add(data.get(field), FIELD_WEIGHTS[field])
+
+    phone = data.get("Phone") or ""
+    add(phone, FIELD_WEIGHTS["Phone"])
+    # Also index the bare digits so "4032025493" finds "(403) 202-5493"
+    digits = "".join(ch for ch in phone if ch.isdigit())
+    if digits:
+        add(digits, FIELD_WEIGHTS["Phone"])
+
+    products = data.get("Products") or []
+    for product in products:
+        if isinstance(product, dict):
+            add(product.get("Product"), FIELD_WEIGHTS["Product"])
+    if not products:
+        # Quotes saved before multi-product support
+        add(data.get("Product"), FIELD_WEIGHTS["Product"])
+    return weights
+
+
+def quote_summary(entry):
+    data = entry.get("data") or {}
+    return {
+        "id": entry["id"],
+        "ClientName": data.get("ClientName") or "",
+        "Address": data.get("Address") or "",
+        "QuoteDate": data.get("QuoteDate") or "",
+        "is_generated": bool(entry.get("is_generated", False)),
+        "version": entry.get("version", 1),
+    }
+
+
+class QuoteSearchIndex:
+    """In-process inverted index over quote fields with prefix lookup.
+
+    Postings map each token to {weight: set of quote ids}. A sorted copy of
+    the vocabulary lets a query term expand to every token it prefixes with
+    a bisection, and scoring works on whole id sets per score level so broad
+    terms stay cheap. Quotes are also kept in (QuoteDate, id) order, which
+    lets the newest matches of a large score level be found without sorting
+    it. The index follows the quote store's change log, so writes made by
+    other gunicorn workers are picked up on the next sync.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}
+        self._vocabulary = []
+        self._quote_tokens = {}
+        self._summaries = {}
+        self._order = []
+        self._seq = None
+
+    def __len__(self):
+        return len(self._summaries)
+
+    @property
+    def is_built(self):
+        return self._seq is not None
+
+    def add(self, entry):
+        with self._lock:
+            quote_id = entry["id"]
+            self._remove(quote_id)
+            tokens = quote_tokens(entry)
+            for token, weight in tokens.items():
+                by_weight = self._postings.get(token)
+                if by_weight is None:
+                    by_weight = self._postings[token] = {}
+                    bisect.insort(self._vocabulary, token)
+                by_weight.setdefault(weight, set()).add(quote_id)
+            summary = quote_summary(entry)
+            self._quote_tokens[quote_id] = tokens
+            self._summaries[quote_id] = summary
+            bisect.insort(self._order, (summary["QuoteDate"], quote_id))
+
+    def remove(self, quote_id):
+        with self._lock:
+            self._remove(quote_id)
+
+    def _remove(self, quote_id):
+        for token, weight in self._quote_tokens.pop(quote_id, {}).items():
+            by_weight = self._postings.get(token)
+            if by_weight is None:
+                continue
+            ids = by_weight.get(weight)
+            if ids is not None:
+                ids.discard(quote_id)
+                if not ids:
+                    del by_weight[weight]
+            if not by_weight:
+                del self._postings[token]
+                i = bisect.bisect_left(self._vocabulary, token)
+                if i < len(self._vocabulary) and self._vocabulary[i] == token:
+                    del self._vocabulary[i]
+        summary = self._summaries.pop(quote_id, None)
+        if summary is not None:
+            key = (summary["QuoteDate"], quote_id)
+            i = bisect.bisect_left(self._order, key)
+            if i < len(self._order) and self._order[i] == key:
+                del self._order[i]
+
+    def build(self, entries):
+        """Replace the index contents with ``entries`` in one pass."""
+        postings = {}
+        quote_tokens_by_id = {}
+        summaries = {}
+        for entry in entries:
+            tokens = quote_tokens(entry)
+            for token, weight in tokens.items():
+                postings.setdefault(token, {}).setdefault(weight, set()).add(entry["id"])
+            quote_tokens_by_id[entry["id"]] = tokens
+            summaries[entry["id"]] = quote_summary(entry)
+        order = sorted((summary["QuoteDate"], quote_id) for quote_id, summary in summaries.items())
+        with self._lock:
+            self._postings = postings
+            self._vocabulary = sorted(postings)
+            self._quote_tokens = quote_tokens_by_id
+            self._summaries = summaries
+            self._order = order
+
+    def sync(self, store):
+        """Bring the index up to date with the store's change log."""
+        with self._lock:
+            if self._seq is not None:
+                changes, complete = store.changes_since(self._seq)
+                if complete:
+                    if changes:
+                        self._apply_changes(store, changes)
+                    return
+            # Read the sequence first so writes racing the scan are replayed
+            seq = store.last_change_seq()
+            self.build(store.iter_quotes())
+            self._seq = seq
+            logging.debug("Built search index with %s quotes", len(self._summaries))
+
+    def _apply_changes(self, store, changes):
+        latest_op = {}
+        for seq, quote_id, op in changes:
+            latest_op[quote_id] = op
+        upserted = [quote_id for quote_id, op in latest_op.items() if op == "upsert"]
+        entries = store.get_many(upserted)
+        for quote_id, op in latest_op.items():
+            entry = entries.get(quote_id)
+            if entry is None:
+                self.remove(quote_id)
+            else:
+                self.add(entry)
+        self._seq = changes[-1][0]
+
+    def _prefix_tokens(self, term):
+        vocabulary = self._vocabulary
+        start = bisect.bisect_left(vocabulary, term)
+        end = bisect.bisect_left(vocabulary, term + "\uffff", start)
+        return vocabulary[start:end]
+
+    def _term_levels(self, tokens, term):
+        """Return [(score, ids)] for ``term``, highest score first.
+
+        A quote matching several tokens keeps only its best score, so the
+        id sets are disjoint. Posting sets are shared, never mutated.
+        """
+        levels = {}
+        owned = set()
+        for token in tokens:
+            factor = 1.0 if token == term else PREFIX_FACTOR
+            for weight, ids in self._postings[token].items():
+                score = weight * factor
+                if score not in levels:
+                    levels[score] = ids
+                elif score in owned:
+                    levels[score] |= ids
+                else:
+                    levels[score] = levels[score] | ids
+                    owned.add(score)
+
+        result = []
+        seen = None
+        scores = sorted(levels, reverse=True)
+        for i, score in enumerate(scores):
+            ids = levels[score] - seen if seen else levels[score]
+            if ids:
+                result.append((score, ids))
+                if i + 1 < len(scores):
+                    seen = seen | ids if seen else ids
+        return result
+
+    def _candidate_levels(self, term, levels):
+        """Like _term_levels, but only for the quotes already in ``levels``."""
+        combined = {}
+        for score, ids in levels:
+            for quote_id in ids:
+                best = 0
+                for token, weight in self._quote_tokens[quote_id].items():
+                    if token.startswith(term):
+                        token_score = weight if token == term else weight * PREFIX_FACTOR
+                        if token_score > best:
+                            best = token_score
+                if best:
+                    combined.setdefault(score + best, set()).add(quote_id)
+        return sorted(combined.items(), reverse=True)
+
+    def _newest(self, ids, count):
+        """Return up to ``count`` ids from ``ids``, newest QuoteDate first."""
+        summaries = self._summaries
+        if len(ids) <= SORT_LIMIT:
+            return heapq.nlargest(count, ids, key=lambda quote_id: (summaries[quote_id]["QuoteDate"], quote_id))
+        # Large sets: walk the global date order until enough members are seen
+        picked = []
+        for quote_date, quote_id in reversed(self._order):
+            if quote_id in ids:
+                picked.append(quote_id)
+                if len(picked) == count:
+                    break
+        return picked
+
+    def search(self, query, limit=20):
+        """Return ranked summaries of quotes matching every query term.
+
+        Each term matches whole tokens or token prefixes, so "kor" finds
+        "Kornbrust". Results are ordered by score, then newest QuoteDate.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            # Most selective terms first, estimated from posting sizes
+            expansions = []
+            for term in terms:
+                tokens = self._prefix_tokens(term)
+                size = sum(len(ids) for token in tokens for ids in self._postings[token].values())
+                if not size:
+                    return []
+                expansions.append((size, term, tokens))
+            expansions.sort()
+
+            levels = None
+            for size, term, tokens in expansions:
+                if levels is None:
+                    levels = self._term_levels(tokens, term)
+                    continue
+                candidates = sum(len(ids) for score, ids in levels)
+                if candidates <= CANDIDATE_SCAN_LIMIT:
+                    levels = self._candidate_levels(term, levels)
+                else:
+                    term_levels = self._term_levels(tokens, term)
+                    combined = {}
+                    for score, ids in levels:
+                        for term_score, term_ids in term_levels:
+                            both = ids & term_ids
+                            if both:
+                                total = score + term_score
+                                combined[total] = combined[total] | both if total in combined else both
+                    levels = sorted(combined.items(), reverse=True)
+                if not levels:
+                    return []
+
+            results = []
+            for score, ids in levels:
+                for quote_id in self._newest(ids, limit - len(results)):
+                    results.append(dict(self._summaries[quote_id], score=round(score, 3)))
+                if len(results) >= limit:
+                    break
+            return results
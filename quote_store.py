@@ -0,0 +1,555 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import argparse
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version.
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS quotes (
+        id TEXT PRIMARY KEY,
+        client_name TEXT NOT NULL DEFAULT '',
+        address TEXT NOT NULL DEFAULT '',
+        quote_date TEXT NOT NULL DEFAULT '',
+        is_generated INTEGER NOT NULL DEFAULT 0,
+        version INTEGER NOT NULL DEFAULT 1,
+        body TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_quotes_client_name ON quotes(client_name COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS idx_quotes_address ON quotes(address COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS idx_quotes_quote_date ON quotes(quote_date);
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_quotes_date_id ON quotes(quote_date DESC, id DESC);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS quote_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        quote_id TEXT NOT NULL,
+        op TEXT NOT NULL
+    );
+    CREATE TRIGGER IF NOT EXISTS trg_quotes_insert AFTER INSERT ON quotes BEGIN
+        INSERT INTO quote_changes (quote_id, op) VALUES (NEW.id, 'upsert');
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_quotes_update AFTER UPDATE ON quotes BEGIN
+        INSERT INTO quote_changes (quote_id, op) VALUES (NEW.id, 'upsert');
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_quotes_delete AFTER DELETE ON quotes BEGIN
+        INSERT INTO quote_changes (quote_id, op) VALUES (OLD.id, 'delete');
+    END;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS render_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        quote_id TEXT NOT NULL,
+        pdf_filename TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        progress INTEGER NOT NULL DEFAULT 0,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        lease_until REAL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_render_jobs_status ON render_jobs(status, id);
+    CREATE INDEX IF NOT EXISTS idx_render_jobs_quote ON render_jobs(quote_id, id);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS blobs (
+        sha256 TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        touched_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced ON blobs(refcount, touched_at);
+    """,
+    """
+    ALTER TABLE quotes ADD COLUMN quoted_by TEXT NOT NULL DEFAULT '';
+    ALTER TABLE quotes ADD COLUMN area TEXT NOT NULL DEFAULT '';
+    UPDATE quotes SET
+        quoted_by = COALESCE(json_extract(body, '$.data.QuotedBy'), ''),
+        area = COALESCE(json_extract(body, '$.data.Area'), '');
+    CREATE INDEX IF NOT EXISTS idx_quotes_quoted_by ON quotes(quoted_by COLLATE NOCASE, quote_date);
+    CREATE INDEX IF NOT EXISTS idx_quotes_area ON quotes(area COLLATE NOCASE, quote_date);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS render_cache (
+        key TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        last_access REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_render_cache_last_access ON render_cache(last_access);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS quote_versions (
+        quote_id TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (quote_id, version)
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sales_rollups (
+        dimension TEXT NOT NULL,
+        day TEXT NOT NULL,
+        key TEXT NOT NULL COLLATE NOCASE,
+        quotes INTEGER NOT NULL,
+        footage REAL NOT NULL,
+        subtotal_cents INTEGER NOT NULL,
+        gst_cents INTEGER NOT NULL,
+        total_cents INTEGER NOT NULL,
+        deposit_cents INTEGER NOT NULL,
+        PRIMARY KEY (dimension, day, key)
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS uploads (
+        id TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        ext TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        sha256 TEXT,
+        blob_name TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_uploads_updated_at ON uploads(updated_at);
+    """,
+    # Rail colours are now read from the product lines; the next sales
+    # report rebuilds the rollups
+    """
+    DELETE FROM sales_rollups WHERE dimension = 'rail_color';
+    DELETE FROM meta WHERE key = 'sales_rollups_seq';
+    """,
+]
+
+# Number of change-log rows kept for followers such as the search index.
+CHANGE_LOG_RETENTION = 10000
+
+
+def _split_statements(script):
+    """Split a migration script into statements, keeping trigger bodies whole."""
+    statements = []
+    buffer = ""
+    for part in script.split(";"):
+        buffer += part + ";"
+        if sqlite3.complete_statement(buffer):
+            if buffer.strip(" \n;"):
+                statements.append(buffer.strip())
+            buffer = ""
+    return statements
+
+
+class QuoteStore(ABC):
+    """Interface for quote repositories used by the routes in app.py.
+
+    Entries are dicts shaped like the records in quote_data.json:
+    {"id": ..., "data": {...}, "is_generated": ..., "version": ...}.
+    """
+
+    @abstractmethod
+    def get(self, quote_id):
+        raise NotImplementedError
+
+    def exists(self, quote_id):
+        return self.get(quote_id) is not None
+
+    @abstractmethod
+    def upsert(self, entry):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, quote_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_quotes(self, batch_size=500):
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_summaries(self, limit=50, after=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_summaries(self, date_from=None, date_to=None, quoted_by=None, area=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_quotes(self, date_from=None, date_to=None, quoted_by=None, area=None, batch_size=100):
+        raise NotImplementedError
+
+    @abstractmethod
+    def changes_since(self, seq):
+        raise NotImplementedError
+
+
+class SQLiteQuoteStore(QuoteStore):
+    """Quote repository backed by a SQLite database in WAL mode.
+
+    Each thread (and each forked worker) gets its own connection, so the
+    store can be shared by gunicorn workers writing at the same time.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._migrate()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        return conn
+
+    @property
+    def conn(self):
+        # Connections must not cross a fork, so key them on the pid as well.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run a block inside a write transaction (BEGIN IMMEDIATE)."""
+        conn = self.conn
+        if conn.in_transaction:
+            # Nested use joins the outer transaction.
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def _migrate(self):
+        with self.transaction() as conn:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            for version, script in enumerate(MIGRATIONS[current:], start=current + 1):
+                for statement in _split_statements(script):
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version={version}")
+                logging.info("Migrated quote store %s to schema version %s", self.path, version)
+
+    @staticmethod
+    def _row_values(entry):
+        data = entry.get("data") or {}
+        return (
+            entry["id"],
+            data.get("ClientName") or "",
+            data.get("Address") or "",
+            data.get("QuoteDate") or "",
+            data.get("QuotedBy") or "",
+            data.get("Area") or "",
+            1 if entry.get("is_generated") else 0,
+            entry.get("version") or 1,
+            json.dumps(entry, separators=(",", ":")),
+            time.time(),
+        )
+
+    def get(self, quote_id):
+        row = self.conn.execute("SELECT body FROM quotes WHERE id = ?", (quote_id,)).fetchone()
+        return json.loads(row["body"]) if row else None
+
+    def exists(self, quote_id):
+        row = self.conn.execute("SELECT 1 FROM quotes WHERE id = ?", (quote_id,)).fetchone()
+        return row is not None
+
+    def upsert(self, entry):
+        """Insert or replace a quote atomically."""
+        with self.transaction() as conn:
+            self._upsert(conn, entry)
+            self._prune_changes(conn)
+        return entry["id"]
+
+    def _upsert(self, conn, entry):
+        conn.execute(
+            """
+            INSERT INTO quotes (id, client_name, address, quote_date, quoted_by, area, is_generated, version, body, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                client_name = excluded.client_name,
+                address = excluded.address,
+                quote_date = excluded.quote_date,
+                quoted_by = excluded.quoted_by,
+                area = excluded.area,
+                is_generated = excluded.is_generated,
+                version = excluded.version,
+                body = excluded.body,
+                updated_at = excluded.updated_at
+            """,
+            self._row_values(entry),
+        )
+
+    def delete(self, quote_id):
+        """Delete a quote atomically. Returns True if a quote was removed."""
+        with self.transaction() as conn:
+            cursor = conn.execute("DELETE FROM quotes WHERE id = ?", (quote_id,))
+            self._prune_changes(conn)
+        return cursor.rowcount > 0
+
+    def iter_quotes(self, batch_size=500):
+        """Yield every quote in insertion order.
+
+        Rows are fetched in keyset-paged batches, so a slow consumer (such
+        as a streamed export) never holds a read snapshot open for long.
+        """
+        last_rowid = 0
+        while True:
+            rows = self.conn.execute(
+                "SELECT rowid, body FROM quotes WHERE rowid > ? ORDER BY rowid LIMIT ?", (last_rowid, batch_size)
+            ).fetchall()
+            for row in rows:
+                yield json.loads(row["body"])
+            if len(rows) < batch_size:
+                return
+            last_rowid = rows[-1]["rowid"]
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM quotes").fetchone()[0]
+
+    def file_size(self):
+        """Bytes used by the database file and its write-ahead log."""
+        return sum(
+            os.path.getsize(path)
+            for path in (self.path, self.path + "-wal")
+            if os.path.exists(path)
+        )
+
+    def iter_ids(self, after=None):
+        """Yield every quote id in id order, starting after ``after``."""
+        sql = "SELECT id FROM quotes"
+        params = ()
+        if after is not None:
+            sql += " WHERE id > ?"
+            params = (after,)
+        for row in self.conn.execute(sql + " ORDER BY id", params):
+            yield row["id"]
+
+    def list_summaries(self, limit=50, after=None):
+        """Return one page of quote summaries, newest QuoteDate first.
+
+        ``after`` is the (quote_date, id) key of the last row of the previous
+        page. Paging is keyset-based on the (quote_date, id) index, so every
+        page costs the same regardless of how deep it is.
+        """
+        sql = "SELECT id, client_name, address, quote_date, is_generated, version FROM quotes"
+        params = []
+        if after is not None:
+            sql += " WHERE (quote_date, id) < (?, ?)"
+            params.extend(after)
+        sql += " ORDER BY quote_date DESC, id DESC LIMIT ?"
+        params.append(limit)
+        return [
+            {
+                "id": row["id"],
+                "ClientName": row["client_name"],
+                "Address": row["address"],
+                "QuoteDate": row["quote_date"],
+                "is_generated": bool(row["is_generated"]),
+                "version": row["version"],
+            }
+            for row in self.conn.execute(sql, params)
+        ]
+
+    @staticmethod
+    def _filter_clauses(date_from=None, date_to=None, quoted_by=None, area=None):
+        clauses = []
+        params = []
+        if date_from:
+            clauses.append("quote_date >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("quote_date <= ?")
+            params.append(date_to)
+        if quoted_by:
+            clauses.append("quoted_by = ? COLLATE NOCASE")
+            params.append(quoted_by)
+        if area:
+            clauses.append("area = ? COLLATE NOCASE")
+            params.append(area)
+        return clauses, params
+
+    def find_summaries(self, date_from=None, date_to=None, quoted_by=None, area=None):
+        """Yield summaries of quotes matching every given filter, oldest QuoteDate first.
+
+        Dates are inclusive YYYY-MM-DD strings; QuotedBy and Area match
+        case-insensitively.
+        """
+        clauses, params = self._filter_clauses(date_from, date_to, quoted_by, area)
+        sql = "SELECT id, client_name, address, quote_date FROM quotes"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY quote_date, id"
+        for row in self.conn.execute(sql, params):
+            yield {
+                "id": row["id"],
+                "ClientName": row["client_name"],
+                "Address": row["address"],
+                "QuoteDate": row["quote_date"],
+            }
+
+    def find_quotes(self, date_from=None, date_to=None, quoted_by=None, area=None, batch_size=100):
+        """Yield the quotes find_summaries would list, in the same order.
+
+        Like iter_quotes, rows are fetched in keyset-paged batches, so a
+        slow consumer never holds a read snapshot open for long.
+        """
+        clauses, params = self._filter_clauses(date_from, date_to, quoted_by, area)
+        after = None
+        while True:
+            page_clauses, page_params = list(clauses), list(params)
+            if after is not None:
+                page_clauses.append("(quote_date, id) > (?, ?)")
+                page_params.extend(after)
+            sql = "SELECT id, quote_date, body FROM quotes"
+            if page_clauses:
+                sql += " WHERE " + " AND ".join(page_clauses)
+            sql += " ORDER BY quote_date, id LIMIT ?"
+            rows = self.conn.execute(sql, page_params + [batch_size]).fetchall()
+            for row in rows:
+                yield json.loads(row["body"])
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1]["quote_date"], rows[-1]["id"])
+
+    def get_many(self, quote_ids):
+        """Return {quote_id: entry} for the ids that exist."""
+        quotes = {}
+        ids = list(quote_ids)
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for row in self.conn.execute(f"SELECT id, body FROM quotes WHERE id IN ({placeholders})", chunk):
+                quotes[row["id"]] = json.loads(row["body"])
+        return quotes
+
+    def last_change_seq(self):
+        return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM quote_changes").fetchone()[0]
+
+    def changes_since(self, seq):
+        """Return (changes, complete) for change-log rows after ``seq``.
+
+        ``changes`` is a list of (seq, quote_id, op) tuples. ``complete`` is
+        False when rows after ``seq`` were already pruned, in which case the
+        caller must rebuild from a full scan.
+        """
+        oldest = self.conn.execute("SELECT MIN(seq) FROM quote_changes").fetchone()[0]
+        complete = oldest is None or oldest <= seq + 1
+        rows = self.conn.execute(
+            "SELECT seq, quote_id, op FROM quote_changes WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+        return [(row["seq"], row["quote_id"], row["op"]) for row in rows], complete
+
+    def _prune_changes(self, conn, keep=CHANGE_LOG_RETENTION):
+        conn.execute("DELETE FROM quote_changes WHERE seq <= (SELECT MAX(seq) FROM quote_changes) - ?", (keep,))
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else default
+
+    def set_meta(self, key, value):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
+
+def import_json_file(store, json_path, batch_size=500):
+    """Import quotes from a legacy quote_data.json file. Returns the count imported."""
+    with open(json_path, "r") as f:
+        quotes = json.load(f)
+
+    imported = 0
+    batch = []
+    for quote in quotes:
+        if not isinstance(quote, dict) or "id" not in quote:
+            logging.error("Skipping malformed quote record: %.80r", quote)
+            continue
+        batch.append(quote)
+        if len(batch) >= batch_size:
+            with store.transaction() as conn:
+                for entry in batch:
+                    store._upsert(conn, entry)
+            imported += len(batch)
+            batch = []
+    if batch:
+        with store.transaction() as conn:
+            for entry in batch:
+                store._upsert(conn, entry)
+        imported += len(batch)
+    with store.transaction() as conn:
+        store._prune_changes(conn)
+    return imported
+
+
+def import_legacy_store(store, json_path):
+    """One-shot import of the legacy JSON store, recorded in the meta table."""
+    if store.get_meta("legacy_import") or not os.path.exists(json_path):
+        return 0
+    try:
+        # One transaction, checked again inside it, so workers starting
+        # together import the file once and a failed import leaves nothing
+        with store.transaction():
+            if store.get_meta("legacy_import"):
+                return 0
+            imported = import_json_file(store, json_path)
+            store.set_meta("legacy_import", json_path)
+    except json.JSONDecodeError:
+        logging.error("Failed to parse legacy quote store: %s", json_path)
+        return 0
+    logging.info("Imported %s quotes from %s", imported, json_path)
+    return imported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the SQLite quote store.")
+    parser.add_argument("--db", default="/persistent/quotes.db", help="Path to the SQLite quote store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import a quote_data.json file")
+    import_parser.add_argument("json_path")
+    subparsers.add_parser("count", help="Print the number of stored quotes")
+    args = parser.parse_args(argv)
+
+    store = SQLiteQuoteStore(args.db)
+    if args.command == "import":
+        imported = import_json_file(store, args.json_path)
+        store.set_meta("legacy_import", args.json_path)
+        print(f"Imported {imported} quotes into {args.db}")
+    elif args.command == "count":
+        print(store.count())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import hashlib
+import logging
+
+from blob_store import is_blob_name
+
+# Bump whenever quote_pdf's layout or the print image settings change, so
+# PDFs rendered by the old template are not served for unchanged quotes.
+TEMPLATE_VERSION = 3
+
+CACHE_DIR = "cache"
+# Default upper bound on the total size of cached PDFs
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# A cache hit updates last_access at most this often (seconds)
+TOUCH_INTERVAL = 60
+
+# Form fields that do not change what is drawn on the PDF
+_VOLATILE_FIELDS = {"quoteId", "is_update"}
+
+
+def _image_identity(upload_folder, name):
+    """Content identity of an image used by a quote."""
+    if is_blob_name(name):
+        # Blob names already carry the sha256 of their contents
+        return name
+    # Uploads from before the blob store: a changed file changes the key
+    try:
+        st = os.stat(os.path.join(upload_folder, name))
+    except OSError:
+        return f"{name}:missing"
+    return f"{name}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def quote_render_key(data, upload_folder):
+    """Hash of everything that determines a quote's rendered PDF."""
+    normalized = {
+        key: value
+        for key, value in data.items()
+        if key not in _VOLATILE_FIELDS
+        and not key.endswith(("_existing", "_photo"))
+        and not key.startswith("Products[")
+    }
+    images = normalized.get("Images") or {}
+    normalized["Images"] = {
+        field: _image_identity(upload_folder, name) if name else None
+        for field, name in images.items()
+    }
+    payload = json.dumps([TEMPLATE_VERSION, normalized], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def cache_filename(key):
+    """Path of a cached PDF relative to the PDF output folder."""
+    return f"{CACHE_DIR}/{key}.pdf"
+
+
+class RenderCache:
+    """Rendered PDFs stored once per render key, evicted least recently used first.
+
+    Files live under <pdf_folder>/cache/<key>.pdf and the render_cache table
+    in the quote store tracks their size and last access, so every gunicorn
+    worker shares one cache and one size cap.
+    """
+
+    def __init__(self, store, pdf_folder, max_bytes=DEFAULT_MAX_BYTES):
+        self.store = store
+        self.pdf_folder = pdf_folder
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(pdf_folder, CACHE_DIR), exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.pdf_folder, cache_filename(key))
+
+    def lookup(self, key):
+        """Return the path of the cached PDF for key, or None on a miss."""
+        path = self.path(key)
+        now = time.time()
+        row = self.store.conn.execute("SELECT last_access FROM render_cache WHERE key = ?", (key,)).fetchone()
+        if not os.path.exists(path):
+            if row is not None:
+                with self.store.transaction() as conn:
+                    conn.execute("DELETE FROM render_cache WHERE key = ?", (key,))
+            return None
+        if row is None:
+            # Rendered, but the result was never recorded
+            self.record(key)
+        elif now - row["last_access"] > TOUCH_INTERVAL:
+            with self.store.transaction() as conn:
+                conn.execute("UPDATE render_cache SET last_access = ? WHERE key = ?", (now, key))
+        return path
+
+    def record(self, key):
+        """Register a freshly rendered PDF, joining any open transaction."""
+        size = os.path.getsize(self.path(key))
+        with self.store.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO render_cache (key, size, last_access) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET size = excluded.size, last_access = excluded.last_access
+                """,
+                (key, size, time.time()),
+            )
+
+    def total_size(self):
+        return self.store.conn.execute("SELECT COALESCE(SUM(size), 0) FROM render_cache").fetchone()[0]
+
+    def evict(self, max_bytes=None):
+        """Remove least recently used PDFs until the cache fits. Returns the count removed."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        removed = 0
+        with self.store.transaction() as conn:
+            excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM render_cache").fetchone()[0] - max_bytes
+            if excess <= 0:
+                return 0
+            for row in conn.execute("SELECT key, size FROM render_cache ORDER BY last_access").fetchall():
+                if excess <= 0:
+                    break
+                path = self.path(row["key"])
+                if os.path.exists(path):
+                    os.remove(path)
+                conn.execute("DELETE FROM render_cache WHERE key = ?", (row["key"],))
+                excess -= row["size"]
+                removed += 1
+        logging.debug("Evicted %s cached PDFs", removed)
+        return removed
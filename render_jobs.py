@@ -0,0 +1,298 @@
+import os
+import time
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from quote_store import SQLiteQuoteStore
+from render_cache import quote_render_key, cache_filename
+from metrics import PHASE_SECONDS, RENDER_PAGES, RENDER_PAGES_PER_DOC
+
+# A job is retried this many times before it is marked failed
+MAX_ATTEMPTS = 3
+# A running job whose lease expires (worker crash or restart) is claimed again
+LEASE_SECONDS = 120
+
+JOB_FIELDS = ("id", "quote_id", "pdf_filename", "status", "progress", "attempts", "error", "created_at", "updated_at")
+
+_worker_stores = {}
+
+
+def worker_store(db_path):
+    """Quote store of the current pool process, opened on first use."""
+    store = _worker_stores.get(db_path)
+    if store is None:
+        store = _worker_stores[db_path] = SQLiteQuoteStore(db_path)
+    return store
+
+
+def render_to_cache(data, pdf_folder, upload_folder, progress=None, force=False):
+    """Render quote data into the PDF cache. Returns (render key, pages).
+
+    Identical content is rendered once: if the cached file already exists
+    it is kept unless ``force`` is set, and pages is None.
+    """
+    from quote_pdf import render_quote_pdf
+
+    key = quote_render_key(data, upload_folder)
+    pdf_path = os.path.join(pdf_folder, cache_filename(key))
+    if os.path.exists(pdf_path) and not force:
+        return key, None
+    os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+    # Render to a temporary name so /retrieve never serves a partial file
+    tmp_path = f"{pdf_path}.{os.getpid()}.tmp"
+    try:
+        pages = render_quote_pdf(data, tmp_path, upload_folder, progress=progress)
+        os.replace(tmp_path, pdf_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return key, pages
+
+
+def run_render_job(db_path, job_id, pdf_folder, upload_folder, lease_seconds=LEASE_SECONDS):
+    """Render one claimed job. Runs in a pool process.
+
+    Returns (render key, pages, seconds). The key is computed from the quote
+    data actually rendered, which may be newer than the data the job was
+    queued for.
+    """
+    store = worker_store(db_path)
+    job = store.conn.execute("SELECT quote_id, pdf_filename FROM render_jobs WHERE id = ?", (job_id,)).fetchone()
+    if job is None:
+        raise LookupError(f"Render job {job_id} no longer exists.")
+    quote = store.get(job["quote_id"])
+    if quote is None:
+        raise LookupError(f"Quote {job['quote_id']} was deleted before it could be rendered.")
+
+    def progress(percent):
+        # Progress updates also renew the lease on the job
+        now = time.time()
+        with store.transaction() as conn:
+            conn.execute(
+                "UPDATE render_jobs SET progress = ?, lease_until = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+                (min(int(percent), 99), now + lease_seconds, now, job_id),
+            )
+
+    started = time.perf_counter()
+    key, pages = render_to_cache(quote["data"], pdf_folder, upload_folder, progress=progress)
+    return key, pages, time.perf_counter() - started
+
+
+class RenderQueue:
+    """PDF render queue persisted in the quote store's render_jobs table.
+
+    Every app process runs a dispatcher thread that claims queued jobs and
+    hands them to a process pool. Claims take a lease, so jobs held by a
+    worker that dies or restarts are picked up again once the lease expires.
+    """
+
+    def __init__(self, store, pdf_folder, upload_folder, workers=2, poll_interval=1.0, lease_seconds=LEASE_SECONDS, cache=None):
+        self.store = store
+        self.cache = cache
+        self.pdf_folder = pdf_folder
+        self.upload_folder = upload_folder
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._wakeup = threading.Event()
+        self._slots = threading.Semaphore(self.workers)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._thread = None
+        self._pid = None
+
+    def enqueue(self, quote_id, pdf_filename):
+        """Queue a render of the quote's current data. Returns the job id."""
+        now = time.time()
+        with self.store.transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO render_jobs (quote_id, pdf_filename, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (quote_id, pdf_filename, now, now),
+            )
+        self.start()
+        self._wakeup.set()
+        logging.debug("Queued render job %s for quote %s", cursor.lastrowid, quote_id)
+        return cursor.lastrowid
+
+    def record_done(self, quote_id, pdf_filename):
+        """Record a finished job for a quote whose PDF is already rendered. Returns the job id."""
+        now = time.time()
+        with self.store.transaction() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO render_jobs (quote_id, pdf_filename, status, progress, created_at, updated_at)
+                VALUES (?, ?, 'done', 100, ?, ?)
+                """,
+                (quote_id, pdf_filename, now, now),
+            )
+        return cursor.lastrowid
+
+    def get(self, job_id):
+        row = self.store.conn.execute(
+            f"SELECT {', '.join(JOB_FIELDS)} FROM render_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def latest_for_quote(self, quote_id):
+        row = self.store.conn.execute(
+            f"SELECT {', '.join(JOB_FIELDS)} FROM render_jobs WHERE quote_id = ? ORDER BY id DESC LIMIT 1",
+            (quote_id,),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def start(self):
+        """Start the dispatcher thread for this process if it is not running."""
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            # After a fork the parent's thread and pool do not exist here
+            self._pid = os.getpid()
+            self._executor = None
+            self._slots = threading.Semaphore(self.workers)
+            self._thread = threading.Thread(target=self._run, name="render-dispatcher", daemon=True)
+            self._thread.start()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                from quote_pdf import warm_assets
+
+                # Decode the header logos and compile the static layers
+                # once, before forking, so every render worker inherits them
+                warm_assets()
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _claim(self):
+        now = time.time()
+        with self.store.transaction() as conn:
+            conn.execute(
+                """
+                UPDATE render_jobs SET status = 'failed', error = 'Render did not finish after repeated attempts.', updated_at = ?
+                WHERE status = 'running' AND lease_until < ? AND attempts >= ?
+                """,
+                (now, now, MAX_ATTEMPTS),
+            )
+            row = conn.execute(
+                """
+                UPDATE render_jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ?
+                WHERE id = (
+                    SELECT id FROM render_jobs
+                    WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)
+                    ORDER BY id LIMIT 1
+                )
+                RETURNING id, quote_id, attempts
+                """,
+                (now + self.lease_seconds, now, now),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def _run(self):
+        while True:
+            self._slots.acquire()
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logging.error("Failed to claim render job: %s", e)
+                job = None
+            if job is None:
+                self._slots.release()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            logging.debug("Rendering job %s for quote %s (attempt %s)", job['id'], job['quote_id'], job['attempts'])
+            executor = self._get_executor()
+            try:
+                future = executor.submit(
+                    run_render_job, self.store.path, job["id"], self.pdf_folder, self.upload_folder, self.lease_seconds
+                )
+            except BrokenProcessPool as e:
+                self._reset_executor()
+                self._finish(job, error=e)
+                continue
+            except RuntimeError as e:
+                # The pool was shut down: replaced after a crash, or the
+                # interpreter is exiting. Neither is the job's fault.
+                self._release(job)
+                if self._executor is executor:
+                    # Not replaced, so the interpreter is exiting; enqueue
+                    # starts a new dispatcher if this process lives on
+                    logging.info("Render dispatcher stopping: %s", e)
+                    return
+                continue
+            future.add_done_callback(lambda f, job=job: self._finish(job, future=f))
+
+    def _release(self, job):
+        """Give a claimed job back to the queue without counting the attempt."""
+        try:
+            with self.store.transaction() as conn:
+                conn.execute(
+                    """
+                    UPDATE render_jobs SET status = 'queued', attempts = attempts - 1, lease_until = NULL, updated_at = ?
+                    WHERE id = ? AND status = 'running'
+                    """,
+                    (time.time(), job["id"]),
+                )
+        except sqlite3.Error as e:
+            # The lease will expire and another dispatcher claims the job
+            logging.error("Failed to release render job %s: %s", job['id'], e)
+        finally:
+            self._slots.release()
+
+    def _finish(self, job, future=None, error=None):
+        if future is not None and future.cancelled():
+            # Dropped with its pool, not failed
+            self._release(job)
+            self._wakeup.set()
+            return
+        try:
+            key = None
+            if future is not None:
+                error = future.exception()
+                if error is None:
+                    key, pages, seconds = future.result()
+                    if pages:
+                        RENDER_PAGES.inc(pages)
+                        RENDER_PAGES_PER_DOC.observe(pages)
+                        PHASE_SECONDS.observe(seconds, phase="pdf_render")
+            if isinstance(error, BrokenProcessPool):
+                self._reset_executor()
+            now = time.time()
+            with self.store.transaction() as conn:
+                if error is None:
+                    conn.execute(
+                        """
+                        UPDATE render_jobs SET status = 'done', pdf_filename = ?, progress = 100, error = NULL,
+                            lease_until = NULL, updated_at = ?
+                        WHERE id = ?
+                        """,
+                        (cache_filename(key), now, job["id"]),
+                    )
+                    if self.cache is not None:
+                        self.cache.record(key)
+                    logging.debug("Render job %s finished", job['id'])
+                else:
+                    status = "queued" if job["attempts"] < MAX_ATTEMPTS and not isinstance(error, LookupError) else "failed"
+                    conn.execute(
+                        "UPDATE render_jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                        (status, str(error), now, job["id"]),
+                    )
+                    logging.error("Render job %s failed (attempt %s): %s", job['id'], job['attempts'], error)
+            if key is not None and self.cache is not None:
+                self.cache.evict()
+        except sqlite3.Error as e:
+            # The lease will expire and another dispatcher retries the job
+            logging.error("Failed to record result of render job %s: %s", job['id'], e)
+        finally:
+            self._slots.release()
+            self._wakeup.set()
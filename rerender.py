@@ -0,0 +1,159 @@
+"""Re-render stored quotes into the PDF cache using every CPU core.
+
+By default only quotes whose render key (quote data, images and template
+version) has no cached PDF are rendered, so after bumping
+render_cache.TEMPLATE_VERSION a run re-renders everything once and a
+second run does nothing. --force renders every quote regardless.
+
+Progress is checkpointed in the quote store's meta table; --resume picks
+up after the last quote of an interrupted run.
+
+Usage: python rerender.py [--workers N] [--force] [--resume] [--verbose] [quote_id ...]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from quote_store import SQLiteQuoteStore
+from render_cache import RenderCache, quote_render_key, cache_filename
+from render_jobs import RenderQueue, render_to_cache, worker_store
+
+# Same locations as app.py
+QUOTE_DB_PATH = "/persistent/quotes.db"
+PDF_OUTPUT_FOLDER = "/persistent/pdfs"
+UPLOAD_FOLDER = "/persistent/uploads"
+
+CHECKPOINT_KEY = "rerender_checkpoint"
+
+
+def render_quote(db_path, quote_id, pdf_folder, upload_folder, force):
+    """Render one quote in a pool process. Returns (quote_id, key, seconds, rendered, error)."""
+    started = time.perf_counter()
+    try:
+        quote = worker_store(db_path).get(quote_id)
+        if quote is None:
+            return quote_id, None, 0.0, False, "deleted"
+        key = quote_render_key(quote["data"], upload_folder)
+        cached = os.path.exists(os.path.join(pdf_folder, cache_filename(key)))
+        if cached and not force:
+            return quote_id, key, time.perf_counter() - started, False, None
+        key, _ = render_to_cache(quote["data"], pdf_folder, upload_folder, force=force)
+        return quote_id, key, time.perf_counter() - started, True, None
+    except Exception as e:
+        return quote_id, None, time.perf_counter() - started, False, str(e)
+
+
+def rerender(store, pdf_folder, upload_folder, quote_ids=None, workers=None, force=False, resume=False, verbose=False, out=sys.stdout):
+    """Render quotes in parallel and record them as the quotes' latest PDFs. Returns a stats dict."""
+    cache = RenderCache(store, pdf_folder)
+    queue = RenderQueue(store, pdf_folder, upload_folder, cache=cache)
+    workers = workers or os.cpu_count() or 1
+
+    checkpoint = None
+    if quote_ids is None:
+        if resume:
+            saved = store.get_meta(CHECKPOINT_KEY)
+            if saved:
+                checkpoint = json.loads(saved)
+                force = checkpoint["force"]
+                print(f"Resuming after {checkpoint['after']!r}", file=out)
+        quote_ids = list(store.iter_ids(after=checkpoint["after"] if checkpoint else None))
+        if checkpoint is None:
+            checkpoint = {"after": None, "force": force}
+
+    stats = {"total": len(quote_ids), "rendered": 0, "skipped": 0, "failed": 0, "render_seconds": 0.0}
+    started = time.perf_counter()
+    # Futures are consumed out of order, but the checkpoint only advances
+    # past quotes that are finished along with everything before them.
+    finished = {}
+    next_index = 0
+    pending = set()
+    in_flight = workers * 4
+    position = {quote_id: i for i, quote_id in enumerate(quote_ids)}
+    done_upto = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while next_index < len(quote_ids) or pending:
+            while next_index < len(quote_ids) and len(pending) < in_flight:
+                pending.add(executor.submit(render_quote, store.path, quote_ids[next_index], pdf_folder, upload_folder, force))
+                next_index += 1
+            completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in completed:
+                quote_id, key, seconds, rendered, error = future.result()
+                if error:
+                    stats["failed"] += 1
+                    print(f"{quote_id}: failed: {error}", file=out)
+                elif rendered:
+                    stats["rendered"] += 1
+                    stats["render_seconds"] += seconds
+                    cache.record(key)
+                    queue.record_done(quote_id, cache_filename(key))
+                    if verbose:
+                        print(f"{quote_id}: {seconds * 1000:.1f} ms", file=out)
+                else:
+                    stats["skipped"] += 1
+                    if verbose:
+                        print(f"{quote_id}: unchanged", file=out)
+                finished[position[quote_id]] = quote_id
+
+            last_done = None
+            while done_upto in finished:
+                last_done = finished.pop(done_upto)
+                done_upto += 1
+            if last_done is not None and checkpoint is not None:
+                checkpoint["after"] = last_done
+                store.set_meta(CHECKPOINT_KEY, json.dumps(checkpoint))
+
+    if checkpoint is not None:
+        store.set_meta(CHECKPOINT_KEY, "")
+    cache.evict()
+
+    stats["elapsed_seconds"] = time.perf_counter() - started
+    processed = stats["rendered"] + stats["skipped"] + stats["failed"]
+    stats["quotes_per_second"] = processed / stats["elapsed_seconds"] if stats["elapsed_seconds"] else 0.0
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-render stored quotes into the PDF cache.")
+    parser.add_argument("--db", default=QUOTE_DB_PATH, help="Path to the SQLite quote store")
+    parser.add_argument("--pdfs", default=PDF_OUTPUT_FOLDER, help="PDF output folder")
+    parser.add_argument("--uploads", default=UPLOAD_FOLDER, help="Upload folder holding quote images")
+    parser.add_argument("--workers", type=int, default=None, help="Render processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Render quotes even if their PDF is cached")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run")
+    parser.add_argument("--verbose", action="store_true", help="Print the render time of every quote")
+    parser.add_argument("quote_ids", nargs="*", help="Only render these quotes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = SQLiteQuoteStore(args.db)
+    try:
+        stats = rerender(
+            store, args.pdfs, args.uploads,
+            quote_ids=args.quote_ids or None,
+            workers=args.workers,
+            force=args.force,
+            resume=args.resume,
+            verbose=args.verbose,
+        )
+    except KeyboardInterrupt:
+        print("Interrupted; run again with --resume to continue.", file=sys.stderr)
+        sys.exit(130)
+
+    mean_ms = stats["render_seconds"] / stats["rendered"] * 1000 if stats["rendered"] else 0.0
+    print(
+        f"{stats['total']} quotes: {stats['rendered']} rendered, {stats['skipped']} unchanged, "
+        f"{stats['failed']} failed in {stats['elapsed_seconds']:.1f} s "
+        f"({stats['quotes_per_second']:.1f} quotes/s, {mean_ms:.1f} ms per render)"
+    )
+    if stats["failed"]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
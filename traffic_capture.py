@@ -0,0 +1,335 @@
+"""Opt-in capture of production traffic for replay in performance tests.
+
+With TRAFFIC_CAPTURE=1 every request is appended to a JSONL file as one
+record: the route and the path it was called with, the form fields, the
+sizes of uploaded files, the status, how long it took and how many bytes
+it answered with. benchmarks/replay.py re-drives the recorded mix against
+a local instance.
+
+Nothing identifying is written. Names, phone numbers, addresses, notes
+and search terms are replaced word by word with pseudonyms derived from
+a keyed hash, so a customer keeps the same pseudonym across requests
+(their quote id in a later /retrieve matches the name they were quoted
+under) without the capture revealing who they are. Uploaded files are
+recorded as their extension, size and a keyed digest, so replay can
+synthesize stand-in photos and identical photos stay identical. The key
+is generated once per capture file and kept beside it as <path>.key.
+"""
+import os
+import re
+import hmac
+import json
+import time
+import hashlib
+import logging
+import secrets
+import threading
+from urllib.parse import quote, unquote
+
+# Not captured: static files and the monitoring endpoints
+SKIP_ENDPOINTS = ("static", "metrics", "list_profiles", "get_profile")
+# Form fields recorded as they are; every other field not handled below is
+# pseudonymized
+KEEP_FIELDS = (
+    "Area", "QuoteDate", "RailColor", "VinylColor", "InstallType", "LeadTime", "Payment", "is_update",
+)
+# Query parameters recorded as they are; "cursor" encodes a quote id and is
+# dropped, the rest are pseudonymized
+KEEP_PARAMS = ("limit", "skip_existing", "group_by", "date_from", "date_to", "area")
+DROP_PARAMS = ("cursor",)
+# Request headers replay needs; X-Quoted-By (the admission fairness key)
+# is pseudonymized like the QuotedBy field it is copied from
+KEEP_HEADERS = ("Upload-Offset", "X-Quoted-By")
+# Ids in JSON responses that later requests refer to
+RESPONSE_IDS = ("upload_id", "job_id")
+
+_CONSONANTS = "bcdfghklmnprstvz"
+_VOWELS = "aeiou"
+_WORD = re.compile(r"[^\W_]+")
+_RULE_ARGUMENT = re.compile(r"<(?:[^:<>]+:)?([^<>]+)>")
+
+
+def _load_key(path):
+    """The pseudonym key kept in ``path``, created on first use.
+
+    Created exclusively, so gunicorn workers starting together agree on it.
+    """
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path) as f:
+            key = f.read().strip()
+        if key:
+            return key.encode("ascii")
+        # Another worker created it and has not written it yet
+        time.sleep(0.1)
+        with open(path) as f:
+            return f.read().strip().encode("ascii")
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, "w") as f:
+        f.write(key)
+    return key.encode("ascii")
+
+
+class Pseudonymizer:
+    """Consistent stand-ins for personal values under one key.
+
+    Words keep their length, case and whether they are digits, so names,
+    phone numbers and notes keep the shape (and the rendered width) of the
+    originals.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def digest(self, value):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        return hmac.new(self.key, value, hashlib.sha256).hexdigest()
+
+    def word(self, word):
+        raw = hmac.new(self.key, word.lower().encode("utf-8"), hashlib.sha256).digest()
+        while len(raw) < len(word):
+            raw += hashlib.sha256(raw).digest()
+        if word.isdigit():
+            return "".join(str(b % 10) for b in raw[:len(word)])
+        letters = "".join(
+            (_VOWELS[b % len(_VOWELS)] if i % 2 else _CONSONANTS[b % len(_CONSONANTS)])
+            for i, b in enumerate(raw[:max(len(word), 2)])
+        )
+        if word.islower():
+            return letters
+        if word.isupper():
+            return letters.upper()
+        return letters.capitalize()
+
+    def text(self, text):
+        """Every word of ``text`` replaced, punctuation and spacing kept."""
+        return _WORD.sub(lambda m: self.word(m.group()), text)
+
+    def client_name(self, name):
+        # Punctuation is dropped as /submit does when deriving the quote id,
+        # so the pseudonym's id is the pseudonym of the original's id
+        words = ("".join(c for c in part if c.isalnum()) for part in name.split())
+        return " ".join(self.word(word) for word in words if word)
+
+    def quote_id(self, quote_id):
+        return "_".join(self.word(word) for word in quote_id.split("_") if word)
+
+    def email(self, email):
+        local = email.split("@", 1)[0]
+        return f"{self.text(local) or 'user'}@example.com"
+
+    def stored_image(self, filename):
+        ext = filename.rsplit(".", 1)[1].lower() if "." in filename else ""
+        return f"{self.digest(filename)[:32]}.{ext}" if ext else self.digest(filename)[:32]
+
+    def form_value(self, name, value):
+        if name in KEEP_FIELDS or name.startswith("Products["):
+            return value
+        if name.endswith("_photo"):
+            # Random upload ids, mapped to the replayed uploads
+            return value
+        if name.endswith("_existing"):
+            return self.stored_image(value) if value else value
+        if name == "ClientName":
+            return self.client_name(value)
+        if name == "quoteId":
+            return self.quote_id(value)
+        if name == "Email":
+            return self.email(value) if value else value
+        return self.text(value)
+
+    def header(self, name, value):
+        if name == "X-Quoted-By":
+            # URI-encoded by the page
+            return quote(self.form_value("QuotedBy", unquote(value)), safe="")
+        return value
+
+    def json_value(self, name, value):
+        if isinstance(value, dict):
+            return {key: self.json_value(key, item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.json_value(name, item) for item in value]
+        if not isinstance(value, str):
+            return value
+        if name == "filename":
+            ext = value.rsplit(".", 1)[1].lower() if "." in value else ""
+            return f"photo.{ext}" if ext else "photo"
+        if name == "sha256":
+            return self.digest(value)
+        return self.form_value(name, value)
+
+
+class TrafficCaptureMiddleware:
+    """WSGI middleware that appends a record of each captured request to ``path``.
+
+    The Flask hooks installed by enable_capture describe the request in
+    the environ; this times it until its response has been sent and counts
+    the bytes sent. Each record is one write to a file opened for append,
+    so the records of several worker processes interleave whole. Wrapping
+    the response body means file responses are no longer sent with
+    sendfile while capturing.
+    """
+
+    def __init__(self, wsgi_app, path):
+        self.wsgi_app = wsgi_app
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+
+    def __call__(self, environ, start_response):
+        started_at = time.time()
+        started = time.perf_counter()
+        response = {}
+
+        def capture(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            return start_response(status, headers, exc_info)
+
+        result = self.wsgi_app(environ, capture)
+        return _CountingBody(result, lambda sent: self._finish(environ, response, started_at, started, sent))
+
+    def _finish(self, environ, response, started_at, started, sent):
+        record = environ.get("traffic_capture.record")
+        if record is None:
+            return
+        duration = time.perf_counter() - started - record.pop("_capture_seconds", 0.0)
+        record.update({
+            "ts": round(started_at, 6),
+            "status": response.get("status"),
+            "duration_ms": round(duration * 1000, 3),
+            "response_bytes": sent,
+            "pid": os.getpid(),
+        })
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        try:
+            with self._lock:
+                os.write(self._fd, line)
+        except OSError as e:
+            logging.error("Could not write traffic capture record: %s", e)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class _CountingBody:
+    """A response iterable that counts the bytes sent and reports them on close."""
+
+    def __init__(self, result, on_close):
+        self._result = result
+        self._on_close = on_close
+        self._sent = 0
+
+    def __iter__(self):
+        for chunk in self._result:
+            self._sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self._result, "close"):
+                self._result.close()
+        finally:
+            self._on_close(self._sent)
+
+
+def _file_record(pseudonymizer, field, file):
+    """Extension, size and keyed digest of an uploaded file, read back from its start."""
+    filename = file.filename or ""
+    ext = filename.rsplit(".", 1)[1].lower() if "." in filename else ""
+    stream = file.stream
+    digest = hmac.new(pseudonymizer.key, digestmod=hashlib.sha256)
+    size = 0
+    try:
+        stream.seek(0)
+        while True:
+            chunk = stream.read(1024 * 1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    except (OSError, ValueError):
+        # Closed or unseekable; the size is all that is lost
+        return {"field": field, "ext": ext, "size": None, "digest": None}
+    return {"field": field, "ext": ext, "size": size, "digest": digest.hexdigest()}
+
+
+def describe_request(request, response, pseudonymizer):
+    """The sanitized record of a Flask request and its response, or None to skip it."""
+    if request.url_rule is None or request.endpoint in SKIP_ENDPOINTS:
+        return None
+    view_args = {
+        name: pseudonymizer.quote_id(value) if name == "quote_id" else value
+        for name, value in (request.view_args or {}).items()
+    }
+    path = _RULE_ARGUMENT.sub(lambda m: str(view_args.get(m.group(1), "")), request.url_rule.rule)
+    query = [
+        [name, value if name in KEEP_PARAMS else pseudonymizer.text(value)]
+        for name, value in request.args.items(multi=True)
+        if name not in DROP_PARAMS
+    ]
+    record = {
+        "method": request.method,
+        "route": request.url_rule.rule,
+        "endpoint": request.endpoint,
+        "path": path,
+        "view_args": view_args,
+        "query": query,
+        "headers": {
+            name: pseudonymizer.header(name, request.headers[name])
+            for name in KEEP_HEADERS
+            if name in request.headers
+        },
+        "content_type": request.mimetype or None,
+        "request_bytes": request.content_length or 0,
+    }
+    # Only bodies the view parsed; reading one here would change the request
+    if "form" in request.__dict__:
+        record["form"] = [
+            [name, pseudonymizer.form_value(name, value)] for name, value in request.form.items(multi=True)
+        ]
+        record["files"] = [
+            _file_record(pseudonymizer, field, file)
+            for field, file in request.files.items(multi=True)
+            if file.filename
+        ]
+    if request.is_json:
+        body = request.get_json(silent=True)
+        if body is not None:
+            record["json"] = pseudonymizer.json_value("", body)
+    if response.is_json and not response.is_streamed:
+        body = response.get_json(silent=True)
+        if isinstance(body, dict):
+            ids = {name: body[name] for name in RESPONSE_IDS if body.get(name) is not None}
+            if ids:
+                record["ids"] = ids
+    return record
+
+
+def enable_capture(app, path, key=None):
+    """Install TrafficCaptureMiddleware on a Flask app, recording to ``path``."""
+    from flask import request
+
+    middleware = TrafficCaptureMiddleware(app.wsgi_app, path)
+    pseudonymizer = Pseudonymizer(key.encode("utf-8") if key else _load_key(path + ".key"))
+    app.wsgi_app = middleware
+
+    @app.after_request
+    def _capture_request(response):
+        started = time.perf_counter()
+        try:
+            record = describe_request(request, response, pseudonymizer)
+        except Exception as e:
+            logging.error("Could not capture %s %s: %s", request.method, request.path, e)
+            record = None
+        if record is not None:
+            # Not counted in the request's duration
+            record["_capture_seconds"] = time.perf_counter() - started
+            request.environ["traffic_capture.record"] = record
+        return response
+
+    logging.info("Traffic capture enabled, writing to %s", path)
+    return middleware
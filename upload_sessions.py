@@ -0,0 +1,288 @@
+"""Chunked, resumable photo uploads.
+
+A photo is uploaded in a session: the client declares its name and size,
+then sends the bytes in chunks, each at the offset the server says it has
+received so far. A connection dropped part way through loses at most the
+chunk in flight; the client asks for the offset and carries on from there.
+Chunks are written straight to a part file and hashed as they arrive, and
+the last one moves the file into the blob store. The session id is then
+the photo id /submit accepts in place of a file.
+
+Usage: python upload_sessions.py [--db PATH] [--uploads PATH] expire
+"""
+import os
+import re
+import time
+import fcntl
+import hashlib
+import logging
+import secrets
+import argparse
+import threading
+from collections import OrderedDict
+
+from quote_store import SQLiteQuoteStore
+from blob_store import BlobStore, CHUNK_SIZE, collect_all
+
+ALLOWED_EXTENSIONS = ("png", "jpg", "jpeg", "gif")
+# Largest photo accepted
+DEFAULT_MAX_BYTES = 25 * 1024 * 1024
+# Sessions untouched for this long are removed, with their part files
+EXPIRE_SECONDS = 24 * 3600
+# Hash states of uploads in progress kept per process. A chunk for an
+# upload whose state is not here (another worker took the previous chunk,
+# or it was evicted) re-hashes the bytes already received.
+MAX_HASHERS = 256
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UploadError(ValueError):
+    """A rejected upload request.
+
+    ``status`` is the HTTP status to answer with; ``offset``, when set, is
+    the number of bytes the server holds, so the client knows where to
+    resume.
+    """
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class UploadSessions:
+    """Upload sessions kept in the uploads table, with part files under blobs/tmp.
+
+    The bytes received so far are the part file itself, so any worker can
+    take the next chunk and a restart loses nothing. A chunk is written
+    under an exclusive lock on the part file, so two requests can never
+    append to the same upload at once.
+    """
+
+    def __init__(self, store, blob_store, max_bytes=DEFAULT_MAX_BYTES, expire_seconds=EXPIRE_SECONDS):
+        self.store = store
+        self.blob_store = blob_store
+        self.max_bytes = max_bytes
+        self.expire_seconds = expire_seconds
+        self._hashers = OrderedDict()
+        self._hashers_lock = threading.Lock()
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.blob_store.tmp_dir, f"upload_{upload_id}.part")
+
+    def _row(self, upload_id):
+        row = None
+        if isinstance(upload_id, str) and _UPLOAD_ID.match(upload_id):
+            row = self.store.conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+        if row is None:
+            raise UploadError("Upload not found. It may have expired; upload the photo again.", 404)
+        return row
+
+    def create(self, filename, size, sha256=None):
+        """Start an upload of ``size`` bytes. Returns its status."""
+        filename = os.path.basename(str(filename or "").replace("\\", "/"))
+        ext = filename.rsplit(".", 1)[1].lower() if "." in filename else ""
+        if ext not in ALLOWED_EXTENSIONS:
+            raise UploadError(f"Photos must be one of: {', '.join(ALLOWED_EXTENSIONS)}.")
+        if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+            raise UploadError("Size must be a positive number of bytes.")
+        if size > self.max_bytes:
+            raise UploadError(f"Photos can be at most {self.max_bytes // (1024 * 1024)} MB.", 413)
+        if sha256 is not None:
+            sha256 = str(sha256).lower()
+            if not _SHA256.match(sha256):
+                raise UploadError("sha256 must be 64 hexadecimal digits.")
+
+        # Opportunistic, so abandoned uploads do not pile up between runs of
+        # the expire command
+        self.expire()
+        upload_id = secrets.token_hex(16)
+        now = time.time()
+        open(self._part_path(upload_id), "wb").close()
+        with self.store.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO uploads (id, filename, ext, size, sha256, blob_name, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, NULL, ?, ?)
+                """,
+                (upload_id, filename, ext, size, sha256, now, now),
+            )
+        logging.debug("Started upload %s of %s (%s bytes)", upload_id, filename, size)
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        row = self._row(upload_id)
+        if row["blob_name"]:
+            offset = row["size"]
+        else:
+            try:
+                offset = os.path.getsize(self._part_path(upload_id))
+            except FileNotFoundError:
+                raise UploadError("Upload not found. It may have expired; upload the photo again.", 404)
+        complete = bool(row["blob_name"])
+        return {
+            "upload_id": row["id"],
+            "filename": row["filename"],
+            "size": row["size"],
+            "offset": offset,
+            "complete": complete,
+            # What /submit takes in place of the file
+            "photo_id": row["id"] if complete else None,
+        }
+
+    def append(self, upload_id, offset, stream, chunk_size=CHUNK_SIZE):
+        """Write the bytes of ``stream`` at ``offset``. Returns the upload's status.
+
+        ``offset`` must equal the bytes already received; anything else is
+        answered with 409 and the current offset, as is a chunk for an
+        upload another request is writing to. The chunk that brings the
+        upload to its declared size completes it.
+        """
+        row = self._row(upload_id)
+        if row["blob_name"]:
+            raise UploadError("Upload is already complete.", 409, offset=row["size"])
+        try:
+            part = open(self._part_path(upload_id), "r+b")
+        except FileNotFoundError:
+            raise UploadError("Upload not found. It may have expired; upload the photo again.", 404)
+        with part:
+            try:
+                fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError("Another request is writing to this upload.", 409)
+            received = part.seek(0, os.SEEK_END)
+            if offset != received:
+                raise UploadError(f"Expected offset {received}.", 409, offset=received)
+            hasher = self._hasher(upload_id, part, received)
+            try:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    if received + len(chunk) > row["size"]:
+                        raise UploadError(
+                            f"Upload is larger than the declared {row['size']} bytes.", 413, offset=received
+                        )
+                    part.write(chunk)
+                    hasher.update(chunk)
+                    received += len(chunk)
+            finally:
+                # Whatever arrived before an error or a dropped connection is
+                # kept, so the client resumes after it
+                part.flush()
+                self._keep_hasher(upload_id, received, hasher)
+
+            if received < row["size"]:
+                with self.store.transaction() as conn:
+                    conn.execute("UPDATE uploads SET updated_at = ? WHERE id = ?", (time.time(), upload_id))
+                return self.status(upload_id)
+            self._complete(row, hasher.hexdigest())
+        return self.status(upload_id)
+
+    def _complete(self, row, sha256):
+        upload_id = row["id"]
+        path = self._part_path(upload_id)
+        self._drop_hasher(upload_id)
+        if row["sha256"] and row["sha256"] != sha256:
+            with self.store.transaction() as conn:
+                conn.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+            os.remove(path)
+            raise UploadError("Checksum mismatch; upload the photo again.", 422)
+        with self.store.transaction() as conn:
+            name = self.blob_store._commit(path, sha256, row["ext"], row["size"])
+            conn.execute(
+                "UPDATE uploads SET sha256 = ?, blob_name = ?, updated_at = ? WHERE id = ?",
+                (sha256, name, time.time(), upload_id),
+            )
+        # Left behind when the photo was already stored
+        if os.path.exists(path):
+            os.remove(path)
+        logging.debug("Completed upload %s as %s", upload_id, name)
+
+    def _hasher(self, upload_id, part, received):
+        with self._hashers_lock:
+            cached = self._hashers.pop(upload_id, None)
+        if cached is not None and cached[0] == received:
+            return cached[1]
+        logging.debug("Re-hashing %s bytes of upload %s", received, upload_id)
+        hasher = hashlib.sha256()
+        part.seek(0)
+        remaining = received
+        while remaining:
+            chunk = part.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            remaining -= len(chunk)
+        part.seek(received)
+        return hasher
+
+    def _keep_hasher(self, upload_id, received, hasher):
+        with self._hashers_lock:
+            self._hashers[upload_id] = (received, hasher)
+            while len(self._hashers) > MAX_HASHERS:
+                self._hashers.popitem(last=False)
+
+    def _drop_hasher(self, upload_id):
+        with self._hashers_lock:
+            self._hashers.pop(upload_id, None)
+
+    def photo(self, upload_id):
+        """Blob name of a completed upload, for a quote's Images."""
+        row = self._row(upload_id)
+        if not row["blob_name"]:
+            raise UploadError(f"Photo {upload_id} has not finished uploading.")
+        return row["blob_name"]
+
+    def cancel(self, upload_id):
+        """Forget an upload. A completed photo stays stored while quotes use it."""
+        self._row(upload_id)
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+        self._remove_part(upload_id)
+
+    def _remove_part(self, upload_id):
+        self._drop_hasher(upload_id)
+        try:
+            os.remove(self._part_path(upload_id))
+        except FileNotFoundError:
+            pass
+
+    def expire(self):
+        """Remove sessions untouched for ``expire_seconds``. Returns the count removed."""
+        cutoff = time.time() - self.expire_seconds
+        with self.store.transaction() as conn:
+            ids = [
+                row["id"]
+                for row in conn.execute("SELECT id FROM uploads WHERE updated_at < ?", (cutoff,))
+            ]
+            conn.executemany("DELETE FROM uploads WHERE id = ?", [(upload_id,) for upload_id in ids])
+        for upload_id in ids:
+            self._remove_part(upload_id)
+        if ids:
+            logging.debug("Expired %s upload sessions", len(ids))
+        return len(ids)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage photo upload sessions.")
+    parser.add_argument("--db", default="/persistent/quotes.db", help="Path to the SQLite quote store")
+    parser.add_argument("--uploads", default="/persistent/uploads", help="Upload folder holding quote images")
+    parser.add_argument("--hours", type=float, default=EXPIRE_SECONDS / 3600, help="Expire sessions idle this long")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("expire", help="Remove abandoned uploads")
+    args = parser.parse_args(argv)
+
+    store = SQLiteQuoteStore(args.db)
+    blob_store = BlobStore(store, args.uploads)
+    sessions = UploadSessions(store, blob_store, expire_seconds=args.hours * 3600)
+    if args.command == "expire":
+        print(f"Removed {sessions.expire()} upload sessions")
+        # Photos of the expired sessions that no quote uses can go now
+        print(f"Removed {collect_all(blob_store)} unreferenced images")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import os
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class _ChunkSink:
+    """Write-only, unseekable file object that collects zip output chunks.
+
+    Because it cannot seek, zipfile writes sizes and CRCs in data
+    descriptors after each member instead of patching local headers.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+def iter_zip(files, compression=zipfile.ZIP_STORED, chunk_size=CHUNK_SIZE):
+    """Yield a zip archive of ``files`` chunk by chunk.
+
+    ``files`` is an iterable of (arcname, path) pairs. At most one chunk of
+    each file is held in memory, and the first bytes are produced before
+    later files are read. PDFs are already compressed, so members are
+    stored uncompressed by default.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression) as archive:
+        for arcname, path in files:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = compression
+            with open(path, "rb") as src, archive.open(info, "w") as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+def unique_arcnames(files):
+    """Pair each path with an archive name, suffixing repeated names.
+
+    ``files`` yields paths, archived under their basename, or (name, path)
+    pairs.
+    """
+    seen = {}
+    for item in files:
+        if isinstance(item, tuple):
+            name, path = item
+        else:
+            name, path = os.path.basename(item), item
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        if count:
+            stem, ext = os.path.splitext(name)
+            name = f"{stem}_{count + 1}{ext}"
+        yield name, path